@@ -0,0 +1,146 @@
+# nonebot_plugin_real_netizens\activity_tracker.py
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, Optional
+
+from nonebot.log import logger
+from nonebot_plugin_datastore import get_session
+
+from .db.database import get_last_message_times
+
+
+def to_unix_time(value: datetime) -> float:
+    """将数据库中的时间转换为时间戳，无时区信息的时间按 UTC 处理。"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+class IdleWatcher:
+    """
+    空闲观察者。
+
+    Attributes:
+        name: 观察者名称。
+        threshold: 根据群组 ID 返回空闲阈值（秒）的函数，返回 None 或非正数时该群组不设置定时器。
+        callback: 群组空闲超过阈值时调用的异步函数，接受一个参数：群组 ID。
+        timers: 每个群组当前挂起的定时器。
+    """
+
+    def __init__(self, name: str, threshold: Callable[[int], Optional[float]],
+                 callback: Callable[[int], Awaitable[None]]):
+        self.name = name
+        self.threshold = threshold
+        self.callback = callback
+        self.timers: Dict[int, asyncio.TimerHandle] = {}
+
+
+class ActivityTracker:
+    """
+    群聊活跃度追踪器。
+
+    在内存中记录每个群组的最后活跃时间，消息入库时更新；
+    每个空闲观察者为每个群组维护一个定时器，恰好在超过阈值时触发，无需周期性扫描。
+    """
+
+    def __init__(self):
+        self.last_activity: Dict[int, float] = {}
+        self.watchers: Dict[str, IdleWatcher] = {}
+
+    def add_idle_watcher(self, name: str, threshold: Callable[[int], Optional[float]],
+                         callback: Callable[[int], Awaitable[None]]):
+        """
+        注册空闲观察者，并为已知活跃时间的群组设置定时器。
+
+        Args:
+            name: 观察者名称，重复注册会替换旧的观察者。
+            threshold: 根据群组 ID 返回空闲阈值（秒）的函数，返回 None 或非正数时该群组不设置定时器。
+            callback: 空闲超过阈值时调用的异步函数。
+        """
+        self.remove_idle_watcher(name)
+        watcher = IdleWatcher(name, threshold, callback)
+        self.watchers[name] = watcher
+        for group_id in self.last_activity:
+            self._arm(watcher, group_id)
+
+    def remove_idle_watcher(self, name: str):
+        """移除空闲观察者并取消其所有定时器。"""
+        watcher = self.watchers.pop(name, None)
+        if watcher:
+            for handle in watcher.timers.values():
+                handle.cancel()
+            watcher.timers.clear()
+
+    async def load(self):
+        """
+        启动时用一次 GROUP BY 查询载入各群组最后消息时间。
+        """
+        try:
+            async with get_session() as session:
+                last_times = await get_last_message_times(session)
+        except Exception as e:
+            logger.error(f"Failed to load last message times: {e}")
+            return
+        for group_id, last_time in last_times.items():
+            # 启动期间已有新消息的群组以内存记录为准
+            timestamp = max(to_unix_time(last_time),
+                            self.last_activity.get(group_id, 0))
+            self.touch(group_id, timestamp)
+        logger.info(f"Activity tracker loaded {len(last_times)} groups")
+
+    def touch(self, group_id: int, timestamp: Optional[float] = None):
+        """
+        记录群组活跃，并重置该群组的所有空闲定时器。
+
+        Args:
+            group_id: 群组 ID。
+            timestamp: 活跃时间戳，默认为当前时间。
+        """
+        self.last_activity[group_id] = timestamp if timestamp is not None else time.time()
+        for watcher in self.watchers.values():
+            self._arm(watcher, group_id)
+
+    def get_last_activity(self, group_id: int) -> Optional[float]:
+        """获取群组最后活跃的时间戳，未知时返回 None。"""
+        return self.last_activity.get(group_id)
+
+    def reschedule(self, group_id: int):
+        """
+        群组阈值变化时重新计算定时器，可作为 group_config_manager 的观察者。
+        """
+        if group_id in self.last_activity:
+            for watcher in self.watchers.values():
+                self._arm(watcher, group_id)
+
+    def _arm(self, watcher: IdleWatcher, group_id: int):
+        handle = watcher.timers.pop(group_id, None)
+        if handle:
+            handle.cancel()
+        try:
+            threshold = watcher.threshold(group_id)
+        except Exception as e:
+            logger.error(
+                f"Failed to get idle threshold '{watcher.name}' for group {group_id}: {e}")
+            return
+        if not threshold or threshold <= 0:
+            return
+        delay = max(0.0, self.last_activity[group_id] + threshold - time.time())
+        loop = asyncio.get_event_loop()
+        watcher.timers[group_id] = loop.call_later(
+            delay, self._fire, watcher, group_id)
+
+    def _fire(self, watcher: IdleWatcher, group_id: int):
+        # 触发后不再重新计时，直到群组再次活跃
+        watcher.timers.pop(group_id, None)
+        asyncio.ensure_future(self._run_callback(watcher, group_id))
+
+    async def _run_callback(self, watcher: IdleWatcher, group_id: int):
+        try:
+            await watcher.callback(group_id)
+        except Exception as e:
+            logger.error(
+                f"Idle watcher '{watcher.name}' failed for group {group_id}: {e}")
+
+
+activity_tracker = ActivityTracker()
@@ -1,5 +1,6 @@
 # nonebot_plugin_real_netizens\admin_commands.py
-from typing import List
+from datetime import datetime
+from typing import List, Optional
 
 from nonebot import on_command, require
 from nonebot.adapters.onebot.v11 import Bot, GroupMessageEvent, MessageSegment
@@ -9,6 +10,7 @@ from nonebot.rule import to_me
 from nonebot_plugin_txt2img import Txt2Img
 
 from .character_manager import character_manager
+from .db.data_transfer import export_data, import_data
 from .group_config_manager import group_config_manager
 from .memory_manager import memory_manager
 
@@ -25,6 +27,8 @@ admin_commands = {
     "恢复印象": on_command("恢复印象", permission=SUPERUSER, priority=5),
     "查看印象": on_command("查看印象", permission=SUPERUSER, priority=5),
     "更新印象": on_command("更新印象", permission=SUPERUSER, priority=5),
+    "导出数据": on_command("导出数据", permission=SUPERUSER, priority=5),
+    "导入数据": on_command("导入数据", permission=SUPERUSER, priority=5),
 }
 # 通用的参数检查函数
 
@@ -42,12 +46,33 @@ async def handle_list_presets(bot: Bot, event: GroupMessageEvent):
     return message
 
 
+def parse_list(value: str, usage: str) -> List[str]:
+    """解析逗号分隔的参数列表，兼容中文逗号"""
+    items = [item.strip() for item in value.replace("，", ",").split(",") if item.strip()]
+    if not items:
+        raise ValueError(f"参数不能为空。使用方法：{usage}")
+    return items
+
+
+def parse_group_ids(value: str, usage: str) -> List[int]:
+    """解析逗号分隔的群号列表"""
+    try:
+        return [int(group_id) for group_id in parse_list(value, usage)]
+    except ValueError:
+        raise ValueError(f"无效的群号列表 '{value}'。使用方法：{usage}")
+
+
+def format_groups(group_ids: List[int]) -> str:
+    return "、".join(str(group_id) for group_id in group_ids)
+
+
 async def handle_switch_preset(bot: Bot, event: GroupMessageEvent):
     args = str(event.get_message()).strip().split()
-    check_args(args, 3, "切换预设 <目标群号> <预设名称>")
-    group_id, preset_name = int(args[1]), args[2]
-    if await group_config_manager.set_preset(group_id, preset_name):
-        return f"成功为群 {group_id} 切换到预设：{preset_name}"
+    usage = "切换预设 <目标群号[,群号...]> <预设名称>"
+    check_args(args, 3, usage)
+    group_ids, preset_name = parse_group_ids(args[1], usage), args[2]
+    if await group_config_manager.set_preset_for_groups(group_ids, preset_name):
+        return f"成功为群 {format_groups(group_ids)} 切换到预设：{preset_name}"
     else:
         return f"切换预设失败，请检查群号和预设名称是否正确"
 
@@ -60,30 +85,36 @@ async def handle_list_worldbooks(bot: Bot, event: GroupMessageEvent):
 
 async def handle_enable_worldbook(bot: Bot, event: GroupMessageEvent):
     args = str(event.get_message()).strip().split()
-    check_args(args, 3, "启用世界书 <目标群号> <世界书名称>")
-    group_id, worldbook_name = int(args[1]), args[2]
-    if await group_config_manager.enable_worldbook(group_id, worldbook_name):
-        return f"成功为群 {group_id} 启用世界书：{worldbook_name}"
+    usage = "启用世界书 <目标群号[,群号...]> <世界书名称[,名称...]>"
+    check_args(args, 3, usage)
+    group_ids, worldbook_names = parse_group_ids(args[1], usage), parse_list(args[2], usage)
+    missing = group_config_manager.missing_worldbooks(worldbook_names)
+    if missing:
+        return f"启用世界书失败，找不到世界书：{', '.join(missing)}"
+    if await group_config_manager.enable_worldbooks(group_ids, worldbook_names):
+        return f"成功为群 {format_groups(group_ids)} 启用世界书：{', '.join(worldbook_names)}"
     else:
         return f"启用世界书失败，请检查群号和世界书名称是否正确"
 
 
 async def handle_disable_worldbook(bot: Bot, event: GroupMessageEvent):
     args = str(event.get_message()).strip().split()
-    check_args(args, 3, "禁用世界书 <目标群号> <世界书名称>")
-    group_id, worldbook_name = int(args[1]), args[2]
-    if await group_config_manager.disable_worldbook(group_id, worldbook_name):
-        return f"成功为群 {group_id} 禁用世界书：{worldbook_name}"
+    usage = "禁用世界书 <目标群号[,群号...]> <世界书名称[,名称...]>"
+    check_args(args, 3, usage)
+    group_ids, worldbook_names = parse_group_ids(args[1], usage), parse_list(args[2], usage)
+    if await group_config_manager.disable_worldbooks(group_ids, worldbook_names):
+        return f"成功为群 {format_groups(group_ids)} 禁用世界书：{', '.join(worldbook_names)}"
     else:
         return f"禁用世界书失败，请检查群号和世界书名称是否正确"
 
 
 async def handle_set_character(bot: Bot, event: GroupMessageEvent):
     args = str(event.get_message()).strip().split()
-    check_args(args, 3, "设置角色卡 <目标群号> <角色名称>")
-    group_id, character_name = int(args[1]), args[2]
-    if await group_config_manager.set_character(group_id, character_name):
-        return f"成功为群 {group_id} 设置角色卡：{character_name}"
+    usage = "设置角色卡 <目标群号[,群号...]> <角色名称>"
+    check_args(args, 3, usage)
+    group_ids, character_name = parse_group_ids(args[1], usage), args[2]
+    if await group_config_manager.set_character_for_groups(group_ids, character_name):
+        return f"成功为群 {format_groups(group_ids)} 设置角色卡：{character_name}"
     else:
         return f"设置角色卡失败，请检查群号和角色名称是否正确"
 
@@ -134,6 +165,43 @@ async def handle_update_impression(bot: Bot, event: GroupMessageEvent):
         args[1]), int(args[2]), args[3], args[4]
     await memory_manager.update_impression(group_id, user_id, character_id, new_impression)
     return f"已更新群 {group_id} 中用户 {user_id} 对角色 {character_id} 的印象"
+
+
+def parse_date(value: str) -> Optional[datetime]:
+    """解析日期参数，按本地时间处理，"-" 表示不限制"""
+    if value == "-":
+        return None
+    try:
+        return datetime.fromisoformat(value).astimezone()
+    except ValueError:
+        raise ValueError(f"无效的日期 '{value}'，请使用 YYYY-MM-DD 格式")
+
+
+async def handle_export_data(bot: Bot, event: GroupMessageEvent):
+    args = str(event.get_message()).strip().split()
+    usage = "导出数据 <文件路径> [群号,群号|全部] [起始日期|-] [结束日期|-]"
+    if not 2 <= len(args) <= 5:
+        raise ValueError(f"参数数量不正确。使用方法：{usage}")
+    path = args[1]
+    group_ids = None
+    if len(args) > 2 and args[2] != "全部":
+        group_ids = parse_group_ids(args[2], usage)
+    since = parse_date(args[3]) if len(args) > 3 else None
+    until = parse_date(args[4]) if len(args) > 4 else None
+    # 同一路径存在未完成的导出时从中断处继续
+    counts = await export_data(path, group_ids, since, until, resume=True)
+    summary = "\n".join(f"{name}: {count}" for name, count in counts.items())
+    return f"已导出到 {path}：\n{summary}"
+
+
+async def handle_import_data(bot: Bot, event: GroupMessageEvent):
+    args = str(event.get_message()).strip().split()
+    check_args(args, 2, "导入数据 <文件路径>")
+    path = args[1]
+    # 同一文件存在未完成的导入时从中断处继续
+    counts = await import_data(path, resume=True)
+    summary = "\n".join(f"{name}: {count}" for name, count in counts.items())
+    return f"已从 {path} 导入（已存在的记录会被跳过）：\n{summary}"
 # 主要的命令处理函数
 
 
@@ -162,6 +230,10 @@ async def handle_admin_command(bot: Bot, event: GroupMessageEvent, args: list):
             return await handle_view_impression(bot, event)
         elif command == "更新印象":
             return await handle_update_impression(bot, event)
+        elif command == "导出数据":
+            return await handle_export_data(bot, event)
+        elif command == "导入数据":
+            return await handle_import_data(bot, event)
         else:
             return f"未知的命令：{command}"
     except ValueError as e:
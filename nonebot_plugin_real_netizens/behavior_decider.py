@@ -1,6 +1,6 @@
 # nonebot_plugin_real_netizens\behavior_decider.py
 import json
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 from nonebot.log import logger
 
@@ -11,7 +11,8 @@ from .memory_manager import memory_manager
 from .message_builder import MessageBuilder
 
 
-async def decide_behavior(message: str, recent_messages: List[Dict], message_builder: MessageBuilder, user_id: int, group_id: int) -> Dict:
+async def decide_behavior(message: str, recent_messages: List[Dict], message_builder: MessageBuilder, user_id: int, group_id: int,
+                          chat_summary: Optional[str] = None) -> Dict:
     """
     根据角色设定、用户印象和最近的对话历史，决定是否回复消息以及回复类型。
     Args:
@@ -20,6 +21,7 @@ async def decide_behavior(message: str, recent_messages: List[Dict], message_bui
         message_builder: 消息构建器.
         user_id: 用户ID.
         group_id: 群ID.
+        chat_summary: 较早聊天记录的滚动摘要.
     Returns:
         包含决策结果的字典，例如：
         {
@@ -39,6 +41,7 @@ async def decide_behavior(message: str, recent_messages: List[Dict], message_bui
         "user_id": user_id,
         "message": message,
         "recent_messages": recent_messages,
+        "chat_summary": chat_summary,
         "character_info": character_info,
         "user_impression": await memory_manager.get_impression(group_id, user_id, character_info['character_id']),  # type: ignore
     }
@@ -0,0 +1,129 @@
+# nonebot_plugin_real_netizens\cache_snapshot.py
+import asyncio
+import os
+import pickle
+import struct
+import time
+import zlib
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from nonebot.log import logger
+
+from .config import plugin_config
+
+# 文件头：魔数、格式版本、写入时间
+SNAPSHOT_MAGIC = b"RNSNAP"
+SNAPSHOT_VERSION = 1
+HEADER = struct.Struct("<6sHd")
+
+DumpFunc = Callable[[], Any]
+LoadFunc = Callable[[Any], Awaitable[None]]
+
+
+class CacheSnapshot:
+    """
+    内存缓存快照。
+
+    各模块通过 register 注册自己的导出和恢复函数。导出函数在事件循环中同步执行，
+    应返回缓存的浅拷贝；恢复函数负责与数据库核对一致性，只恢复仍然有效的部分。
+    快照以 pickle 序列化后 zlib 压缩，先写临时文件再替换，写入中断不会损坏旧快照。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.providers: Dict[str, Tuple[DumpFunc, LoadFunc]] = {}
+        # 在 save 中创建：Python 3.8/3.9 的 Lock 在创建时绑定事件循环，模块导入时循环尚未运行
+        self._lock: Optional[asyncio.Lock] = None
+
+    def register(self, name: str, dump: DumpFunc, load: LoadFunc):
+        """
+        注册一个缓存。
+
+        Args:
+            name (str): 缓存名称，作为快照中的键。
+            dump (DumpFunc): 导出缓存数据的函数。
+            load (LoadFunc): 用快照数据恢复缓存的异步函数。
+        """
+        self.providers[name] = (dump, load)
+
+    async def save(self) -> int:
+        """
+        保存快照。
+
+        Returns:
+            写入的字节数，失败时返回 0。
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            data = {}
+            for name, (dump, _) in self.providers.items():
+                try:
+                    data[name] = dump()
+                except Exception as e:
+                    logger.error(f"Error dumping cache {name}: {e}")
+            try:
+                size = await asyncio.get_running_loop().run_in_executor(None, self._write, data)
+            except Exception as e:
+                logger.error(f"Error saving cache snapshot: {e}")
+                return 0
+            logger.debug(f"Cache snapshot saved: {size} bytes, {len(data)} caches")
+            return size
+
+    def _write(self, data: Dict[str, Any]) -> int:
+        payload = zlib.compress(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL), 1)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, time.time()))
+            f.write(payload)
+        os.replace(tmp_path, self.path)
+        return HEADER.size + len(payload)
+
+    def _read(self, max_age: float) -> Optional[Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, "rb") as f:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return None
+            magic, version, created_at = HEADER.unpack(header)
+            if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+                logger.warning(f"Ignoring cache snapshot with unknown format: {self.path}")
+                return None
+            if max_age > 0 and time.time() - created_at > max_age:
+                logger.info("Ignoring expired cache snapshot")
+                return None
+            return pickle.loads(zlib.decompress(f.read()))
+
+    async def restore(self, max_age: float = 0) -> List[str]:
+        """
+        读取快照并交给各缓存的恢复函数。
+
+        Args:
+            max_age (float): 快照的最长有效期（秒），0 表示不限制。
+
+        Returns:
+            成功恢复的缓存名称列表。
+        """
+        try:
+            data = await asyncio.get_running_loop().run_in_executor(None, self._read, max_age)
+        except Exception as e:
+            logger.error(f"Error reading cache snapshot: {e}")
+            return []
+        if not data:
+            return []
+        restored = []
+        for name, (_, load) in self.providers.items():
+            if name not in data:
+                continue
+            try:
+                await load(data[name])
+                restored.append(name)
+            except Exception as e:
+                logger.error(f"Error restoring cache {name}: {e}")
+        logger.info(f"Restored caches from snapshot: {', '.join(restored) or 'none'}")
+        return restored
+
+
+cache_snapshot = CacheSnapshot(plugin_config.CACHE_SNAPSHOT_PATH)
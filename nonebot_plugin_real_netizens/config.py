@@ -60,6 +60,111 @@ class Config(BaseSettings):
         default=512,
         description="发送给 LLM 的图片最大尺寸（像素）, 建议不超过 1024"
     )
+    IMAGE_ADAPTIVE_ENCODING: bool = Field(
+        default=True,
+        description="是否按图片类别（表情包、截图、照片）和 VL 模型的 token 计费方式自动选择尺寸、质量和格式，"
+                    "关闭时统一缩放到 MAX_IMAGE_SIZE 并编码为 JPEG"
+    )
+    IMAGE_WORKER_TYPE: str = Field(
+        default="thread",
+        description="图片解码、缩放和编码使用的工作池类型：thread 或 process"
+    )
+    IMAGE_WORKERS: int = Field(
+        default=0,
+        description="图片工作池的并发数，0 表示取 CPU 核数与 4 中较小者",
+        ge=0
+    )
+    IMAGE_QUEUE_SIZE: int = Field(
+        default=32,
+        description="图片工作池同时提交的最大任务数，超出的任务排队等待",
+        ge=1
+    )
+    IMAGE_JOB_TIMEOUT: float = Field(
+        default=30,
+        description="单个图片任务排队和执行的最长时间（秒）",
+        gt=0
+    )
+    IMAGE_PHASH_THRESHOLD: int = Field(
+        default=4,
+        description="近似重复图片的感知哈希最大汉明距离（0-15），在此范围内直接复用已有描述，-1 表示关闭",
+        ge=-1, le=15
+    )
+    IMAGE_CACHE_SIZE: int = Field(
+        default=4096,
+        description="内存中缓存的图片识别结果条数，0 表示关闭",
+        ge=0
+    )
+    IMAGE_CACHE_WARM_UP: int = Field(
+        default=1000,
+        description="启动时预加载的最近图片识别结果条数",
+        ge=0
+    )
+    IMAGE_NEGATIVE_TTL: int = Field(
+        default=3600,
+        description="识别失败的图片在多长时间内不再重试（秒），0 表示不缓存失败",
+        ge=0
+    )
+    IMAGE_DOWNLOAD_MAX_BYTES: int = Field(
+        default=10 * 1024 * 1024,
+        description="单张图片的最大下载字节数，超过时中止下载",
+        gt=0
+    )
+    IMAGE_DOWNLOAD_TIMEOUT: float = Field(
+        default=20,
+        description="单张图片下载的超时时间（秒）",
+        gt=0
+    )
+    IMAGE_DOWNLOAD_CONCURRENCY: int = Field(
+        default=16,
+        description="图片下载的最大并发连接数",
+        ge=1
+    )
+    IMAGE_DOWNLOAD_PER_HOST: int = Field(
+        default=4,
+        description="对同一主机的最大并发连接数",
+        ge=1
+    )
+    IMAGE_MESSAGE_CONCURRENCY: int = Field(
+        default=4,
+        description="同一条消息中同时处理的图片数",
+        ge=1
+    )
+    IMAGE_MESSAGE_DEADLINE: float = Field(
+        default=8,
+        description="等待一条消息中图片识别的最长时间（秒），超时的图片先用占位符代替，"
+                    "识别完成后补写到已保存的消息中；0 表示等待全部图片",
+        ge=0
+    )
+    IMAGE_CAPTION_MODE: str = Field(
+        default="lazy",
+        description="图片识别时机：eager 收到图片时立即识别；lazy 只保存图片引用，"
+                    "在消息进入提示词（回复、摘要、检索）时才识别，其余图片由后台在空闲时补齐"
+    )
+    IMAGE_CAPTION_IDLE_SECONDS: float = Field(
+        default=60,
+        description="lazy 模式下距离上次按需识别多久（秒）后，后台开始补齐图片描述",
+        ge=0
+    )
+    IMAGE_CAPTION_INTERVAL: float = Field(
+        default=5,
+        description="后台补齐图片描述时两次识别之间的间隔（秒）",
+        ge=0
+    )
+    IMAGE_CAPTION_TIMEOUT: float = Field(
+        default=20,
+        description="构建提示词时等待图片识别的最长时间（秒），超时的图片不附带描述",
+        gt=0
+    )
+    IMAGE_CAPTION_BATCH_SIZE: int = Field(
+        default=4,
+        description="一次多模态请求最多识别的图片数，同时等待识别的图片合并为一次请求，1 表示不合并",
+        ge=1, le=16
+    )
+    IMAGE_CAPTION_BATCH_WAIT: float = Field(
+        default=0.2,
+        description="合并识别请求时等待更多图片的最长时间（秒）",
+        ge=0
+    )
 
     # --- 触发配置 ---
     TRIGGER_PROBABILITY: float = Field(
@@ -75,9 +180,69 @@ class Config(BaseSettings):
         default=30,
         description="保留的上下文消息数量"
     )
+    SUMMARY_ENABLED: bool = Field(
+        default=True,
+        description="是否在群聊空闲时将较早的聊天记录折叠为滚动摘要"
+    )
+    SUMMARY_IDLE_SECONDS: int = Field(
+        default=300,
+        description="群聊空闲多久后开始折叠摘要（秒）"
+    )
+    SUMMARY_WINDOW: int = Field(
+        default=50,
+        description="每次折叠进摘要的消息条数上限"
+    )
+    SUMMARY_MIN_MESSAGES: int = Field(
+        default=20,
+        description="待折叠消息少于该条数时不进行折叠"
+    )
+    SUMMARY_TAIL_COUNT: int = Field(
+        default=15,
+        description="折叠时保留在摘要之外的最新原始消息条数"
+    )
+    SUMMARY_MAX_WINDOWS: int = Field(
+        default=5,
+        description="每次空闲期最多折叠的窗口数"
+    )
+    SUMMARY_MAX_CHARS: int = Field(
+        default=800,
+        description="滚动摘要的最大字数"
+    )
     CHAT_HISTORY_LIMIT: int = Field(
         default=3000,
-        description="聊天历史记录最大保存条数"
+        description="每个群聊历史记录最大保存条数（0 表示不限制）"
+    )
+    MESSAGE_RETENTION_DAYS: int = Field(
+        default=30,
+        description="聊天记录最长保存天数（0 表示不限制）"
+    )
+    RETENTION_BATCH_SIZE: int = Field(
+        default=500,
+        description="清理聊天记录时每批删除的条数"
+    )
+    RETENTION_BATCH_PAUSE: float = Field(
+        default=0.05,
+        description="清理聊天记录时两批之间的暂停时间（秒）"
+    )
+    RETENTION_MAX_BATCHES: int = Field(
+        default=200,
+        description="每轮清理最多执行的批次数，未清理完的部分留到下一轮"
+    )
+    RETENTION_INTERVAL: int = Field(
+        default=10,
+        description="聊天记录清理任务的执行间隔（分钟）"
+    )
+    MESSAGE_ARCHIVE_ENABLED: bool = Field(
+        default=True,
+        description="清理聊天记录时是否压缩归档而不是直接删除"
+    )
+    ARCHIVE_CODEC: str = Field(
+        default="zlib",
+        description="归档压缩算法（zlib 或 zstd，zstd 需要安装 zstandard）"
+    )
+    ARCHIVE_COMPRESSION_LEVEL: int = Field(
+        default=6,
+        description="归档压缩级别（zlib 为 1-9，zstd 为 1-22）"
     )
 
     # --- 用户和群组配置 ---
@@ -111,6 +276,10 @@ class Config(BaseSettings):
         default="data/images",
         description="图片保存路径"
     )
+    IMAGE_SAVE_ENABLED: bool = Field(
+        default=True,
+        description="是否将下载的图片保存到 IMAGE_SAVE_PATH，保存在后台进行，不影响识别"
+    )
 
     # --- 默认资源配置 ---
     DEFAULT_WORLDBOOK: str = Field(
@@ -137,10 +306,106 @@ class Config(BaseSettings):
         default="sqlite:///friend_bot.db", env="DATABASE_URL",
         description="数据库连接URL"
     )
+    SQLITE_TUNING: bool = Field(
+        default=True,
+        description="使用 SQLite 时是否在初始化数据库时应用性能配置"
+    )
+    SQLITE_JOURNAL_MODE: str = Field(
+        default="WAL",
+        description="SQLite 日志模式，WAL 允许读写并发"
+    )
+    SQLITE_SYNCHRONOUS: str = Field(
+        default="NORMAL",
+        description="SQLite 同步级别，WAL 模式下 NORMAL 可安全减少 fsync"
+    )
+    SQLITE_MMAP_SIZE: int = Field(
+        default=268435456,
+        description="SQLite 内存映射大小（字节），0 表示关闭"
+    )
+    SQLITE_CACHE_SIZE: int = Field(
+        default=-65536,
+        description="SQLite 页缓存大小，负数表示 KiB"
+    )
+    SQLITE_BUSY_TIMEOUT: int = Field(
+        default=5000,
+        description="SQLite 等待写锁的超时时间（毫秒）"
+    )
+    MESSAGE_FTS_ENABLED: bool = Field(
+        default=True,
+        description="使用 SQLite 时是否为聊天记录建立 FTS5 全文索引"
+    )
+    RELATED_HISTORY_COUNT: int = Field(
+        default=3,
+        description="回复时注入的相关历史聊天条数（0 表示关闭）"
+    )
+    SEMANTIC_MEMORY_ENABLED: bool = Field(
+        default=True,
+        description="是否启用本地语义记忆（哈希向量化检索）"
+    )
+    SEMANTIC_INDEX_PATH: str = Field(
+        default="data/semantic_index",
+        description="语义记忆向量索引的保存目录"
+    )
+    SEMANTIC_DIM: int = Field(
+        default=256,
+        description="语义记忆向量维度，修改后需删除已有索引"
+    )
+    SEMANTIC_MIN_SCORE: float = Field(
+        default=0.15,
+        description="语义检索结果的最低相似度（0.0-1.0）"
+    )
+    SQLITE_MAINTENANCE_INTERVAL: int = Field(
+        default=60,
+        description="SQLite WAL 检查点与 optimize 的执行间隔（分钟），0 表示关闭"
+    )
     INACTIVE_THRESHOLD: int = Field(
         default=3600,
         description="群聊不活跃阈值（秒）"
     )
+    IMPRESSION_FLUSH_INTERVAL: int = Field(
+        default=10,
+        description="印象更新队列批量写入数据库的间隔（秒）"
+    )
+    PROFILE_CACHE_TTL: int = Field(
+        default=3600,
+        description="用户资料缓存的有效期（秒），过期后重新拉取用户资料"
+    )
+    PROFILE_CACHE_SIZE: int = Field(
+        default=10000,
+        description="用户资料缓存的最大条数"
+    )
+    PROFILE_REFRESH_INTERVAL: int = Field(
+        default=30,
+        description="后台同步用户资料与最后发言的间隔（秒）"
+    )
+    AVATAR_CAPTION_INTERVAL: float = Field(
+        default=10.0,
+        description="两次头像描述之间的最小间隔（秒），与聊天图片识别分开限速"
+    )
+    AVATAR_RECHECK_INTERVAL: int = Field(
+        default=86400,
+        description="头像地址未变化时重新检查头像内容的间隔（秒）"
+    )
+    AVATAR_QUEUE_SIZE: int = Field(
+        default=1000,
+        description="头像描述后台队列的最大长度"
+    )
+    CACHE_SNAPSHOT_ENABLED: bool = Field(
+        default=True,
+        description="是否在关闭时保存内存缓存快照，并在启动时恢复"
+    )
+    CACHE_SNAPSHOT_PATH: str = Field(
+        default="data/cache_snapshot.bin",
+        description="缓存快照文件路径"
+    )
+    CACHE_SNAPSHOT_INTERVAL: int = Field(
+        default=10,
+        description="定期保存缓存快照的间隔（分钟），0 表示只在关闭时保存"
+    )
+    CACHE_SNAPSHOT_MAX_AGE: int = Field(
+        default=86400,
+        description="缓存快照的最长有效期（秒），更旧的快照启动时直接忽略"
+    )
     CACHE_EXPIRY_TIME: int = Field(
         default=1800,
         description="缓存过期时间（秒）(未实装)"
@@ -0,0 +1,201 @@
+# nonebot_plugin_real_netizens\db\archive.py
+import json
+import zlib
+from datetime import date, datetime, timedelta, timezone
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from nonebot.log import logger
+from sqlalchemy import and_, delete, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import plugin_config
+from .database import get_overflow_boundary
+from .models import Message, MessageArchive
+from .unit_of_work import commit_or_flush
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+_zstd_warned = False
+
+
+def get_codec() -> str:
+    """获取配置的压缩算法，未安装 zstandard 时退回 zlib"""
+    global _zstd_warned
+    codec = plugin_config.ARCHIVE_CODEC
+    if codec == "zstd" and zstandard is None:
+        if not _zstd_warned:
+            logger.warning("zstandard is not installed, archiving with zlib instead")
+            _zstd_warned = True
+        return "zlib"
+    return codec if codec in ("zlib", "zstd") else "zlib"
+
+
+def compress(data: bytes, codec: str, level: int) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    return zlib.compress(data, level)
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read zstd archives")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def _as_utc(value: datetime) -> datetime:
+    # SQLite 读出的时间不带时区，存入时均为 UTC
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+def encode_messages(messages: List[Message], codec: str, level: int) -> bytes:
+    """将消息编码为压缩的 JSON 数组，每条为 [id, user_id, unix 时间戳, 内容]"""
+    rows = [
+        [msg.id, msg.user_id, _as_utc(msg.timestamp).timestamp() if msg.timestamp else None, msg.content]
+        for msg in messages
+    ]
+    payload = json.dumps(rows, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return compress(payload, codec, level)
+
+
+def decode_archive(archive: MessageArchive) -> List[Dict]:
+    """解压一个归档块，返回按 ID 升序的消息字典列表"""
+    rows = json.loads(decompress(archive.data, archive.codec))
+    return [
+        {
+            "id": message_id,
+            "group_id": archive.group_id,
+            "user_id": user_id,
+            "content": content,
+            "timestamp": datetime.fromtimestamp(ts, timezone.utc) if ts is not None else None,
+        }
+        for message_id, user_id, ts, content in rows
+    ]
+
+
+async def archive_messages(session: AsyncSession, messages: List[Message]) -> int:
+    """
+    将消息按群组和日期（UTC）压缩写入归档表，并从消息表中删除。
+
+    Returns:
+        归档的消息条数。
+    """
+    if not messages:
+        return 0
+    codec = get_codec()
+    level = plugin_config.ARCHIVE_COMPRESSION_LEVEL
+    chunks: Dict[Tuple[int, date], List[Message]] = {}
+    for msg in messages:
+        day = _as_utc(msg.timestamp).date() if msg.timestamp else date.min
+        chunks.setdefault((msg.group_id, day), []).append(msg)
+    for (group_id, day), rows in chunks.items():
+        rows.sort(key=lambda msg: msg.id)
+        session.add(MessageArchive(
+            group_id=group_id,
+            day=day,
+            first_message_id=rows[0].id,
+            last_message_id=rows[-1].id,
+            message_count=len(rows),
+            codec=codec,
+            data=encode_messages(rows, codec, level),
+        ))
+    ids = [msg.id for msg in messages]
+    await session.execute(
+        delete(Message).where(Message.id.in_(ids)).execution_options(synchronize_session=False))
+    await commit_or_flush(session)
+    return len(ids)
+
+
+async def archive_old_messages(session: AsyncSession, days: int, batch_size: int) -> int:
+    """
+    归档最旧的一批早于指定天数的消息。
+
+    Returns:
+        归档的消息条数，小于 batch_size 表示已没有需要归档的消息。
+    """
+    cutoff_date = datetime.now(timezone.utc) - timedelta(days=days)
+    result = await session.execute(
+        select(Message)
+        .where(Message.timestamp < cutoff_date)
+        .order_by(Message.id)
+        .limit(batch_size)
+    )
+    return await archive_messages(session, list(result.scalars().all()))
+
+
+async def archive_group_overflow_messages(
+    session: AsyncSession, group_id: int, keep: int, batch_size: int
+) -> int:
+    """
+    归档群组中超出保留条数的最旧消息，每次最多 batch_size 条。
+
+    Returns:
+        归档的消息条数，为 0 表示该群组已不超出限制。
+    """
+    boundary = await get_overflow_boundary(session, group_id, keep)
+    if boundary is None:
+        return 0
+    result = await session.execute(
+        select(Message)
+        .where(Message.group_id == group_id, Message.id <= boundary)
+        .order_by(Message.id)
+        .limit(batch_size)
+    )
+    return await archive_messages(session, list(result.scalars().all()))
+
+
+async def iter_archived_messages(
+    session: AsyncSession,
+    group_id: int,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+) -> AsyncIterator[Dict]:
+    """
+    按时间顺序流式读取群组的归档消息，每次只解压一个归档块。
+
+    Args:
+        start (Optional[datetime]): 只返回不早于此时间的消息。
+        end (Optional[datetime]): 只返回早于此时间的消息。
+    """
+    stmt = select(MessageArchive).where(MessageArchive.group_id == group_id)
+    if start is not None:
+        start = _as_utc(start)
+        stmt = stmt.where(MessageArchive.day >= start.date())
+    if end is not None:
+        end = _as_utc(end)
+        stmt = stmt.where(MessageArchive.day <= end.date())
+    stmt = stmt.order_by(MessageArchive.first_message_id).execution_options(yield_per=20)
+    result = await session.stream_scalars(stmt)
+    async for archive in result:
+        for message in decode_archive(archive):
+            timestamp = message["timestamp"]
+            if start is not None and (timestamp is None or timestamp < start):
+                continue
+            if end is not None and (timestamp is None or timestamp >= end):
+                continue
+            yield message
+
+
+async def get_archived_messages_by_ids(
+    session: AsyncSession, group_id: int, ids: List[int]
+) -> Dict[int, Dict]:
+    """根据消息 ID 从归档中取回消息，只解压包含这些 ID 的归档块"""
+    if not ids:
+        return {}
+    wanted = set(ids)
+    stmt = select(MessageArchive).where(
+        MessageArchive.group_id == group_id,
+        or_(*(and_(MessageArchive.first_message_id <= message_id,
+                   MessageArchive.last_message_id >= message_id) for message_id in wanted)),
+    )
+    result = await session.execute(stmt)
+    found: Dict[int, Dict] = {}
+    for archive in result.scalars().all():
+        for message in decode_archive(archive):
+            if message["id"] in wanted:
+                found[message["id"]] = message
+    return found
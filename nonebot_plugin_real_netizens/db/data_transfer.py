@@ -0,0 +1,371 @@
+# nonebot_plugin_real_netizens\db\data_transfer.py
+import asyncio
+import gzip
+import json
+import os
+from datetime import date, datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from nonebot.log import logger
+from sqlalchemy import Date, DateTime, LargeBinary, select, text, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .archive import decode_archive
+from .database import get_upsert_insert
+from .models import (
+    ConversationSummary,
+    Group,
+    GroupConfig,
+    GroupUser,
+    GroupWorldbook,
+    Image,
+    ImageFileAlias,
+    Impression,
+    Message,
+    MessageArchive,
+    User,
+)
+from .unit_of_work import use_session
+
+EXPORT_FORMAT = "real_netizens"
+EXPORT_VERSION = 1
+
+# 导出顺序即导入顺序，被外键引用的表在前
+SECTIONS: List[Tuple[str, Any]] = [
+    ("user", User),
+    ("group", Group),
+    ("group_user", GroupUser),
+    ("group_config", GroupConfig),
+    ("group_worldbook", GroupWorldbook),
+    ("image", Image),
+    ("impression", Impression),
+    ("summary", ConversationSummary),
+    ("message", Message),
+    # 归档消息展开为普通的 message 记录
+    ("archived_message", MessageArchive),
+    # 追加在末尾，不影响已有导出进度中的分段序号
+    ("image_alias", ImageFileAlias),
+]
+MODELS: Dict[str, Any] = {name: model for name, model in SECTIONS if model is not MessageArchive}
+# 导入后需要重置自增序列的表（PostgreSQL）
+SERIAL_MODELS = [GroupWorldbook, Image, Impression, Message]
+
+
+def _columns(model) -> list:
+    return [column for column in model.__table__.columns if not isinstance(column.type, LargeBinary)]
+
+
+def _to_json(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def _to_naive_utc(value: datetime) -> datetime:
+    # 数据库中的时间均按不带时区的 UTC 保存
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def serialize_row(name: str, model, row) -> Dict:
+    """将 ORM 对象转换为一条导出记录"""
+    record = {"_type": name}
+    for column in _columns(model):
+        record[column.name] = _to_json(getattr(row, column.key))
+    return record
+
+
+def deserialize_record(model, record: Dict) -> Dict:
+    """将一条导出记录转换为可插入的列字典，忽略模型中不存在的字段"""
+    row = {}
+    for column in _columns(model):
+        if column.name not in record:
+            continue
+        value = record[column.name]
+        if value is not None and isinstance(column.type, DateTime):
+            value = _to_naive_utc(datetime.fromisoformat(value))
+        elif value is not None and isinstance(column.type, Date):
+            value = date.fromisoformat(value)
+        row[column.key] = value
+    return row
+
+
+def _progress_path(path: str, mode: str) -> str:
+    return f"{path}.{mode}.progress"
+
+
+def _load_progress(path: str, mode: str) -> Optional[Dict]:
+    progress_path = _progress_path(path, mode)
+    if not os.path.exists(progress_path):
+        return None
+    with open(progress_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_progress(path: str, mode: str, progress: Dict):
+    progress_path = _progress_path(path, mode)
+    tmp_path = f"{progress_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(progress, f)
+    os.replace(tmp_path, progress_path)
+
+
+def _clear_progress(path: str, mode: str):
+    progress_path = _progress_path(path, mode)
+    if os.path.exists(progress_path):
+        os.remove(progress_path)
+
+
+class JsonlWriter:
+    """
+    分批追加写入 JSONL。
+
+    .gz 文件的每一批写成一个独立的 gzip 成员，批次边界即是可安全截断的位置，
+    中断后可从上次记录的偏移量继续写入。
+    """
+
+    def __init__(self, path: str, offset: int = 0):
+        self.path = path
+        self.compress = path.endswith(".gz")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.file = open(path, "ab")
+        # 丢弃上次中断时写了一半的批次
+        self.file.truncate(offset)
+        self.file.seek(offset)
+
+    def write_batch(self, records: List[Dict]) -> int:
+        """写入一批记录，返回写入后的文件偏移量"""
+        data = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records).encode("utf-8")
+        if self.compress:
+            data = gzip.compress(data, compresslevel=6)
+        self.file.write(data)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+
+def _section_filter(stmt, model, group_ids: Optional[List[int]], since: Optional[datetime], until: Optional[datetime]):
+    columns = model.__table__.columns
+    if group_ids and "group_id" in columns:
+        stmt = stmt.where(columns["group_id"].in_(group_ids))
+    if model is Message:
+        if since is not None:
+            stmt = stmt.where(Message.timestamp >= since)
+        if until is not None:
+            stmt = stmt.where(Message.timestamp < until)
+    elif model is MessageArchive:
+        if since is not None:
+            stmt = stmt.where(MessageArchive.day >= since.date())
+        if until is not None:
+            stmt = stmt.where(MessageArchive.day <= until.date())
+    return stmt
+
+
+def _archive_records(archive, since: Optional[datetime], until: Optional[datetime]) -> List[Dict]:
+    records = []
+    for message in decode_archive(archive):
+        timestamp = message["timestamp"]
+        if timestamp is not None:
+            timestamp = _to_naive_utc(timestamp)
+            if (since is not None and timestamp < since) or (until is not None and timestamp >= until):
+                continue
+        records.append({
+            "_type": "message",
+            "id": message["id"],
+            "group_id": message["group_id"],
+            "user_id": message["user_id"],
+            "content": message["content"],
+            "timestamp": _to_json(timestamp),
+        })
+    return records
+
+
+async def export_data(
+    path: str,
+    group_ids: Optional[List[int]] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    resume: bool = False,
+    batch_size: int = 1000,
+    on_progress: Optional[Callable[[Dict[str, int]], None]] = None,
+) -> Dict[str, int]:
+    """
+    流式导出聊天记录、印象、图片记录、用户资料和群组配置到 JSONL 文件（.gz 结尾时压缩）。
+
+    各表按主键顺序以游标分批读取，内存占用与数据量无关。每批写入后记录进度，
+    resume 为 True 时从上次中断处继续。群组和时间过滤只作用于带 group_id 的表和消息。
+
+    Returns:
+        各类型导出的记录条数。
+    """
+    since = _to_naive_utc(since) if since else None
+    until = _to_naive_utc(until) if until else None
+    filters = {
+        "group_ids": sorted(group_ids) if group_ids else None,
+        "since": _to_json(since),
+        "until": _to_json(until),
+    }
+    progress = _load_progress(path, "export") if resume else None
+    if progress and progress.get("filters") != filters:
+        raise ValueError("导出条件与未完成的导出不一致，无法继续")
+    if not progress:
+        progress = {"filters": filters, "section": 0, "last": None, "offset": 0, "counts": {}}
+    writer = JsonlWriter(path, progress["offset"])
+    loop = asyncio.get_running_loop()
+    try:
+        if progress["offset"] == 0:
+            header = {"_type": "header", "format": EXPORT_FORMAT, "version": EXPORT_VERSION,
+                      "created_at": datetime.now(timezone.utc).isoformat(), "filters": filters}
+            progress["offset"] = await loop.run_in_executor(None, writer.write_batch, [header])
+            _save_progress(path, "export", progress)
+        for index in range(progress["section"], len(SECTIONS)):
+            name, model = SECTIONS[index]
+            pk = list(model.__table__.primary_key.columns)
+            stmt = _section_filter(select(model), model, group_ids, since, until)
+            if progress["section"] == index and progress["last"] is not None:
+                if len(pk) == 1:
+                    stmt = stmt.where(pk[0] > progress["last"][0])
+                else:
+                    stmt = stmt.where(tuple_(*pk) > tuple_(*progress["last"]))
+            stmt = stmt.order_by(*pk).execution_options(yield_per=batch_size)
+            async with use_session() as session:
+                result = await session.stream_scalars(stmt)
+                batch: List[Dict] = []
+                last = None
+                async for row in result:
+                    if model is MessageArchive:
+                        batch.extend(_archive_records(row, since, until))
+                    else:
+                        batch.append(serialize_row(name, model, row))
+                    last = [getattr(row, column.key) for column in pk]
+                    if len(batch) >= batch_size:
+                        await _write_progress(writer, path, progress, index, last, batch, on_progress)
+                        batch = []
+                if batch or last is not None:
+                    await _write_progress(writer, path, progress, index, last, batch, on_progress)
+            progress["section"] = index + 1
+            progress["last"] = None
+            _save_progress(path, "export", progress)
+    finally:
+        writer.close()
+    _clear_progress(path, "export")
+    logger.info(f"Exported {progress['counts']} to {path}")
+    return progress["counts"]
+
+
+async def _write_progress(writer: JsonlWriter, path: str, progress: Dict, index: int, last: list,
+                          batch: List[Dict], on_progress: Optional[Callable[[Dict[str, int]], None]]):
+    if batch:
+        loop = asyncio.get_running_loop()
+        progress["offset"] = await loop.run_in_executor(None, writer.write_batch, batch)
+        for record in batch:
+            progress["counts"][record["_type"]] = progress["counts"].get(record["_type"], 0) + 1
+    progress["section"] = index
+    progress["last"] = [_to_json(value) for value in last]
+    _save_progress(path, "export", progress)
+    if on_progress:
+        on_progress(progress["counts"])
+
+
+async def _insert_rows(session: AsyncSession, model, rows: List[Dict]):
+    """批量插入，主键已存在的行跳过，重复导入不会产生重复数据"""
+    insert = get_upsert_insert(session)
+    batches: Dict[tuple, List[Dict]] = {}
+    for row in rows:
+        batches.setdefault(tuple(sorted(row)), []).append(row)
+    for keys, batch in batches.items():
+        if insert is None:
+            for row in batch:
+                await session.merge(model(**row))
+            continue
+        # 控制单条语句的参数个数，避免超过 SQLite 的变量上限
+        per_statement = max(1, 30000 // max(1, len(keys)))
+        for start in range(0, len(batch), per_statement):
+            await session.execute(
+                insert(model).values(batch[start:start + per_statement]).on_conflict_do_nothing())
+
+
+async def _reset_sequences(session: AsyncSession):
+    # PostgreSQL 中显式写入 ID 后需要把自增序列推进到最大 ID 之后
+    if session.bind.dialect.name != "postgresql":
+        return
+    for model in SERIAL_MODELS:
+        table = model.__tablename__
+        await session.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+            f"COALESCE((SELECT MAX(id) FROM {table}), 0) + 1, false)"))
+
+
+def _read_lines(file, count: int) -> List[str]:
+    lines = []
+    for line in file:
+        lines.append(line)
+        if len(lines) >= count:
+            break
+    return lines
+
+
+async def import_data(
+    path: str,
+    resume: bool = False,
+    batch_size: int = 1000,
+    on_progress: Optional[Callable[[Dict[str, int]], None]] = None,
+) -> Dict[str, int]:
+    """
+    流式导入 export_data 导出的 JSONL 文件，每批一个事务。
+
+    主键已存在的记录会被跳过，因此可以重复导入；resume 为 True 时跳过上次已提交的行。
+    可在 SQLite 和 PostgreSQL 之间迁移数据。
+
+    Returns:
+        各类型读取的记录条数（含因已存在而跳过的记录）。
+    """
+    progress = _load_progress(path, "import") if resume else None
+    if not progress:
+        progress = {"lines": 0, "counts": {}}
+    opener = gzip.open if path.endswith(".gz") else open
+    loop = asyncio.get_running_loop()
+    with opener(path, "rt", encoding="utf-8") as file:
+        skipped = 0
+        while skipped < progress["lines"]:
+            count = min(batch_size, progress["lines"] - skipped)
+            skipped += len(await loop.run_in_executor(None, _read_lines, file, count))
+        while True:
+            lines = await loop.run_in_executor(None, _read_lines, file, batch_size)
+            if not lines:
+                break
+            grouped: Dict[str, List[Dict]] = {}
+            for line in lines:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                record_type = record.pop("_type", None)
+                if record_type == "header":
+                    if record.get("format") != EXPORT_FORMAT or record.get("version") != EXPORT_VERSION:
+                        raise ValueError(f"不支持的导出文件格式：{record.get('format')} v{record.get('version')}")
+                    continue
+                model = MODELS.get(record_type)
+                if model is None:
+                    logger.warning(f"Skipping unknown record type: {record_type}")
+                    continue
+                grouped.setdefault(record_type, []).append(deserialize_record(model, record))
+            async with use_session() as session:
+                # 按导出顺序插入，保证被引用的行先写入
+                for name, model in SECTIONS:
+                    if name in grouped:
+                        await _insert_rows(session, model, grouped[name])
+            progress["lines"] += len(lines)
+            for name, rows in grouped.items():
+                progress["counts"][name] = progress["counts"].get(name, 0) + len(rows)
+            _save_progress(path, "import", progress)
+            if on_progress:
+                on_progress(progress["counts"])
+    async with use_session() as session:
+        await _reset_sequences(session)
+    _clear_progress(path, "import")
+    logger.info(f"Imported {progress['counts']} from {path}")
+    return progress["counts"]
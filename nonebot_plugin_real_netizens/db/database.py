@@ -1,18 +1,185 @@
 # nonebot_plugin_real_netizens\db\database.py
 from .models import Image
 from datetime import datetime, timedelta, timezone
+import re
 from typing import Dict, List, Optional
-from sqlalchemy import delete, select, func
+from nonebot.log import logger
+from sqlalchemy import delete, event, inspect, or_, select, func, text, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from .models import (
+    Base,
     User,
     Group,
     GroupUser,
     Message,
     Impression,
     Image,
+    ImageFileAlias,
+    ConversationSummary,
 )
-from nonebot_plugin_datastore import get_session
+from nonebot_plugin_datastore.db import get_engine
+from .unit_of_work import commit_or_flush, current_unit, execute_or_defer, use_session
+from ..config import plugin_config
+from ..image_cache import image_cache
+
+
+def build_sqlite_pragmas() -> List[str]:
+    """根据配置生成每个 SQLite 连接需要执行的 PRAGMA 语句"""
+    return [
+        f"PRAGMA journal_mode={plugin_config.SQLITE_JOURNAL_MODE}",
+        f"PRAGMA synchronous={plugin_config.SQLITE_SYNCHRONOUS}",
+        f"PRAGMA mmap_size={plugin_config.SQLITE_MMAP_SIZE}",
+        f"PRAGMA cache_size={plugin_config.SQLITE_CACHE_SIZE}",
+        f"PRAGMA busy_timeout={plugin_config.SQLITE_BUSY_TIMEOUT}",
+        "PRAGMA temp_store=MEMORY",
+    ]
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma in build_sqlite_pragmas():
+            cursor.execute(pragma)
+    finally:
+        cursor.close()
+
+
+async def apply_sqlite_profile(engine):
+    """为 SQLite 引擎的每个新连接应用性能配置，并替换连接池中的旧连接"""
+    if not event.contains(engine.sync_engine, "connect", _set_sqlite_pragmas):
+        event.listen(engine.sync_engine, "connect", _set_sqlite_pragmas)
+    await engine.dispose()
+    async with engine.connect() as conn:
+        journal_mode = (await conn.exec_driver_sql("PRAGMA journal_mode")).scalar()
+    logger.info(f"SQLite profile applied, journal_mode={journal_mode}")
+
+
+MESSAGE_FTS_TABLE = "real_netizens_messages_fts"
+# 全文索引是否可用，由 init_database 设置
+fts_enabled = False
+
+
+async def init_message_fts(conn) -> bool:
+    """
+    创建消息全文索引（FTS5 外部内容表）及同步触发器。
+
+    SQLite 3.34 起使用 trigram 分词，中文无需分词即可检索；更早的版本退回 unicode61。
+    消息的插入、更新和删除都由触发器同步到索引。
+    """
+    exists = (await conn.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (MESSAGE_FTS_TABLE,))).scalar()
+    if not exists:
+        version = (await conn.exec_driver_sql("SELECT sqlite_version()")).scalar()
+        tokenizer = "trigram" if tuple(map(int, version.split("."))) >= (3, 34, 0) else "unicode61"
+        await conn.exec_driver_sql(
+            f"CREATE VIRTUAL TABLE {MESSAGE_FTS_TABLE} USING fts5("
+            f"content, content='real_netizens_messages', content_rowid='id', tokenize='{tokenizer}')")
+        # 为已有消息建立索引
+        await conn.exec_driver_sql(
+            f"INSERT INTO {MESSAGE_FTS_TABLE}({MESSAGE_FTS_TABLE}) VALUES ('rebuild')")
+        logger.info(f"Message full-text index created with {tokenizer} tokenizer")
+    await conn.exec_driver_sql(f"""
+        CREATE TRIGGER IF NOT EXISTS real_netizens_messages_fts_ai
+        AFTER INSERT ON real_netizens_messages BEGIN
+            INSERT INTO {MESSAGE_FTS_TABLE}(rowid, content) VALUES (new.id, new.content);
+        END""")
+    await conn.exec_driver_sql(f"""
+        CREATE TRIGGER IF NOT EXISTS real_netizens_messages_fts_ad
+        AFTER DELETE ON real_netizens_messages BEGIN
+            INSERT INTO {MESSAGE_FTS_TABLE}({MESSAGE_FTS_TABLE}, rowid, content)
+            VALUES ('delete', old.id, old.content);
+        END""")
+    await conn.exec_driver_sql(f"""
+        CREATE TRIGGER IF NOT EXISTS real_netizens_messages_fts_au
+        AFTER UPDATE OF content ON real_netizens_messages BEGIN
+            INSERT INTO {MESSAGE_FTS_TABLE}({MESSAGE_FTS_TABLE}, rowid, content)
+            VALUES ('delete', old.id, old.content);
+            INSERT INTO {MESSAGE_FTS_TABLE}(rowid, content) VALUES (new.id, new.content);
+        END""")
+    return True
+
+
+async def init_database():
+    """初始化数据库：应用 SQLite 性能配置并创建插件数据表"""
+    global fts_enabled
+    engine = get_engine()
+    if engine.dialect.name == "sqlite" and plugin_config.SQLITE_TUNING:
+        await apply_sqlite_profile(engine)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(add_missing_columns)
+        await conn.run_sync(add_impression_unique_index)
+    if engine.dialect.name == "sqlite" and plugin_config.MESSAGE_FTS_ENABLED:
+        try:
+            async with engine.begin() as conn:
+                fts_enabled = await init_message_fts(conn)
+        except Exception as e:
+            # 未编译 FTS5 的 SQLite 退回 LIKE 检索
+            logger.warning(f"Message full-text index unavailable: {e}")
+            fts_enabled = False
+
+
+def add_missing_columns(conn):
+    """
+    为已存在的表补充后续版本新增的可空列。
+
+    create_all 只创建缺失的表，不会修改已有的表；新增列均可为空，直接 ADD COLUMN 即可。
+    """
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            column_type = column.type.compile(dialect=conn.dialect)
+            conn.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column_type}')
+            logger.info(f"Added column {table.name}.{column.name}")
+
+
+def add_impression_unique_index(conn):
+    """
+    为旧版本创建的印象表补充 (group_id, user_id, character_id) 唯一索引。
+
+    create_all 不会给已有的表添加约束，而印象的 upsert 以该唯一索引为冲突目标。
+    建索引前删除重复的印象，每组只保留最新（ID 最大）的一条。
+    """
+    inspector = inspect(conn)
+    table = Impression.__tablename__
+    if not inspector.has_table(table):
+        return
+    columns = ["group_id", "user_id", "character_id"]
+    unique_sets = [constraint["column_names"] for constraint in inspector.get_unique_constraints(table)]
+    unique_sets += [index["column_names"] for index in inspector.get_indexes(table) if index.get("unique")]
+    if any(sorted(names) == sorted(columns) for names in unique_sets):
+        return
+    deleted = conn.exec_driver_sql(
+        f"DELETE FROM {table} WHERE id NOT IN ("
+        f"SELECT MAX(id) FROM {table} GROUP BY group_id, user_id, character_id)").rowcount
+    conn.exec_driver_sql(
+        f"CREATE UNIQUE INDEX IF NOT EXISTS uq_impression_group_user_character "
+        f"ON {table} (group_id, user_id, character_id)")
+    logger.info(f"Added unique index to {table}, removed {deleted} duplicate impressions")
+
+
+async def maintain_database():
+    """定期执行 WAL 检查点和 PRAGMA optimize，防止 WAL 文件无限增长"""
+    engine = get_engine()
+    if engine.dialect.name != "sqlite":
+        return
+    try:
+        async with engine.connect() as conn:
+            busy, log_frames, checkpointed = (
+                await conn.exec_driver_sql("PRAGMA wal_checkpoint(PASSIVE)")).one()
+            await conn.exec_driver_sql("PRAGMA optimize")
+        logger.debug(
+            f"SQLite maintenance: wal_checkpoint busy={busy}, "
+            f"frames={log_frames}, checkpointed={checkpointed}")
+    except Exception as e:
+        logger.error(f"SQLite maintenance failed: {e}")
 
 
 async def get_user(session: AsyncSession, user_id: int) -> Optional[User]:
@@ -46,7 +213,7 @@ async def create_user(
         last_message_time=last_message_time,
     )
     session.add(user)
-    await session.commit()
+    await commit_or_flush(session)
     return user
 
 
@@ -55,7 +222,18 @@ async def update_user(session: AsyncSession, user: User, **kwargs):
     for key, value in kwargs.items():
         setattr(user, key, value)
     session.add(user)
-    await session.commit()
+    await commit_or_flush(session)
+
+
+async def set_user_avatar_description(
+    session: AsyncSession, user_id: int, description: str, avatar_hash: str
+):
+    """更新用户头像描述及对应的头像感知哈希"""
+    user = await session.get(User, user_id)
+    if user:
+        user.avatar_description = description
+        user.avatar_hash = avatar_hash
+        await commit_or_flush(session)
 
 
 async def get_group(session: AsyncSession, group_id: int) -> Optional[Group]:
@@ -69,7 +247,7 @@ async def create_group(session: AsyncSession, group_id: int, group_name: str) ->
     """创建新群组"""
     group = Group(group_id=group_id, group_name=group_name)
     session.add(group)
-    await session.commit()
+    await commit_or_flush(session)
     return group
 
 
@@ -96,7 +274,7 @@ async def create_group_user(
         join_time=datetime.now(),
     )
     session.add(group_user)
-    await session.commit()
+    await commit_or_flush(session)
     return group_user
 
 
@@ -106,10 +284,18 @@ async def add_message(
     """添加新消息"""
     message = Message(group_id=group_id, user_id=user_id, content=content)
     session.add(message)
-    await session.commit()
+    await commit_or_flush(session)
     return message
 
 
+async def update_message_content(session: AsyncSession, message_id: int, content: str) -> bool:
+    """修改已保存消息的内容，全文索引由触发器同步。消息不存在时返回 False"""
+    result = await session.execute(
+        update(Message).where(Message.id == message_id).values(content=content))
+    await commit_or_flush(session)
+    return result.rowcount > 0
+
+
 async def get_recent_messages(
     session: AsyncSession, group_id: int, limit: int = 10
 ) -> List[Message]:
@@ -124,12 +310,73 @@ async def get_recent_messages(
     return result.scalars().all()
 
 
-async def delete_old_messages(session: AsyncSession, days: int = 30):
-    """删除旧消息"""
+async def delete_old_messages(
+    session: AsyncSession, days: int = 30, batch_size: Optional[int] = None
+) -> int:
+    """
+    删除早于指定天数的旧消息。
+
+    指定 batch_size 时只删除最旧的一批，便于调用方分批执行、在批次间让出数据库锁。
+    返回删除的行数。
+    """
     cutoff_date = datetime.now(timezone.utc) - timedelta(days=days)
-    stmt = delete(Message).where(Message.timestamp < cutoff_date)
-    await session.execute(stmt)
-    await session.commit()
+    if batch_size:
+        batch = (
+            select(Message.id)
+            .where(Message.timestamp < cutoff_date)
+            .order_by(Message.id)
+            .limit(batch_size)
+        )
+        stmt = delete(Message).where(Message.id.in_(batch))
+    else:
+        stmt = delete(Message).where(Message.timestamp < cutoff_date)
+    result = await session.execute(stmt.execution_options(synchronize_session=False))
+    await commit_or_flush(session)
+    return result.rowcount or 0
+
+
+async def get_group_message_counts(session: AsyncSession) -> Dict[int, int]:
+    """获取每个群组的消息条数"""
+    stmt = select(Message.group_id, func.count(Message.id)).group_by(Message.group_id)
+    result = await session.execute(stmt)
+    return {group_id: count for group_id, count in result.all()}
+
+
+async def get_overflow_boundary(
+    session: AsyncSession, group_id: int, keep: int
+) -> Optional[int]:
+    """获取群组中超出保留条数的最新一条消息的 ID，不超出时返回 None"""
+    # 第 keep + 1 新的消息及更早的消息都超出限制
+    return await session.scalar(
+        select(Message.id)
+        .where(Message.group_id == group_id)
+        .order_by(Message.id.desc())
+        .offset(keep)
+        .limit(1)
+    )
+
+
+async def delete_group_overflow_messages(
+    session: AsyncSession, group_id: int, keep: int, batch_size: int
+) -> int:
+    """
+    删除群组中超出保留条数的最旧消息，每次最多删除 batch_size 条。
+
+    返回删除的行数，为 0 表示该群组已不超出限制。
+    """
+    boundary = await get_overflow_boundary(session, group_id, keep)
+    if boundary is None:
+        return 0
+    batch = (
+        select(Message.id)
+        .where(Message.group_id == group_id, Message.id <= boundary)
+        .order_by(Message.id)
+        .limit(batch_size)
+    )
+    stmt = delete(Message).where(Message.id.in_(batch))
+    result = await session.execute(stmt.execution_options(synchronize_session=False))
+    await commit_or_flush(session)
+    return result.rowcount or 0
 
 
 async def get_impression(
@@ -145,28 +392,140 @@ async def get_impression(
     return result.first()
 
 
+def get_upsert_insert(session: AsyncSession):
+    """根据会话绑定的数据库方言返回支持 ON CONFLICT 的 insert 构造函数"""
+    dialect = session.bind.dialect.name
+    if dialect == "sqlite":
+        return sqlite_insert
+    if dialect == "postgresql":
+        return pg_insert
+    return None
+
+
+async def upsert_impressions(session: AsyncSession, rows: List[Dict]) -> int:
+    """
+    批量写入用户印象，单条 INSERT ... ON CONFLICT DO UPDATE 语句完成。
+
+    rows 中每项需包含 group_id、user_id、character_id、content；
+    同一键出现多次时以最后一次为准。返回实际写入的印象条数。
+    """
+    if not rows:
+        return 0
+    now = datetime.now(timezone.utc)
+    # 同一条语句内不能多次命中同一冲突键，先在内存中去重
+    merged: Dict[tuple, Dict] = {}
+    for row in rows:
+        key = (row["group_id"], row["user_id"], row["character_id"])
+        merged[key] = {
+            "group_id": row["group_id"],
+            "user_id": row["user_id"],
+            "character_id": row["character_id"],
+            "content": row["content"],
+            "is_active": True,
+            "created_at": now,
+            "updated_at": now,
+        }
+    values = list(merged.values())
+    insert = get_upsert_insert(session)
+    if insert is None:
+        # 其他数据库退回逐条查询写入
+        for value in values:
+            impression = await get_impression(
+                session, value["group_id"], value["user_id"], value["character_id"])
+            if impression:
+                impression.content = value["content"]
+                impression.updated_at = now
+            else:
+                session.add(Impression(**value))
+        await commit_or_flush(session)
+        return len(values)
+    stmt = insert(Impression).values(values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["group_id", "user_id", "character_id"],
+        set_={
+            "content": stmt.excluded.content,
+            "updated_at": stmt.excluded.updated_at,
+        },
+    )
+    await session.execute(stmt)
+    await commit_or_flush(session)
+    return len(values)
+
+
+async def _upsert_rows(
+    session: AsyncSession,
+    model,
+    rows: List[Dict],
+    index_elements: List[str],
+    coalesce_fields: tuple = (),
+):
+    """
+    按冲突键批量写入行，不提交事务。
+
+    键集合相同的行合并为一条 INSERT ... ON CONFLICT DO UPDATE 语句；
+    coalesce_fields 中的字段在新值为空时保留原值。
+    """
+    insert = get_upsert_insert(session)
+    batches: Dict[tuple, List[Dict]] = {}
+    for row in rows:
+        batches.setdefault(tuple(sorted(row)), []).append(row)
+    for keys, batch in batches.items():
+        if insert is None:
+            for row in batch:
+                await session.merge(model(**row))
+            continue
+        stmt = insert(model).values(batch)
+        update_fields = [key for key in keys if key not in index_elements]
+        if not update_fields:
+            await session.execute(stmt.on_conflict_do_nothing(index_elements=index_elements))
+            continue
+        stmt = stmt.on_conflict_do_update(
+            index_elements=index_elements,
+            set_={
+                key: func.coalesce(getattr(stmt.excluded, key), getattr(model, key))
+                if key in coalesce_fields else getattr(stmt.excluded, key)
+                for key in update_fields
+            },
+        )
+        await session.execute(stmt)
+
+
+async def upsert_profiles(
+    session: AsyncSession,
+    users: List[Dict],
+    groups: List[Dict],
+    group_users: List[Dict],
+):
+    """
+    批量写入用户、群组和群成员记录，一次提交。
+
+    每类记录按主键 upsert，users 中只包含需要更新的字段。
+    """
+    if users:
+        await _upsert_rows(session, User, users, ["user_id"])
+    if groups:
+        await _upsert_rows(session, Group, groups, ["group_id"],
+                           coalesce_fields=("group_name",))
+    if group_users:
+        await _upsert_rows(session, GroupUser, group_users, ["group_id", "user_id"],
+                           coalesce_fields=("nickname",))
+    await commit_or_flush(session)
+
+
 async def update_impression(
     session: AsyncSession,
     group_id: int,
     user_id: int,
     character_id: str,
     content: str,
-) -> Impression:
+) -> None:
     """更新或创建用户印象"""
-    impression = await get_impression(session, group_id, user_id, character_id)
-    if impression:
-        impression.content = content
-        impression.updated_at = datetime.now(timezone.utc)
-    else:
-        impression = Impression(
-            group_id=group_id,
-            user_id=user_id,
-            character_id=character_id,
-            content=content,
-        )
-        session.add(impression)
-    await session.commit()
-    return impression
+    await upsert_impressions(session, [{
+        "group_id": group_id,
+        "user_id": user_id,
+        "character_id": character_id,
+        "content": content,
+    }])
 
 
 async def get_last_message_time(
@@ -182,25 +541,418 @@ async def get_last_message_time(
     return last_message_time
 
 
-async def add_image_record(image_info: Dict):
-    async with get_session() as session:
-        new_image = Image(**image_info)
-        session.add(new_image)
-        await session.commit()
+async def get_last_message_times(session: AsyncSession) -> Dict[int, datetime]:
+    """一次查询获取所有群组最后一条消息的时间"""
+    stmt = (
+        select(Message.group_id, func.max(Message.timestamp))
+        .group_by(Message.group_id)
+    )
+    result = await session.execute(stmt)
+    return {group_id: last_time for group_id, last_time in result.all() if last_time}
+
+
+async def get_last_message_ids(session: AsyncSession, group_ids: List[int]) -> Dict[int, int]:
+    """一次查询获取多个群组最后一条消息的 ID"""
+    if not group_ids:
+        return {}
+    stmt = (
+        select(Message.group_id, func.max(Message.id))
+        .where(Message.group_id.in_(group_ids))
+        .group_by(Message.group_id)
+    )
+    result = await session.execute(stmt)
+    return {group_id: last_id for group_id, last_id in result.all()}
 
 
-async def get_image_by_hash(image_hash: str) -> Optional[Dict]:
-    async with get_session() as session:
-        query = select(Image).where(Image.hash == image_hash)
-        result = await session.execute(query)
-        image = result.scalar_one_or_none()
-        if image:
-            return {
-                "file_path": image.file_path,
-                "file_name": image.file_name,
-                "hash": image.hash,
-                "description": image.description,
-                "is_meme": image.is_meme,
-                "emotion_tag": image.emotion_tag,
-            }
+async def get_first_message_ids(session: AsyncSession, group_ids: List[int]) -> Dict[int, int]:
+    """一次查询获取多个群组最早一条消息的 ID，没有消息的群组不在结果中"""
+    if not group_ids:
+        return {}
+    stmt = (
+        select(Message.group_id, func.min(Message.id))
+        .where(Message.group_id.in_(group_ids))
+        .group_by(Message.group_id)
+    )
+    result = await session.execute(stmt)
+    return {group_id: first_id for group_id, first_id in result.all()}
+
+
+async def get_messages_after(
+    session: AsyncSession,
+    group_id: int,
+    after_id: int = 0,
+    limit: int = 50,
+    before_id: Optional[int] = None,
+    newest: bool = False,
+) -> List[Message]:
+    """
+    获取群组中 ID 大于 after_id（且小于 before_id）的消息，按 ID 升序返回。
+
+    newest 为 True 时取满足条件的最新 limit 条，否则取最旧的 limit 条。
+    """
+    stmt = select(Message).where(
+        Message.group_id == group_id, Message.id > after_id)
+    if before_id is not None:
+        stmt = stmt.where(Message.id < before_id)
+    stmt = stmt.order_by(Message.id.desc() if newest else Message.id).limit(limit)
+    result = await session.execute(stmt)
+    messages = list(result.scalars().all())
+    return messages[::-1] if newest else messages
+
+
+async def get_recent_messages_by_group(
+    session: AsyncSession, group_ids: List[int], limit: int
+) -> Dict[int, List[Message]]:
+    """
+    一次查询获取多个群组各自最新的 limit 条消息，每个群组的消息按 ID 升序排列。
+
+    使用 ROW_NUMBER 窗口函数按群组分区编号，依赖 (group_id, id) 索引。
+    """
+    if not group_ids or limit <= 0:
+        return {}
+    ranked = (
+        select(
+            Message.id,
+            func.row_number().over(
+                partition_by=Message.group_id, order_by=Message.id.desc()
+            ).label("rn"),
+        )
+        .where(Message.group_id.in_(group_ids))
+        .subquery()
+    )
+    stmt = (
+        select(Message)
+        .join(ranked, Message.id == ranked.c.id)
+        .where(ranked.c.rn <= limit)
+        .order_by(Message.group_id, Message.id)
+    )
+    result = await session.execute(stmt)
+    messages: Dict[int, List[Message]] = {}
+    for message in result.scalars().all():
+        messages.setdefault(message.group_id, []).append(message)
+    return messages
+
+
+async def get_active_impressions(
+    session: AsyncSession, group_ids: List[int], user_ids: List[int]
+) -> List[Impression]:
+    """批量获取指定群组和用户的有效印象"""
+    if not group_ids or not user_ids:
+        return []
+    stmt = select(Impression).where(
+        Impression.group_id.in_(group_ids),
+        Impression.user_id.in_(user_ids),
+        Impression.is_active == True,
+    )
+    result = await session.execute(stmt)
+    return list(result.scalars().all())
+
+
+async def get_summaries(
+    session: AsyncSession, group_ids: List[int]
+) -> Dict[int, ConversationSummary]:
+    """批量获取群组的滚动摘要"""
+    if not group_ids:
+        return {}
+    stmt = select(ConversationSummary).where(ConversationSummary.group_id.in_(group_ids))
+    result = await session.execute(stmt)
+    return {summary.group_id: summary for summary in result.scalars().all()}
+
+
+def build_fts_query(query: str, max_terms: int = 32) -> Optional[str]:
+    """
+    将自然语言查询转换为 FTS5 MATCH 表达式。
+
+    短词按短语匹配；长句拆成三字片段以 OR 连接，由 bm25 按重合程度排序。
+    没有不少于三个字的词时返回 None，由调用方退回 LIKE 检索。
+    """
+    terms: List[str] = []
+    for word in re.split(r"[\W_]+", query):
+        if len(word) < 3:
+            continue
+        if len(word) <= 6:
+            terms.append(word)
+        else:
+            terms.extend(word[i:i + 3] for i in range(len(word) - 2))
+    unique_terms = list(dict.fromkeys(terms))[:max_terms]
+    if not unique_terms:
+        return None
+    return " OR ".join('"' + term.replace('"', '""') + '"' for term in unique_terms)
+
+
+async def search_messages(
+    session: AsyncSession, group_id: int, query: str, limit: int = 5
+) -> List[Dict]:
+    """
+    在群组聊天记录中检索与 query 相关的消息，按相关度排序。
+
+    SQLite 使用 FTS5 全文索引；其他数据库或查询过短时退回 LIKE 匹配，按时间倒序。
+    """
+    match = build_fts_query(query) if fts_enabled else None
+    if match:
+        stmt = text(f"""
+            SELECT m.id, m.user_id, m.content, m.timestamp, bm25({MESSAGE_FTS_TABLE}) AS score
+            FROM {MESSAGE_FTS_TABLE}
+            JOIN real_netizens_messages AS m ON m.id = {MESSAGE_FTS_TABLE}.rowid
+            WHERE {MESSAGE_FTS_TABLE} MATCH :match AND m.group_id = :group_id
+            ORDER BY score
+            LIMIT :limit""")
+        result = await session.execute(stmt, {"match": match, "group_id": group_id, "limit": limit})
+        return [dict(row._mapping) for row in result.all()]
+    words = [word for word in re.split(r"[\W_]+", query) if len(word) >= 2][:8]
+    if not words:
+        return []
+    stmt = (
+        select(Message.id, Message.user_id, Message.content, Message.timestamp)
+        .where(Message.group_id == group_id,
+               or_(*[Message.content.contains(word, autoescape=True) for word in words]))
+        .order_by(Message.id.desc())
+        .limit(limit)
+    )
+    result = await session.execute(stmt)
+    return [dict(row._mapping, score=0.0) for row in result.all()]
+
+
+async def get_messages_by_ids(
+    session: AsyncSession, message_ids: List[int]
+) -> Dict[int, Message]:
+    """按 ID 批量获取消息"""
+    if not message_ids:
+        return {}
+    result = await session.execute(select(Message).where(Message.id.in_(message_ids)))
+    return {message.id: message for message in result.scalars().all()}
+
+
+async def get_tail_start_id(
+    session: AsyncSession, group_id: int, tail: int
+) -> Optional[int]:
+    """获取群组最新 tail 条消息中最旧一条的 ID"""
+    if tail <= 0:
         return None
+    stmt = (
+        select(Message.id)
+        .where(Message.group_id == group_id)
+        .order_by(Message.id.desc())
+        .offset(tail - 1)
+        .limit(1)
+    )
+    return await session.scalar(stmt)
+
+
+async def get_summary(
+    session: AsyncSession, group_id: int
+) -> Optional[ConversationSummary]:
+    """获取群组的滚动摘要"""
+    return await session.get(ConversationSummary, group_id)
+
+
+async def save_summary(
+    session: AsyncSession,
+    group_id: int,
+    content: str,
+    last_message_id: int,
+    message_count: int,
+) -> ConversationSummary:
+    """保存群组的滚动摘要"""
+    summary = await session.get(ConversationSummary, group_id)
+    if not summary:
+        summary = ConversationSummary(group_id=group_id)
+        session.add(summary)
+    summary.content = content
+    summary.last_message_id = last_message_id
+    summary.message_count = message_count
+    summary.updated_at = datetime.now(timezone.utc)
+    await commit_or_flush(session)
+    return summary
+
+
+async def add_image_record(image_info: Dict) -> Dict:
+    """
+    添加图片记录，返回数据库中的记录。
+
+    同一图片被并发写入时只保留先写入的记录（ON CONFLICT DO NOTHING），之后重新查询并返回它。
+    在外层工作单元内写入会推迟到提交时执行，避免后续的图片识别期间占用写锁，此时返回传入的记录。
+    """
+    unit = current_unit()
+    async with use_session() as session:
+        insert = get_upsert_insert(session)
+        if insert is None:
+            session.add(Image(**image_info))
+            await commit_or_flush(session, defer=True)
+        else:
+            await execute_or_defer(session, insert(Image).values(**image_info).on_conflict_do_nothing())
+    if unit is not None:
+        unit.cache[("image", image_info["hash"])] = image_info
+    elif insert is not None:
+        async with use_session() as session:
+            result = await session.execute(select(Image).where(Image.hash == image_info["hash"]))
+            image = result.scalar_one_or_none()
+        if image is not None:
+            image_info = _image_to_dict(image)
+    image_cache.put(image_info)
+    return image_info
+
+
+async def get_image_by_hash(image_hash: str) -> Optional[Dict]:
+    unit = current_unit()
+    if unit is not None and ("image", image_hash) in unit.cache:
+        return unit.cache[("image", image_hash)]
+    image_info = image_cache.get(image_hash)
+    if image_info is not None:
+        return image_info
+    async with use_session() as session:
+        # 不触发自动 flush，推迟的写入留到提交时执行
+        with session.no_autoflush:
+            query = select(Image).where(Image.hash == image_hash)
+            result = await session.execute(query)
+            image = result.scalar_one_or_none()
+        image_info = _image_to_dict(image) if image else None
+    if unit is not None:
+        unit.cache[("image", image_hash)] = image_info
+    if image_info is not None:
+        image_cache.put(image_info)
+    return image_info
+
+
+def _image_to_dict(image: Image) -> Dict:
+    return {
+        "file_path": image.file_path,
+        "file_name": image.file_name,
+        "hash": image.hash,
+        "description": image.description,
+        "is_meme": image.is_meme,
+        "emotion_tag": image.emotion_tag,
+    }
+
+
+# IN 列表每条语句的最大长度，SQLite 3.32 之前每条语句最多 999 个绑定参数
+IN_CLAUSE_BATCH = 500
+
+
+async def get_images_by_hashes(session: AsyncSession, hashes: List[str]) -> Dict[str, Dict]:
+    """按 MD5 批量获取图片信息，每 IN_CLAUSE_BATCH 个 MD5 查询一次"""
+    images = {}
+    for start in range(0, len(hashes), IN_CLAUSE_BATCH):
+        result = await session.execute(
+            select(Image).where(Image.hash.in_(hashes[start:start + IN_CLAUSE_BATCH])))
+        images.update((image.hash, _image_to_dict(image)) for image in result.scalars().all())
+    return images
+
+
+async def get_recent_images(session: AsyncSession, limit: int) -> List[Dict]:
+    """获取最近识别的图片，按时间从旧到新排列"""
+    result = await session.execute(select(Image).order_by(Image.id.desc()).limit(limit))
+    return [_image_to_dict(image) for image in reversed(result.scalars().all())]
+
+
+async def get_image_phashes(session: AsyncSession, after_id: int, limit: int) -> List[tuple]:
+    """按 ID 分批获取已有 pHash 的图片，返回 (id, hash, phash) 列表"""
+    result = await session.execute(
+        select(Image.id, Image.hash, Image.phash)
+        .where(Image.id > after_id, Image.phash.isnot(None))
+        .order_by(Image.id)
+        .limit(limit)
+    )
+    return [tuple(row) for row in result.all()]
+
+
+async def get_images_without_phash(session: AsyncSession, after_id: int, limit: int) -> List[tuple]:
+    """按 ID 分批获取缺少 pHash 的图片，返回 (id, hash, file_path) 列表"""
+    result = await session.execute(
+        select(Image.id, Image.hash, Image.file_path)
+        .where(Image.id > after_id, Image.phash.is_(None))
+        .order_by(Image.id)
+        .limit(limit)
+    )
+    return [tuple(row) for row in result.all()]
+
+
+async def set_image_phashes(session: AsyncSession, rows: List[tuple]):
+    """批量写入图片的 pHash，rows 为 (id, phash) 列表"""
+    await session.execute(
+        update(Image),
+        [{"id": image_id, "phash": phash} for image_id, phash in rows],
+    )
+    await commit_or_flush(session)
+
+
+async def get_images_without_description(session: AsyncSession, limit: int) -> List[tuple]:
+    """获取尚未识别的图片，按入库顺序返回 (hash, file_path) 列表"""
+    result = await session.execute(
+        select(Image.hash, Image.file_path)
+        .where(Image.description.is_(None))
+        .order_by(Image.id)
+        .limit(limit)
+    )
+    return [tuple(row) for row in result.all()]
+
+
+async def set_image_description(session: AsyncSession, image_info: Dict):
+    """写入延迟识别的图片描述和文件路径，并更新图片缓存"""
+    await session.execute(
+        update(Image)
+        .where(Image.hash == image_info["hash"])
+        .values(file_path=image_info["file_path"], description=image_info["description"],
+                is_meme=image_info["is_meme"], emotion_tag=image_info["emotion_tag"])
+    )
+    await commit_or_flush(session)
+    image_cache.put(image_info)
+
+
+async def get_image_by_file_id(file_id: str) -> Optional[Dict]:
+    """根据消息段中的图片文件 ID 获取已识别的图片信息"""
+    unit = current_unit()
+    if unit is not None and ("image_alias", file_id) in unit.cache:
+        return unit.cache[("image_alias", file_id)]
+    image_info = image_cache.get_by_file_id(file_id)
+    if image_info is not None:
+        return image_info
+    async with use_session() as session:
+        with session.no_autoflush:
+            result = await session.execute(
+                select(Image)
+                .join(ImageFileAlias, ImageFileAlias.image_hash == Image.hash)
+                .where(ImageFileAlias.file_id == file_id)
+            )
+            image = result.scalars().first()
+        image_info = _image_to_dict(image) if image else None
+    if unit is not None:
+        unit.cache[("image_alias", file_id)] = image_info
+        if image_info is not None:
+            unit.cache[("image", image_info["hash"])] = image_info
+    if image_info is not None:
+        image_cache.put(image_info, file_id)
+    return image_info
+
+
+async def get_image_aliases(session: AsyncSession, file_ids: List[str]) -> Dict[str, str]:
+    """批量获取图片文件 ID 对应的图片 MD5，每 IN_CLAUSE_BATCH 个文件 ID 查询一次"""
+    aliases = {}
+    for start in range(0, len(file_ids), IN_CLAUSE_BATCH):
+        result = await session.execute(
+            select(ImageFileAlias.file_id, ImageFileAlias.image_hash)
+            .where(ImageFileAlias.file_id.in_(file_ids[start:start + IN_CLAUSE_BATCH])))
+        aliases.update(result.all())
+    return aliases
+
+
+async def add_image_alias(file_id: str, image_info: Dict):
+    """
+    记录图片文件 ID 与图片记录的对应关系，已存在时指向新的记录。
+
+    在工作单元内写入会推迟到提交时执行。
+    """
+    async with use_session() as session:
+        insert = get_upsert_insert(session)
+        if insert is None:
+            await session.merge(ImageFileAlias(file_id=file_id, image_hash=image_info["hash"]))
+            await commit_or_flush(session, defer=True)
+        else:
+            stmt = insert(ImageFileAlias).values(file_id=file_id, image_hash=image_info["hash"])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["file_id"], set_={"image_hash": stmt.excluded.image_hash})
+            await execute_or_defer(session, stmt)
+    unit = current_unit()
+    if unit is not None:
+        unit.cache[("image_alias", file_id)] = image_info
+    image_cache.put(image_info, file_id)
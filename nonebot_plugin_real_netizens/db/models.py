@@ -5,11 +5,14 @@ from sqlalchemy import (
     Boolean,
     Column,
     DateTime,
+    Date,
     ForeignKey,
     Index,
     Integer,
+    LargeBinary,
     String,
     Text,
+    UniqueConstraint,
 )
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import declarative_base, relationship
@@ -27,6 +30,8 @@ class User(Base):
     nickname = Column(String(64))
     avatar = Column(String(255))
     avatar_description = Column(Text)
+    # 已生成描述的头像的感知哈希，头像未变化时跳过描述
+    avatar_hash = Column(String(64))
     last_active_time = Column(DateTime)
     displayname = Column(String(64))
     remark = Column(String(64))
@@ -70,11 +75,15 @@ class GroupUser(Base):
 
 class Message(Base):
     __tablename__ = "real_netizens_messages"
+    __table_args__ = (
+        Index("idx_message_group_id", "group_id", "id"),
+    )
     id = Column(Integer, primary_key=True)
     group_id = Column(Integer, ForeignKey("real_netizens_groups.group_id"))
     user_id = Column(Integer, ForeignKey("real_netizens_users.user_id"))
     content = Column(Text)
-    timestamp = Column(DateTime, default=datetime.now(
+    # 默认值需为可调用对象，否则所有消息都会共用模块加载时的时间
+    timestamp = Column(DateTime, default=lambda: datetime.now(
         timezone.utc), index=True)
     group = relationship("Group", back_populates="messages")
     user = relationship("User", back_populates="messages")
@@ -82,6 +91,11 @@ class Message(Base):
 
 class Impression(Base):
     __tablename__ = "real_netizens_impressions"
+    __table_args__ = (
+        # upsert 依赖此唯一约束作为冲突目标
+        UniqueConstraint("group_id", "user_id", "character_id",
+                         name="uq_impression_group_user_character"),
+    )
     id = Column(Integer, primary_key=True)
     group_id = Column(Integer, index=True)
     user_id = Column(Integer, index=True)
@@ -106,9 +120,46 @@ class Image(Base):
     description = Column(Text)
     is_meme = Column(Boolean, default=False)
     emotion_tag = Column(String(255))  # 添加 emotion_tag 字段
+    phash = Column(String(16))  # 感知哈希，用于查找近似重复的图片
     created_at = Column(DateTime, default=datetime.now(timezone.utc))
 
 
+class ConversationSummary(Base):
+    __tablename__ = "real_netizens_summaries"
+    group_id = Column(Integer, primary_key=True, autoincrement=False)
+    content = Column(Text)
+    # 已折叠进摘要的最后一条消息 ID
+    last_message_id = Column(Integer, default=0)
+    message_count = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+
+class ImageFileAlias(Base):
+    """消息段中的图片文件 ID 到图片记录的映射，重复发送的图片无需下载即可识别"""
+    __tablename__ = "real_netizens_image_aliases"
+    file_id = Column(String(255), primary_key=True)
+    image_hash = Column(String(64), nullable=False, index=True)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+
+class MessageArchive(Base):
+    """冷数据归档：一个群组一天内的一批消息压缩后存为一行"""
+    __tablename__ = "real_netizens_message_archives"
+    __table_args__ = (
+        Index("idx_message_archive_group_day", "group_id", "day"),
+        Index("idx_message_archive_group_ids", "group_id", "first_message_id", "last_message_id"),
+    )
+    id = Column(Integer, primary_key=True)
+    group_id = Column(Integer, nullable=False)
+    day = Column(Date, nullable=False)
+    first_message_id = Column(Integer, nullable=False)
+    last_message_id = Column(Integer, nullable=False)
+    message_count = Column(Integer, nullable=False)
+    codec = Column(String(16), nullable=False)
+    data = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+
 class GroupConfig(Base):
     __tablename__ = "real_netizens_group_configs"
     group_id = Column(Integer, primary_key=True, autoincrement=False)
@@ -138,6 +189,9 @@ def init_models(plugin_data):
         "Message": Message,
         "Impression": Impression,
         "Image": Image,
+        "ImageFileAlias": ImageFileAlias,
+        "ConversationSummary": ConversationSummary,
+        "MessageArchive": MessageArchive,
         "GroupConfig": GroupConfig,
         "GroupWorldbook": GroupWorldbook,
     }
@@ -152,5 +206,8 @@ GroupUser = db_models["GroupUser"]
 Message = db_models["Message"]
 Impression = db_models["Impression"]
 Image = db_models["Image"]
+ImageFileAlias = db_models["ImageFileAlias"]
+ConversationSummary = db_models["ConversationSummary"]
+MessageArchive = db_models["MessageArchive"]
 GroupConfig = db_models["GroupConfig"]
 GroupWorldbook = db_models["GroupWorldbook"]
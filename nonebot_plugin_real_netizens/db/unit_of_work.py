@@ -0,0 +1,129 @@
+# nonebot_plugin_real_netizens\db\unit_of_work.py
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from nonebot.log import logger
+from nonebot_plugin_datastore.db import get_engine
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import Executable
+
+
+class UnitOfWork:
+    """
+    一次事件处理流程的工作单元。
+
+    流程内的数据库访问共享同一个会话（同一事务内共享同一个连接），写入只 flush 不提交，
+    在流程结束或显式调用 commit 时一次性提交。cache 保存流程内已读取或写入的数据，
+    同一流程中的重复查询直接命中，并能读到本流程尚未提交的写入。
+    """
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+        self.cache: Dict[Any, Any] = {}
+        self.pending: List[Executable] = []
+        self.closed = False
+
+    async def commit(self):
+        """
+        提交目前为止的写入。
+
+        写入在提交前一直占用 SQLite 写锁，调用 LLM 等耗时操作前应先提交。
+        """
+        session = self.session
+        pending, self.pending = self.pending, []
+        for statement in pending:
+            await session.execute(statement)
+        if session.new or session.dirty or session.deleted or session.in_transaction():
+            await session.commit()
+
+
+_current_unit: ContextVar[Optional[UnitOfWork]] = ContextVar(
+    "real_netizens_unit_of_work", default=None)
+
+
+def current_unit() -> Optional[UnitOfWork]:
+    """获取当前上下文中的工作单元，不在工作单元内时返回 None"""
+    unit = _current_unit.get()
+    # 工作单元内创建的任务和定时回调会复制上下文，工作单元结束后不能再使用它的会话
+    if unit is None or unit.closed:
+        return None
+    return unit
+
+
+def detach_unit():
+    """
+    使当前任务脱离工作单元，之后的数据库访问各自使用独立的工作单元。
+
+    工作单元的会话不能被多个任务同时使用，在工作单元内创建的并发子任务应在开始时调用。
+    任务持有上下文的副本，不影响创建它的任务。
+    """
+    _current_unit.set(None)
+
+
+@asynccontextmanager
+async def event_scope() -> AsyncIterator[UnitOfWork]:
+    """
+    开启一个工作单元，已在工作单元内时复用外层的工作单元。
+
+    正常退出时提交全部写入，发生异常时回滚。
+    """
+    unit = current_unit()
+    if unit is not None:
+        try:
+            yield unit
+        except Exception:
+            # 内层操作失败导致事务失效时回滚，外层流程仍可继续使用会话
+            if not unit.session.is_active:
+                logger.warning("Unit of work rolled back after a failed operation")
+                await unit.session.rollback()
+            raise
+        return
+    async with AsyncSession(get_engine(), expire_on_commit=False) as session:
+        unit = UnitOfWork(session)
+        token = _current_unit.set(unit)
+        try:
+            yield unit
+            await unit.commit()
+        except BaseException:
+            await session.rollback()
+            raise
+        finally:
+            unit.closed = True
+            _current_unit.reset(token)
+
+
+@asynccontextmanager
+async def use_session() -> AsyncIterator[AsyncSession]:
+    """获取当前工作单元的会话，不在工作单元内时使用一个独立的工作单元"""
+    async with event_scope() as unit:
+        yield unit.session
+
+
+async def commit_or_flush(session: AsyncSession, defer: bool = False):
+    """
+    数据库操作函数的统一提交入口。
+
+    会话属于当前工作单元时只 flush，由工作单元统一提交；defer 为 True 时连 flush 也推迟，
+    写入留到下一次查询或提交时执行。其他会话直接提交。
+    """
+    unit = current_unit()
+    if unit is None or unit.session is not session:
+        await session.commit()
+    elif not defer:
+        await session.flush()
+
+
+async def execute_or_defer(session: AsyncSession, statement: Executable):
+    """
+    执行一条写入语句。
+
+    会话属于当前工作单元时推迟到工作单元提交时执行，避免提前占用写锁；
+    其他会话立即执行并提交。适合 INSERT ... ON CONFLICT 这类不依赖返回值的语句。
+    """
+    unit = current_unit()
+    if unit is None or unit.session is not session:
+        await session.execute(statement)
+        await session.commit()
+    else:
+        unit.pending.append(statement)
@@ -1,103 +1,268 @@
 #nonebot_plugin_real_netizens\db\user_info_service.py
+import asyncio
+import time
 from datetime import datetime
-from io import BytesIO
-from typing import TYPE_CHECKING, Optional
+from typing import Dict, List, Optional, Tuple
 from nonebot.log import logger
-if TYPE_CHECKING:
-    from .models import User, Group, GroupUser
-import aiohttp
-from PIL import Image
+from cachetools import TTLCache
 from nonebot.adapters import Bot, Event
 from nonebot_plugin_datastore import get_session
 from nonebot_plugin_userinfo import UserInfo, get_user_info
+from ..config import plugin_config
+from ..image_captioner import image_captioner
+from ..image_downloader import ImageDownloadError, image_downloader
 from ..image_processor import image_processor
 from .database import (
-    create_group,
-    create_group_user,
-    create_user,
-    get_group,
-    get_group_user,
+    add_image_record,
+    get_image_by_hash,
     get_user,
-    update_user,
+    set_user_avatar_description,
+    upsert_profiles,
 )
-from .models import Group, GroupUser, User
+
+
+class ProfileSyncer:
+    """
+    用户资料同步器。
+
+    消息热路径只在内存中记录事件；后台定时任务拉取用户资料，
+    与缓存比较后仅将发生变化的 User/Group/GroupUser 记录批量 upsert，一次提交。
+    """
+
+    def __init__(self):
+        # user_id -> 用户资料快照，过期后重新拉取
+        self.profile_cache: TTLCache = TTLCache(
+            maxsize=plugin_config.PROFILE_CACHE_SIZE, ttl=plugin_config.PROFILE_CACHE_TTL)
+        # (group_id, user_id) -> 群名片
+        self.member_cache: TTLCache = TTLCache(
+            maxsize=plugin_config.PROFILE_CACHE_SIZE, ttl=plugin_config.PROFILE_CACHE_TTL)
+        # 等待后台拉取资料的用户：user_id -> (bot, event)
+        self.pending_refresh: Dict[int, Tuple[Bot, Event]] = {}
+        # 等待写入的最后发言：user_id -> (消息, 时间)
+        self.pending_activity: Dict[int, Tuple[Optional[str], datetime]] = {}
+        # 等待写入的群组与群成员
+        self.pending_groups: Dict[int, Optional[str]] = {}
+        self.pending_members: Dict[Tuple[int, int], None] = {}
+
+    def record_event(self, bot: Bot, event: Event):
+        """
+        记录事件中的用户活动，不访问数据库和网络。
+        """
+        user_id = int(event.get_user_id())
+        message = str(event.get_message()) if hasattr(event, 'get_message') else None
+        self.pending_activity[user_id] = (message, datetime.now())
+        if user_id not in self.profile_cache:
+            self.pending_refresh[user_id] = (bot, event)
+        if hasattr(event, 'group_id'):
+            group_id = int(event.group_id)
+            group_name = getattr(event, 'group_name', None)
+            if group_name is not None or group_id not in self.pending_groups:
+                self.pending_groups[group_id] = group_name
+            if (group_id, user_id) not in self.member_cache:
+                self.pending_members[(group_id, user_id)] = None
+                # 群名片需要拉取资料后才能得到
+                self.pending_refresh[user_id] = (bot, event)
+
+    async def refresh(self):
+        """
+        后台任务：拉取待刷新的用户资料，并批量写入所有变化。
+        """
+        pending_refresh, self.pending_refresh = self.pending_refresh, {}
+        pending_activity, self.pending_activity = self.pending_activity, {}
+        pending_groups, self.pending_groups = self.pending_groups, {}
+        pending_members, self.pending_members = self.pending_members, {}
+        if not (pending_refresh or pending_activity or pending_groups or pending_members):
+            return
+        users: Dict[int, Dict] = {}
+        changed_avatars: List[Tuple[int, str]] = []
+        member_names: Dict[Tuple[int, int], Optional[str]] = {}
+        for user_id, (bot, event) in pending_refresh.items():
+            try:
+                user_info: UserInfo = await get_user_info(bot, event, str(user_id))
+            except Exception as e:
+                logger.error(f"Error fetching user info for {user_id}: {str(e)}")
+                continue
+            if not user_info:
+                continue
+            profile = {
+                "nickname": user_info.user_name,
+                "avatar": user_info.user_avatar.get_url() if user_info.user_avatar else None,
+                "displayname": user_info.user_displayname,
+                "remark": user_info.user_remark,
+                "gender": user_info.user_gender,
+            }
+            cached = self.profile_cache.get(user_id)
+            self.profile_cache[user_id] = profile
+            if hasattr(event, 'group_id'):
+                member_names[(int(event.group_id), user_id)] = user_info.user_displayname
+            if cached == profile:
+                continue
+            users[user_id] = {"user_id": user_id, **profile}
+            if profile["avatar"] and (not cached or cached["avatar"] != profile["avatar"]):
+                changed_avatars.append((user_id, profile["avatar"]))
+        for user_id, (message, message_time) in pending_activity.items():
+            row = users.setdefault(user_id, {"user_id": user_id})
+            row["last_active_time"] = message_time
+            if message is not None:
+                row["last_message"] = message
+                row["last_message_time"] = message_time
+        groups = [{"group_id": group_id, "group_name": group_name}
+                  for group_id, group_name in pending_groups.items()]
+        group_users = []
+        for key in set(pending_members) | set(member_names):
+            group_id, user_id = key
+            nickname = member_names.get(key)
+            if key in self.member_cache and self.member_cache[key] == nickname:
+                continue
+            group_users.append({"group_id": group_id, "user_id": user_id, "nickname": nickname})
+        try:
+            async with get_session() as session:
+                await upsert_profiles(session, list(users.values()), groups, group_users)
+            for row in group_users:
+                self.member_cache[(row["group_id"], row["user_id"])] = row["nickname"]
+        except Exception as e:
+            logger.error(f"Error syncing user profiles: {str(e)}")
+            # 写入失败时让这些用户在下一轮重新拉取
+            for user_id in users:
+                self.profile_cache.pop(user_id, None)
+            return
+        logger.debug(
+            f"Synced {len(users)} users, {len(groups)} groups, {len(group_users)} group members")
+        # 头像发生变化时交给后台任务更新头像描述
+        for user_id, avatar_url in changed_avatars:
+            avatar_describer.enqueue(user_id, avatar_url)
+
+
+profile_syncer = ProfileSyncer()
+
+
 async def save_user_info(bot: Bot, event: Event):
-    """保存用户信息到数据库"""
-    user_id = event.get_user_id()
-    async with get_session() as session:
-        user_info: UserInfo = await get_user_info(bot, event, user_id)
-        user: Optional[User] = await get_user(session, int(user_id))  # type: ignore
-        if not user:
-            user = await create_user(
-                session,
-                int(user_id),
-                user_info.user_name,
-                user_info.user_avatar.get_url() if user_info.user_avatar else None,
-                user_info.user_displayname,
-                user_info.user_remark,
-                user_info.user_gender
-            )
+    """保存用户信息到数据库，实际写入由后台的 profile_syncer.refresh 批量完成"""
+    profile_syncer.record_event(bot, event)
+
+
+class AvatarDescriber:
+    """
+    头像描述后台任务。
+
+    按用户去重排队，头像地址未变化且已有描述时跳过；地址相同时每隔
+    AVATAR_RECHECK_INTERVAL 秒才重新下载比较感知哈希。相同图片复用已有的 Image 记录，
+    VL 识别按 AVATAR_CAPTION_INTERVAL 单独限速，每个头像只付一次识别成本。
+    """
+
+    def __init__(self):
+        # 在 start 中创建：Python 3.8/3.9 的 Queue 在创建时绑定事件循环，模块导入时循环尚未运行
+        self.queue: Optional[asyncio.Queue] = None
+        # 排队中的用户 -> 最新的头像地址，启动前登记的用户只记录在这里
+        self.queued: Dict[int, str] = {}
+        # 头像地址 -> 最近一次检查时间，过期后允许重新检查
+        self.checked: TTLCache = TTLCache(
+            maxsize=plugin_config.PROFILE_CACHE_SIZE, ttl=plugin_config.AVATAR_RECHECK_INTERVAL)
+        self._next_caption_time = 0.0
+        self._worker: Optional[asyncio.Task] = None
+
+    def start(self):
+        """启动后台处理任务"""
+        if self.queue is None:
+            self.queue = asyncio.Queue(maxsize=plugin_config.AVATAR_QUEUE_SIZE)
+            for user_id in self.queued:
+                self.queue.put_nowait(user_id)
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止后台处理任务"""
+        if self._worker:
+            self._worker.cancel()
+            self._worker = None
+
+    def enqueue(self, user_id: int, avatar_url: str):
+        """将用户头像加入描述队列，同一用户只保留最新的头像地址"""
+        if not avatar_url or (user_id, avatar_url) in self.checked:
+            return
+        if user_id in self.queued:
+            self.queued[user_id] = avatar_url
+            return
+        if self.queue is None:
+            # 启动前与队列使用相同的容量上限，启动时一并放入队列
+            if 0 < plugin_config.AVATAR_QUEUE_SIZE <= len(self.queued):
+                logger.warning(f"Avatar queue is full, skipping user {user_id}")
+                return
         else:
-            # 确保 user 不为 None
-            if user:
-                await update_user(
-                    session,
-                    user,
-                    nickname=user_info.user_name,
-                    avatar=user_info.user_avatar.get_url() if user_info.user_avatar else None,
-                    last_active_time=datetime.now(),
-                    displayname=user_info.user_displayname,
-                    remark=user_info.user_remark,
-                    gender=user_info.user_gender
-                )
-            else:
-                logger.warning(f"User {user_id} not found in database.")
-        # 处理头像描述
-        if user_info.user_avatar:
-            await update_user_avatar_description(session, int(user_id), user_info.user_avatar.get_url())
-        # 检查 event 是否有 group_id 和 group_name 属性
-        if hasattr(event, 'group_id') and hasattr(event, 'group_name'):
-            group_id = event.group_id
-            group: Optional[Group] = await get_group(session, int(group_id))  # type: ignore
-            if not group:
-                group = await create_group(session, int(group_id), event.group_name)
-            # 确保 group 和 user 都不是 None
-            if group and user:
-                group_user: Optional[GroupUser] = await get_group_user(session, group.group_id, user.user_id)  # type: ignore
-                if not group_user:
-                    await create_group_user(session, group.group_id, user.user_id, user_info.user_displayname)
-            else:
-                logger.warning(f"Group {group_id} or user {user_id} not found in database.")
-        # 如果是消息事件，更新用户的最新消息
-        if hasattr(event, 'get_message') and user:
-            message = event.get_message()
-            await update_user(session, user, last_message=str(message), last_message_time=datetime.now())
-async def update_user_avatar_description(session, user_id: int, avatar_url: str):
-    """更新用户头像描述"""
-    try:
-        image_data = await download_image(avatar_url)
-        if image_data:
-            image = Image.open(BytesIO(image_data))
-            # 计算图像哈希值并保存到数据库（如果不存在）
-            image_hash = image_processor.calculate_image_hash(image)
-            # 生成图像描述（如果不存在）
-            _, image_info = await image_processor.process_image("", image_hash)
-            # 更新用户头像描述
-            user = await session.get(User, user_id)
-            if user:
-                user.avatar_description = image_info['description']
-                await session.commit()
-    except Exception as e:
-        logger.error(
-            f"Error updating avatar description for user {user_id}: {str(e)}")
-
-async def download_image(url: str) -> Optional[bytes]:
-    """下载图片"""
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                if response.status == 200:
-                    return await response.read()
-    except Exception as e:
-        logger.error(f"Error downloading image from {url}: {str(e)}")
-    return None
+            try:
+                self.queue.put_nowait(user_id)
+            except asyncio.QueueFull:
+                logger.warning(f"Avatar queue is full, skipping user {user_id}")
+                return
+        self.queued[user_id] = avatar_url
+
+    async def _run(self):
+        while True:
+            user_id = await self.queue.get()
+            avatar_url = self.queued.pop(user_id, None)
+            try:
+                if avatar_url:
+                    await self.describe(user_id, avatar_url)
+            except Exception as e:
+                logger.error(
+                    f"Error updating avatar description for user {user_id}: {str(e)}")
+            finally:
+                self.queue.task_done()
+
+    async def describe(self, user_id: int, avatar_url: str):
+        """更新用户头像描述"""
+        async with get_session() as session:
+            user = await get_user(session, user_id)
+            if not user:
+                return
+            # 地址未变化且已有描述，在重新检查间隔内跳过
+            if user.avatar == avatar_url and user.avatar_description and (user_id, avatar_url) in self.checked:
+                return
+            known_hash = user.avatar_hash if user.avatar_description else None
+        try:
+            # 头像需要计算感知哈希，不按 MD5 提前结束
+            result = await image_downloader.fetch(avatar_url)
+        except ImageDownloadError as e:
+            logger.error(f"Error downloading image from {avatar_url}: {str(e)}")
+            return
+        image_data = result.data
+        self.checked[(user_id, avatar_url)] = True
+        try:
+            avatar_hash = await image_processor.perceptual_hash(image_data)
+        except Exception as e:
+            logger.error(f"Error hashing avatar: {str(e)}")
+            return
+        if avatar_hash == known_hash:
+            return
+        # 复用相同图片已有的描述
+        md5 = result.hash
+        image_info = await get_image_by_hash(md5)
+        if image_info and image_info['description'] is None:
+            # 同一图片以消息图片入库但尚未识别
+            image_info = await image_captioner.caption(md5)
+            if not image_info:
+                return
+        if not image_info:
+            image_info = await self._caption(image_data, md5, avatar_hash)
+            if not image_info:
+                return
+        async with get_session() as session:
+            await set_user_avatar_description(session, user_id, image_info['description'], avatar_hash)
+        logger.debug(f"Avatar description updated for user {user_id}")
+
+    async def _caption(self, image_data: bytes, md5: str, phash: Optional[str] = None) -> Optional[Dict]:
+        # 头像识别单独限速，避免挤占聊天图片的 VL 调用
+        delay = self._next_caption_time - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self._next_caption_time = time.monotonic() + plugin_config.AVATAR_CAPTION_INTERVAL
+        success, image_info = await image_processor.process_image_data(image_data, md5)
+        if not success:
+            return None
+        # 头像的感知哈希与图片记录的 pHash 相同，一并保存供近似重复检索
+        await add_image_record(dict(image_info, phash=phash))
+        return image_info
+
+
+avatar_describer = AvatarDescriber()
+
@@ -1,12 +1,14 @@
 # nonebot_plugin_real_netizens\group_config_manager.py
 
 import os
-from typing import Callable, Dict, List, Optional
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, Optional
 
 from nonebot.log import logger
 from nonebot_plugin_datastore import get_session
 from pydantic import BaseModel
-from sqlalchemy import delete, select
+from sqlalchemy import and_, delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from .db.models import GroupConfig as DBGroupConfig
 from .db.models import GroupWorldbook
@@ -71,25 +73,33 @@ class GroupConfigManager:
     async def load_configs(self):
         """
         从数据库加载所有群组配置。
+
+        群组配置与已启用的世界书通过一次外连接查询取出，避免逐个群组查询世界书。
         """
         try:
             async with get_session() as session:
-                group_configs = (await session.scalars(select(DBGroupConfig))).all()
-                for db_config in group_configs:
-                    worldbooks = (await session.scalars(
-                        select(GroupWorldbook).where(
-                            GroupWorldbook.group_id == db_config.group_id,
-                            GroupWorldbook.enabled == True,
+                result = await session.execute(
+                    select(DBGroupConfig, GroupWorldbook.worldbook_name)
+                    .outerjoin(GroupWorldbook, and_(
+                        GroupWorldbook.group_id == DBGroupConfig.group_id,
+                        GroupWorldbook.enabled == True,
+                    ))
+                    .order_by(DBGroupConfig.group_id, GroupWorldbook.id)
+                )
+                configs: Dict[int, GroupConfig] = {}
+                for db_config, worldbook_name in result.all():
+                    config = configs.get(db_config.group_id)
+                    if config is None:
+                        config = configs[db_config.group_id] = GroupConfig(
+                            group_id=db_config.group_id,
+                            character_id=db_config.character_id,
+                            preset_name=db_config.preset_name,
+                            inactive_threshold=db_config.inactive_threshold,
                         )
-                    )).all()
-                    self.configs[db_config.group_id] = GroupConfig(
-                        group_id=db_config.group_id,
-                        character_id=db_config.character_id,
-                        preset_name=db_config.preset_name,
-                        worldbook_names=[
-                            worldbook.worldbook_name for worldbook in worldbooks],
-                        inactive_threshold=db_config.inactive_threshold,
-                    )
+                    if worldbook_name is not None and worldbook_name not in config.worldbook_names:
+                        config.worldbook_names.append(worldbook_name)
+            self.configs.update(configs)
+            logger.info(f"Loaded {len(configs)} group configs")
         except Exception as e:
             logger.error(f"Failed to load group configs: {e}")
 
@@ -107,45 +117,153 @@ class GroupConfigManager:
             self.configs[group_id] = GroupConfig(group_id=group_id)
         return self.configs[group_id]
 
-    async def update_group_config(self, config: GroupConfig):
+    async def update_group_config(self, config: GroupConfig) -> bool:
         """
         更新指定群组的配置。
 
         Args:
             config: 新的群组配置对象。
+
+        Returns:
+            更新成功返回 True，否则返回 False。
+        """
+        return await self.update_group_configs([config])
+
+    async def update_group_configs(self, configs: List[GroupConfig]) -> bool:
+        """
+        在一个事务中更新多个群组的配置。
+
+        世界书只增删发生变化的记录，未变化的记录保持不动。
+
+        Args:
+            configs: 新的群组配置对象列表。
+
+        Returns:
+            更新成功返回 True，否则返回 False。
         """
+        if not configs:
+            return True
+        group_ids = [config.group_id for config in configs]
         try:
             async with get_session() as session:
-                db_config = await session.get(DBGroupConfig, config.group_id)
-                if not db_config:
-                    # 新创建的群组配置，使用全局默认值
-                    db_config = DBGroupConfig(
-                        group_id=config.group_id,
-                        character_id=config.character_id or "default_character",  # 使用 config 的值或全局默认值
-                        preset_name=config.preset_name or "default_preset",
-                        inactive_threshold=config.inactive_threshold
-                    )
-                else:
-                    # 已存在的群组配置
-                    if config.character_id is not None:  # 如果 config 中提供了新值
-                        db_config.character_id = config.character_id
-                    if config.preset_name is not None:
-                        db_config.preset_name = config.preset_name
-                    db_config.inactive_threshold = config.inactive_threshold
-
-                await session.execute(delete(GroupWorldbook).where(GroupWorldbook.group_id == config.group_id))
-                for worldbook_name in config.worldbook_names:
-                    session.add(GroupWorldbook(
-                        group_id=config.group_id,
-                        worldbook_name=worldbook_name,
-                        enabled=True,
-                    ))
+                db_configs = {
+                    db_config.group_id: db_config
+                    for db_config in (await session.scalars(
+                        select(DBGroupConfig).where(DBGroupConfig.group_id.in_(group_ids))
+                    )).all()
+                }
+                worldbook_rows: Dict[int, List[GroupWorldbook]] = defaultdict(list)
+                for row in (await session.scalars(
+                    select(GroupWorldbook)
+                    .where(GroupWorldbook.group_id.in_(group_ids))
+                    .order_by(GroupWorldbook.id)
+                )).all():
+                    worldbook_rows[row.group_id].append(row)
+
+                for config in configs:
+                    db_config = db_configs.get(config.group_id)
+                    if not db_config:
+                        # 新创建的群组配置，使用全局默认值
+                        db_config = DBGroupConfig(
+                            group_id=config.group_id,
+                            character_id=config.character_id or "default_character",  # 使用 config 的值或全局默认值
+                            preset_name=config.preset_name or "default_preset",
+                            inactive_threshold=config.inactive_threshold
+                        )
+                        session.add(db_config)
+                        db_configs[config.group_id] = db_config
+                    else:
+                        # 已存在的群组配置
+                        if config.character_id is not None:  # 如果 config 中提供了新值
+                            db_config.character_id = config.character_id
+                        if config.preset_name is not None:
+                            db_config.preset_name = config.preset_name
+                        db_config.inactive_threshold = config.inactive_threshold
+                    await self._sync_worldbooks(
+                        session, config.group_id, config.worldbook_names, worldbook_rows[config.group_id])
                 await session.commit()
+        except Exception as e:
+            logger.error(f"Failed to update group config: {e}")
+            return False
 
+        for config in configs:
             self.configs[config.group_id] = config
             self.notify_observers(config.group_id)  # 通知观察者
-        except Exception as e:
-            logger.error(f"Failed to update group config: {e}")
+        return True
+
+    @staticmethod
+    async def _sync_worldbooks(
+        session: AsyncSession, group_id: int, names: List[str], rows: List[GroupWorldbook]
+    ):
+        """
+        将群组的世界书记录与目标列表对齐。
+
+        已有记录按需启用，多余或重复的记录删除，缺少的记录新增。
+        """
+        wanted = set(names)
+        seen = set()
+        stale_ids = []
+        for row in rows:
+            if row.worldbook_name in wanted and row.worldbook_name not in seen:
+                seen.add(row.worldbook_name)
+                if not row.enabled:
+                    row.enabled = True
+            else:
+                stale_ids.append(row.id)
+        if stale_ids:
+            await session.execute(delete(GroupWorldbook).where(GroupWorldbook.id.in_(stale_ids)))
+        for worldbook_name in names:
+            if worldbook_name not in seen:
+                seen.add(worldbook_name)
+                session.add(GroupWorldbook(
+                    group_id=group_id,
+                    worldbook_name=worldbook_name,
+                    enabled=True,
+                ))
+
+    async def apply_to_groups(
+        self,
+        group_ids: List[int],
+        character_id: Optional[str] = None,
+        preset_name: Optional[str] = None,
+        enable_worldbooks: Iterable[str] = (),
+        disable_worldbooks: Iterable[str] = (),
+        inactive_threshold: Optional[int] = None,
+    ) -> bool:
+        """
+        将同一组配置变更应用到多个群组，在一个事务中完成。
+
+        未提供的参数保持各群组原有的值。
+
+        Args:
+            group_ids: 群组 ID 列表。
+            character_id: 角色卡 ID。
+            preset_name: 预设名称。
+            enable_worldbooks: 要启用的世界书名称。
+            disable_worldbooks: 要禁用的世界书名称。
+            inactive_threshold: 非活跃阈值（秒）。
+
+        Returns:
+            更新成功返回 True，否则返回 False。
+        """
+        enable_worldbooks = list(enable_worldbooks)
+        disable_worldbooks = set(disable_worldbooks)
+        configs = []
+        for group_id in dict.fromkeys(group_ids):
+            current = self.get_group_config(group_id)
+            worldbook_names = [
+                name for name in current.worldbook_names if name not in disable_worldbooks]
+            worldbook_names += [
+                name for name in dict.fromkeys(enable_worldbooks) if name not in worldbook_names]
+            configs.append(GroupConfig(
+                group_id=group_id,
+                character_id=character_id if character_id is not None else current.character_id,
+                preset_name=preset_name if preset_name is not None else current.preset_name,
+                worldbook_names=worldbook_names,
+                inactive_threshold=(
+                    inactive_threshold if inactive_threshold is not None else current.inactive_threshold),
+            ))
+        return await self.update_group_configs(configs)
 
     def get_all_groups(self) -> List[int]:
         """
@@ -167,16 +285,42 @@ class GroupConfigManager:
         Returns:
             设置成功返回 True，否则返回 False。
         """
-        config = self.get_group_config(group_id)
+        return await self.set_preset_for_groups([group_id], preset_name)
+
+    async def set_preset_for_groups(self, group_ids: List[int], preset_name: str) -> bool:
+        """
+        为多个群组设置同一个预设。
+
+        Args:
+            group_ids: 群组 ID 列表。
+            preset_name: 预设名称。
+
+        Returns:
+            设置成功返回 True，否则返回 False。
+        """
         # 使用绝对路径拼接预设文件路径
         preset_path = os.path.join(
             self.res_path, 'preset', f"{preset_name}.json")
         if os.path.exists(preset_path):
-            config.preset_name = preset_name
-            await self.update_group_config(config)
-            return True
+            return await self.apply_to_groups(group_ids, preset_name=preset_name)
         return False
 
+    def missing_worldbooks(self, worldbook_names: List[str]) -> List[str]:
+        """
+        检查世界书文件是否存在。
+
+        Args:
+            worldbook_names: 世界书名称列表。
+
+        Returns:
+            不存在的世界书名称列表。
+        """
+        # 使用绝对路径拼接世界书文件路径
+        return [
+            name for name in worldbook_names
+            if not os.path.exists(os.path.join(self.res_path, 'world', f"{name}.json"))
+        ]
+
     async def enable_worldbook(self, group_id: int, worldbook_name: str) -> bool:
         """
         启用指定群组的世界书。
@@ -188,16 +332,26 @@ class GroupConfigManager:
         Returns:
             启用成功返回 True，否则返回 False。
         """
-        config = self.get_group_config(group_id)
-        # 使用绝对路径拼接世界书文件路径
-        worldbook_path = os.path.join(
-            self.res_path, 'world', f"{worldbook_name}.json")
-        if os.path.exists(worldbook_path):
-            if worldbook_name not in config.worldbook_names:
-                config.worldbook_names.append(worldbook_name)
-                await self.update_group_config(config)
+        if self.missing_worldbooks([worldbook_name]):
+            return False
+        if worldbook_name in self.get_group_config(group_id).worldbook_names:
             return True
-        return False
+        return await self.enable_worldbooks([group_id], [worldbook_name])
+
+    async def enable_worldbooks(self, group_ids: List[int], worldbook_names: List[str]) -> bool:
+        """
+        为多个群组启用多个世界书，在一个事务中完成。
+
+        Args:
+            group_ids: 群组 ID 列表。
+            worldbook_names: 世界书名称列表。
+
+        Returns:
+            启用成功返回 True，有世界书不存在或写入失败返回 False。
+        """
+        if not worldbook_names or self.missing_worldbooks(worldbook_names):
+            return False
+        return await self.apply_to_groups(group_ids, enable_worldbooks=worldbook_names)
 
     async def disable_worldbook(self, group_id: int, worldbook_name: str) -> bool:
         """
@@ -210,12 +364,24 @@ class GroupConfigManager:
         Returns:
             禁用成功返回 True，否则返回 False。
         """
-        config = self.get_group_config(group_id)
-        if worldbook_name in config.worldbook_names:
-            config.worldbook_names.remove(worldbook_name)
-            await self.update_group_config(config)
-            return True
-        return False
+        if worldbook_name not in self.get_group_config(group_id).worldbook_names:
+            return False
+        return await self.disable_worldbooks([group_id], [worldbook_name])
+
+    async def disable_worldbooks(self, group_ids: List[int], worldbook_names: List[str]) -> bool:
+        """
+        为多个群组禁用多个世界书，在一个事务中完成。
+
+        Args:
+            group_ids: 群组 ID 列表。
+            worldbook_names: 世界书名称列表。
+
+        Returns:
+            禁用成功返回 True，否则返回 False。
+        """
+        if not worldbook_names:
+            return False
+        return await self.apply_to_groups(group_ids, disable_worldbooks=worldbook_names)
 
     async def set_character(self, group_id: int, character_name: str) -> bool:
         """
@@ -228,11 +394,21 @@ class GroupConfigManager:
         Returns:
             设置成功返回 True，否则返回 False。
         """
-        config = self.get_group_config(group_id)
+        return await self.set_character_for_groups([group_id], character_name)
+
+    async def set_character_for_groups(self, group_ids: List[int], character_name: str) -> bool:
+        """
+        为多个群组设置同一个角色卡。
+
+        Args:
+            group_ids: 群组 ID 列表。
+            character_name: 角色卡名称。
+
+        Returns:
+            设置成功返回 True，否则返回 False。
+        """
         if character_card_loader.get_resource(character_name):
-            config.character_id = character_name
-            await self.update_group_config(config)
-            return True
+            return await self.apply_to_groups(group_ids, character_id=character_name)
         return False
 
 
@@ -0,0 +1,129 @@
+# nonebot_plugin_real_netizens\image_cache.py
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+from cachetools import LRUCache
+from nonebot.log import logger
+
+from .cache_snapshot import cache_snapshot
+from .config import plugin_config
+
+
+class ImageCache:
+    """
+    图片识别结果的进程内缓存。
+
+    images 按 MD5 保存图片信息，aliases 保存消息段文件 ID 对应的 MD5，均按 LRU 淘汰。
+    识别失败的图片按 MD5 和文件 ID 记入 failures，在 negative_ttl 内再次出现时直接跳过，
+    不再查询数据库或调用 VL 模型。所有修改图片记录的地方（写入延迟识别的描述等）
+    都会同时更新缓存，因此命中的缓存无需与数据库核对；从快照恢复时则需要逐条核对。
+    """
+
+    def __init__(self, maxsize: int, negative_ttl: float):
+        self.maxsize = maxsize
+        self.negative_ttl = negative_ttl
+        self.images: LRUCache = LRUCache(maxsize=max(maxsize, 1))
+        self.aliases: LRUCache = LRUCache(maxsize=max(maxsize, 1))
+        # 键 -> 过期时间（time.time()），按写入顺序排列
+        self.failures: "OrderedDict[str, float]" = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0
+
+    def get(self, image_hash: str) -> Optional[Dict]:
+        if not self.enabled:
+            return None
+        return self.images.get(image_hash)
+
+    def put(self, image_info: Dict, file_id: Optional[str] = None):
+        if not self.enabled:
+            return
+        image_hash = image_info["hash"]
+        self.images[image_hash] = image_info
+        self.failures.pop(image_hash, None)
+        if file_id:
+            self.aliases[file_id] = image_hash
+            self.failures.pop(file_id, None)
+
+    def get_by_file_id(self, file_id: str) -> Optional[Dict]:
+        if not self.enabled:
+            return None
+        image_hash = self.aliases.get(file_id)
+        return self.images.get(image_hash) if image_hash else None
+
+    def mark_failed(self, *keys: Optional[str]):
+        """记录识别失败的图片 MD5 或文件 ID"""
+        if not self.enabled or self.negative_ttl <= 0:
+            return
+        expires = time.time() + self.negative_ttl
+        for key in keys:
+            if key:
+                self.failures.pop(key, None)
+                self.failures[key] = expires
+        while len(self.failures) > self.maxsize:
+            self.failures.popitem(last=False)
+
+    def is_failed(self, key: Optional[str]) -> bool:
+        if not key:
+            return False
+        expires = self.failures.get(key)
+        if expires is None:
+            return False
+        if expires <= time.time():
+            del self.failures[key]
+            return False
+        return True
+
+    def warm_up(self, images: Iterable[Dict]):
+        """用最近的图片记录预热缓存，images 按时间从旧到新排列"""
+        count = 0
+        for image_info in images:
+            if image_info["hash"] not in self.images:
+                self.images[image_info["hash"]] = image_info
+                count += 1
+        logger.info(f"Image cache warmed up with {count} images")
+
+    def dump(self) -> Dict:
+        now = time.time()
+        return {
+            "images": list(self.images.items()),
+            "aliases": list(self.aliases.items()),
+            "failures": [(key, expires) for key, expires in self.failures.items() if expires > now],
+        }
+
+    async def restore(self, data: Dict):
+        """
+        从快照恢复缓存，已有的条目不会被覆盖。
+
+        快照只决定恢复哪些条目：图片按数据库中的当前记录恢复，已删除的跳过；
+        文件 ID 只在数据库中仍指向同一图片时恢复。
+        """
+        if not self.enabled:
+            return
+        # database 模块依赖 image_cache，在函数内导入避免循环导入
+        from .db.database import get_image_aliases, get_images_by_hashes
+        from .db.unit_of_work import use_session
+        images = [(image_hash, image_info) for image_hash, image_info in data.get("images", [])
+                  if image_hash not in self.images]
+        aliases = [(file_id, image_hash) for file_id, image_hash in data.get("aliases", [])
+                   if file_id not in self.aliases]
+        async with use_session() as session:
+            stored_images = await get_images_by_hashes(session, [image_hash for image_hash, _ in images])
+            stored_aliases = await get_image_aliases(session, [file_id for file_id, _ in aliases])
+        for image_hash, _ in images:
+            if image_hash in stored_images:
+                self.images[image_hash] = stored_images[image_hash]
+        for file_id, image_hash in aliases:
+            if stored_aliases.get(file_id) == image_hash:
+                self.aliases[file_id] = image_hash
+        now = time.time()
+        failures: Iterable[Tuple[str, float]] = data.get("failures", [])
+        for key, expires in failures:
+            if expires > now and key not in self.failures:
+                self.failures[key] = expires
+
+
+image_cache = ImageCache(plugin_config.IMAGE_CACHE_SIZE, plugin_config.IMAGE_NEGATIVE_TTL)
+cache_snapshot.register("images", image_cache.dump, image_cache.restore)
@@ -0,0 +1,206 @@
+# nonebot_plugin_real_netizens\image_captioner.py
+import asyncio
+import os
+import re
+import time
+from collections import OrderedDict
+from itertools import islice
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from nonebot.log import logger
+
+from .config import plugin_config
+from .db.database import get_image_by_hash, get_images_without_description, set_image_description
+from .db.unit_of_work import detach_unit, use_session
+from .image_cache import image_cache
+from .image_processor import image_processor, unsaved_image_path
+
+# 消息中尚未识别的图片引用
+IMAGE_REFERENCE_PATTERN = re.compile(r"\[图片:([0-9a-f]{32})\]")
+# 图片识别失败或超时时在提示词中的写法
+UNKNOWN_IMAGE = "[图片]"
+
+
+def image_reference(image_hash: str) -> str:
+    return f"[图片:{image_hash}]"
+
+
+def format_image_description(image_info: Dict) -> str:
+    """将图片信息写成消息中的描述，尚未识别的图片写成引用"""
+    if image_info.get("description") is None:
+        return image_reference(image_info["hash"])
+    description = f"[图片描述: {image_info['description']}]"
+    if image_info.get("is_meme"):
+        description += f"[表情包情绪: {image_info['emotion_tag']}]"
+    return description
+
+
+class ImageCaptioner:
+    """
+    延迟图片识别。
+
+    lazy 模式下新图片入库时只保存文件和不带描述的记录，消息中写入图片引用；
+    消息进入提示词（回复、摘要、检索）前由 resolve 识别引用的图片并替换为描述。
+    大多数消息不会触发回复，这样只有真正用到的图片才调用 VL 模型。
+    其余图片由后台任务在一段时间没有按需识别后分批补齐。
+    识别完成后通知 register_observer 注册的回调，由其将消息中的引用改写为描述并重新索引。
+    """
+
+    def __init__(self, mode: str, idle_seconds: float, interval: float, timeout: float):
+        self.mode = mode
+        self.idle_seconds = idle_seconds
+        self.interval = interval
+        self.timeout = timeout
+        # 待识别的图片：MD5 -> 文件路径，按入库顺序排列
+        self.pending: "OrderedDict[str, str]" = OrderedDict()
+        self.inflight: Dict[str, asyncio.Task] = {}
+        self._last_demand = 0.0
+        # 在 start 中创建：Python 3.8/3.9 的 Event 在创建时绑定事件循环，模块导入时循环尚未运行
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self.observers: List[Callable[[Dict], Awaitable[None]]] = []
+        # 后台运行的回调任务，保持引用避免被回收
+        self._tasks = set()
+
+    @property
+    def lazy(self) -> bool:
+        return self.mode == "lazy"
+
+    def start(self):
+        """启动后台补齐任务"""
+        if self.lazy and (self._worker is None or self._worker.done()):
+            if self._wakeup is None:
+                self._wakeup = asyncio.Event()
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止后台补齐任务"""
+        if self._worker:
+            self._worker.cancel()
+            self._worker = None
+
+    def register_observer(self, observer: Callable[[Dict], Awaitable[None]]):
+        """注册图片描述写入后的回调，回调在后台任务中执行，应自行处理异常"""
+        self.observers.append(observer)
+
+    def enqueue(self, image_hash: str, file_path: str):
+        """登记尚未识别的图片，由后台任务在空闲时识别"""
+        self.pending[image_hash] = file_path
+        self._wake()
+
+    def _wake(self):
+        # 后台任务启动前无需唤醒，启动后会先检查 pending
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def load(self, limit: int = 10000):
+        """从数据库加载上次运行时未识别完的图片"""
+        if not self.lazy:
+            return
+        async with use_session() as session:
+            rows = await get_images_without_description(session, limit)
+        for image_hash, file_path in rows:
+            self.pending.setdefault(image_hash, file_path)
+        if rows:
+            self._wake()
+            logger.info(f"{len(rows)} images waiting for captions")
+
+    async def caption(self, image_hash: str) -> Optional[Dict]:
+        """识别图片并写入描述，同一图片同时只识别一次。已有描述时直接返回"""
+        task = self.inflight.get(image_hash)
+        if task is None:
+            task = asyncio.create_task(self._caption(image_hash))
+            self.inflight[image_hash] = task
+            task.add_done_callback(lambda _: self.inflight.pop(image_hash, None))
+        return await asyncio.shield(task)
+
+    async def _caption(self, image_hash: str) -> Optional[Dict]:
+        # 可能由多个流程同时等待，不能使用发起者所在工作单元的会话
+        detach_unit()
+        image_info = await get_image_by_hash(image_hash)
+        if image_info is None or image_info["description"] is not None:
+            self.pending.pop(image_hash, None)
+            return image_info
+        if image_cache.is_failed(image_hash):
+            return None
+        file_path = self.pending.pop(image_hash, None) or image_info["file_path"]
+        success, result = await image_processor.process_image(file_path, image_hash)
+        if not success:
+            image_cache.mark_failed(image_hash)
+            return None
+        image_info = dict(image_info, description=result["description"], is_meme=result["is_meme"],
+                          emotion_tag=result["emotion_tag"])
+        # 图片只为延迟识别保存时，识别完成后删除，记录改为未保存
+        if not plugin_config.IMAGE_SAVE_ENABLED:
+            image_info["file_path"] = unsaved_image_path(image_hash)
+        async with use_session() as session:
+            await set_image_description(session, image_info)
+        for observer in self.observers:
+            task = asyncio.create_task(observer(image_info))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        if not plugin_config.IMAGE_SAVE_ENABLED:
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
+        return image_info
+
+    async def resolve(self, text: str) -> str:
+        """将文本中的图片引用替换为描述，尚未识别的图片最多等待 timeout 秒"""
+        hashes = list(dict.fromkeys(IMAGE_REFERENCE_PATTERN.findall(text or "")))
+        if not hashes:
+            return text
+        self._last_demand = time.monotonic()
+        tasks = {image_hash: asyncio.ensure_future(self.caption(image_hash)) for image_hash in hashes}
+        done, _ = await asyncio.wait(tasks.values(), timeout=self.timeout)
+        descriptions = {}
+        for image_hash, task in tasks.items():
+            image_info = None
+            if task in done:
+                if task.exception() is not None:
+                    logger.error(f"Error captioning image {image_hash}: {task.exception()}")
+                else:
+                    image_info = task.result()
+            descriptions[image_hash] = (
+                format_image_description(image_info)
+                if image_info and image_info["description"] is not None else UNKNOWN_IMAGE)
+        return IMAGE_REFERENCE_PATTERN.sub(lambda match: descriptions[match.group(1)], text)
+
+    async def resolve_messages(self, messages: List[Dict]) -> List[Dict]:
+        """替换消息列表中的图片引用，返回新的列表，不修改传入的消息"""
+        contents = await asyncio.gather(*(self.resolve(message["content"]) for message in messages))
+        return [
+            message if content == message["content"] else dict(message, content=content)
+            for message, content in zip(messages, contents)
+        ]
+
+    async def _run(self):
+        while True:
+            if not self.pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            # 最近有按需识别时让出 VL 模型，空闲一段时间后再补齐
+            idle = time.monotonic() - self._last_demand
+            if idle < self.idle_seconds or self.inflight:
+                await asyncio.sleep(max(self.idle_seconds - idle, 1))
+                continue
+            # 一次取出可合并为一个请求的图片数
+            hashes = list(islice(self.pending, image_processor.batch_size))
+            results = await asyncio.gather(*(self.caption(image_hash) for image_hash in hashes),
+                                           return_exceptions=True)
+            for image_hash, result in zip(hashes, results):
+                if isinstance(result, Exception):
+                    logger.error(f"Error captioning image {image_hash} in background: {str(result)}")
+                if result is None or isinstance(result, Exception):
+                    self.pending.pop(image_hash, None)
+            await asyncio.sleep(self.interval)
+
+
+image_captioner = ImageCaptioner(
+    mode=plugin_config.IMAGE_CAPTION_MODE,
+    idle_seconds=plugin_config.IMAGE_CAPTION_IDLE_SECONDS,
+    interval=plugin_config.IMAGE_CAPTION_INTERVAL,
+    timeout=plugin_config.IMAGE_CAPTION_TIMEOUT,
+)
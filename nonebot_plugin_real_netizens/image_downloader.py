@@ -0,0 +1,185 @@
+# nonebot_plugin_real_netizens\image_downloader.py
+import asyncio
+import base64
+import binascii
+import hashlib
+import re
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Optional
+
+import aiohttp
+
+from .config import plugin_config
+
+# QQ 图片的文件名和旧版图片链接中带有大写的 MD5
+_MD5_PATTERN = re.compile(r"(?<![0-9a-fA-F])([0-9a-fA-F]{32})(?![0-9a-fA-F])")
+# 部分服务器不返回或返回不准确的类型，这些类型仍按图片处理
+_GENERIC_CONTENT_TYPES = ("application/octet-stream", "binary/octet-stream")
+
+
+class ImageDownloadError(Exception):
+    """图片下载失败、超过大小限制或不是图片"""
+
+
+@dataclass
+class DownloadResult:
+    """
+    图片下载结果。
+
+    Attributes:
+        hash: 图片内容的 MD5。
+        data: 图片数据，命中缓存提前结束时为 None。
+        cached: 命中缓存时 lookup 返回的值。
+    """
+    hash: str
+    data: Optional[bytes] = None
+    cached: Any = None
+
+
+def extract_md5(*candidates: Optional[str]) -> Optional[str]:
+    """从文件名或链接中提取 MD5，找不到时返回 None"""
+    for candidate in candidates:
+        if candidate:
+            match = _MD5_PATTERN.search(candidate)
+            if match:
+                return match.group(1).lower()
+    return None
+
+
+def _header_md5(headers) -> Optional[str]:
+    """从 Content-MD5 或形如 MD5 的 ETag 响应头中获取内容哈希"""
+    content_md5 = headers.get("Content-MD5")
+    if content_md5:
+        try:
+            return base64.b64decode(content_md5, validate=True).hex()
+        except (binascii.Error, ValueError):
+            pass
+    etag = headers.get("ETag", "").strip('W/"')
+    if len(etag) == 32:
+        return extract_md5(etag)
+    return None
+
+
+class ImageDownloader:
+    """
+    共享的图片下载器。
+
+    所有下载复用同一个连接池，按主机限制并发连接数。下载时分块读取并同时计算 MD5，
+    超过大小限制或响应不是图片时立即中止。提供 lookup 时，
+    依次用链接中的 MD5、响应头中的 MD5 和下载完成后的 MD5 查询缓存，命中即结束。
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        timeout: float,
+        limit: int,
+        limit_per_host: int,
+        chunk_size: int = 64 * 1024,
+    ):
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.chunk_size = chunk_size
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.limit, limit_per_host=self.limit_per_host, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=self.timeout, sock_connect=min(self.timeout, 10)),
+            )
+        return self._session
+
+    async def fetch(
+        self,
+        url: str,
+        lookup: Optional[Callable[[str], Awaitable[Any]]] = None,
+        hint: Optional[str] = None,
+    ) -> DownloadResult:
+        """
+        下载图片。
+
+        Args:
+            url: 图片链接，支持 base64:// 内联数据。
+            lookup: 按 MD5 查询缓存的协程函数，返回 None 表示未命中。
+            hint: 可能包含 MD5 的文件名，例如消息段中的 file 字段。
+
+        Raises:
+            ImageDownloadError: 下载失败、超时、超过大小限制或不是图片。
+        """
+        known = extract_md5(hint, url)
+        if known and lookup is not None:
+            cached = await lookup(known)
+            if cached is not None:
+                return DownloadResult(known, cached=cached)
+        if url.startswith("base64://"):
+            return await self._decode_inline(url[len("base64://"):], lookup)
+
+        try:
+            async with self._get_session().get(url) as resp:
+                if resp.status != 200:
+                    raise ImageDownloadError(f"HTTP {resp.status}")
+                content_type = resp.headers.get("Content-Type", "").split(";")[0].strip().lower()
+                if content_type and not content_type.startswith("image/") \
+                        and content_type not in _GENERIC_CONTENT_TYPES:
+                    raise ImageDownloadError(f"unexpected content type {content_type}")
+                if resp.content_length is not None and resp.content_length > self.max_bytes:
+                    raise ImageDownloadError(
+                        f"image is {resp.content_length} bytes, limit is {self.max_bytes}")
+                header_md5 = _header_md5(resp.headers)
+                if header_md5 and header_md5 != known and lookup is not None:
+                    cached = await lookup(header_md5)
+                    if cached is not None:
+                        return DownloadResult(header_md5, cached=cached)
+
+                digest = hashlib.md5()
+                buffer = bytearray()
+                async for chunk in resp.content.iter_chunked(self.chunk_size):
+                    if len(buffer) + len(chunk) > self.max_bytes:
+                        raise ImageDownloadError(f"image exceeds {self.max_bytes} bytes")
+                    digest.update(chunk)
+                    buffer += chunk
+        except asyncio.TimeoutError:
+            raise ImageDownloadError(f"timed out after {self.timeout}s")
+        except aiohttp.ClientError as e:
+            raise ImageDownloadError(str(e)) from e
+
+        image_hash = digest.hexdigest()
+        if lookup is not None and image_hash not in (known, header_md5):
+            cached = await lookup(image_hash)
+            if cached is not None:
+                return DownloadResult(image_hash, cached=cached)
+        return DownloadResult(image_hash, bytes(buffer))
+
+    async def _decode_inline(
+        self, encoded: str, lookup: Optional[Callable[[str], Awaitable[Any]]]
+    ) -> DownloadResult:
+        # base64 编码后约为原始大小的 4/3
+        if len(encoded) > self.max_bytes * 4 // 3 + 4:
+            raise ImageDownloadError(f"image exceeds {self.max_bytes} bytes")
+        try:
+            data = base64.b64decode(encoded)
+        except (binascii.Error, ValueError) as e:
+            raise ImageDownloadError(f"invalid base64 image: {e}") from e
+        image_hash = hashlib.md5(data).hexdigest()
+        if lookup is not None:
+            cached = await lookup(image_hash)
+            if cached is not None:
+                return DownloadResult(image_hash, cached=cached)
+        return DownloadResult(image_hash, data)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+image_downloader = ImageDownloader(
+    max_bytes=plugin_config.IMAGE_DOWNLOAD_MAX_BYTES,
+    timeout=plugin_config.IMAGE_DOWNLOAD_TIMEOUT,
+    limit=plugin_config.IMAGE_DOWNLOAD_CONCURRENCY,
+    limit_per_host=plugin_config.IMAGE_DOWNLOAD_PER_HOST,
+)
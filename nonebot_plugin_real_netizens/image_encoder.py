@@ -0,0 +1,240 @@
+# nonebot_plugin_real_netizens\image_encoder.py
+import base64
+import math
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image, features
+from nonebot.log import logger
+
+# 本模块的函数在图片工作池中执行，只依赖 PIL，便于进程池 pickle
+
+
+@dataclass(frozen=True)
+class ModelImageCost:
+    """
+    多模态模型的图片 token 计费方式。
+
+    Attributes:
+        kind: patch 按 unit 像素的方块计数；tile 先缩放再按 unit 像素的瓦片计数（OpenAI）；
+            pixels 按像素数除以 unit（Claude）；fixed 每张图片固定 tokens（Gemini 1.5）。
+        unit: 方块、瓦片边长或像素除数。
+        tokens: 每个方块、瓦片的 token 数，fixed 时为每张图片的 token 数。
+        base: 每张图片额外的 token 数。
+        webp: 接口是否接受 WebP。
+    """
+    kind: str
+    unit: int = 0
+    tokens: int = 1
+    base: int = 0
+    webp: bool = False
+
+
+# 按模型名称中包含的关键字匹配，越靠前越优先
+MODEL_IMAGE_COSTS: List[Tuple[str, ModelImageCost]] = [
+    ("qwen", ModelImageCost("patch", unit=28, tokens=1, base=2, webp=True)),
+    ("gpt-4o", ModelImageCost("tile", unit=512, tokens=170, base=85, webp=True)),
+    ("gpt-4.1", ModelImageCost("tile", unit=512, tokens=170, base=85, webp=True)),
+    ("claude", ModelImageCost("pixels", unit=750, webp=True)),
+    ("gemini", ModelImageCost("fixed", tokens=258, webp=True)),
+]
+# 未知模型按 28 像素方块估算，只发送 JPEG
+DEFAULT_IMAGE_COST = ModelImageCost("patch", unit=28, tokens=1, base=2)
+
+
+@dataclass(frozen=True)
+class EncodeProfile:
+    """一类图片的编码参数，scale 为尺寸上限相对 MAX_IMAGE_SIZE 的倍数"""
+    scale: float
+    quality: int
+    token_budget: int
+    webp: bool
+
+
+# 表情包很小，缩小不影响识别；截图需要保留文字的清晰度；照片保持原有的尺寸上限
+ENCODE_PROFILES: Dict[str, EncodeProfile] = {
+    "sticker": EncodeProfile(scale=0.5, quality=80, token_budget=120, webp=True),
+    "screenshot": EncodeProfile(scale=2.0, quality=85, token_budget=1500, webp=True),
+    "photo": EncodeProfile(scale=1.0, quality=75, token_budget=450, webp=False),
+}
+# 最长边不超过该像素数的图片按表情包处理
+STICKER_MAX_SIDE = 300
+_WEBP_AVAILABLE = features.check("webp")
+
+
+@dataclass
+class EncodedImage:
+    """
+    编码后发送给 VL 模型的图片。
+
+    Attributes:
+        data: base64 编码的图片数据。
+        mime: 图片的 MIME 类型。
+        kind: 图片类别：sticker、screenshot 或 photo。
+        size: 编码后的 (宽, 高)。
+        bytes_in: 原始图片的字节数。
+        bytes_out: 编码后的字节数。
+        tokens: 按模型计费方式估算的 token 数。
+        baseline_tokens: 统一缩放到 MAX_IMAGE_SIZE 时估算的 token 数。
+    """
+    data: str
+    mime: str
+    kind: str
+    size: Tuple[int, int]
+    bytes_in: int
+    bytes_out: int
+    tokens: int
+    baseline_tokens: int
+
+
+def to_rgb(img: Image.Image, max_size: int) -> Image.Image:
+    """缩放到 max_size 以内并将透明背景合成为白色，返回 RGB 图片"""
+    if img.format == 'GIF':
+        img.seek(0)
+    # JPEG 在解码时按 DCT 缩放，避免解码完整尺寸
+    img.draft('RGB', (max_size, max_size))
+    if img.width > max_size or img.height > max_size:
+        img.thumbnail((max_size, max_size))
+    if img.mode == 'P' and 'transparency' in img.info:
+        img = img.convert('RGBA')
+    if img.mode in ('RGBA', 'LA'):
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel('A'))
+        return background
+    if img.mode != 'RGB':  # 调色板、灰度、CMYK 等
+        return img.convert('RGB')
+    return img
+
+
+def model_image_cost(model: str) -> ModelImageCost:
+    name = (model or "").lower()
+    for keyword, cost in MODEL_IMAGE_COSTS:
+        if keyword in name:
+            return cost
+    return DEFAULT_IMAGE_COST
+
+
+def estimate_tokens(cost: ModelImageCost, width: int, height: int) -> int:
+    """按模型计费方式估算一张图片的 token 数"""
+    if cost.kind == "fixed":
+        return cost.tokens
+    if cost.kind == "pixels":
+        return math.ceil(width * height / cost.unit)
+    if cost.kind == "tile":
+        # 先缩放到 2048 以内，再将短边缩放到 768 以内
+        ratio = min(1.0, 2048 / max(width, height))
+        width, height = width * ratio, height * ratio
+        ratio = min(1.0, 768 / min(width, height))
+        width, height = width * ratio, height * ratio
+    return cost.base + cost.tokens * math.ceil(width / cost.unit) * math.ceil(height / cost.unit)
+
+
+def fit_size(width: int, height: int, max_size: int) -> Tuple[int, int]:
+    """按 thumbnail 的规则将尺寸等比缩放到 max_size 以内"""
+    ratio = min(1.0, max_size / max(width, height))
+    return max(round(width * ratio), 1), max(round(height * ratio), 1)
+
+
+# fit_budget 缩小到的最小边长
+MIN_FIT_SIZE = 64
+
+
+def fit_budget(width: int, height: int, max_size: int, budget: int, cost: ModelImageCost) -> int:
+    """
+    在 max_size 以内找出估算 token 不超过 budget 的最大边长。
+
+    固定计费或有最低瓦片数的模型缩小到一定程度后 token 不再减少，budget 低于最小尺寸的估算时
+    以该估算为准，只缩小到首次达到最低 token 数的尺寸，不做没有收益的缩小。
+    """
+    size = min(max_size, max(width, height))
+    budget = max(budget, estimate_tokens(cost, *fit_size(width, height, MIN_FIT_SIZE)))
+    while size > MIN_FIT_SIZE and estimate_tokens(cost, *fit_size(width, height, size)) > budget:
+        size = int(size * 0.9)
+    return size
+
+
+def classify(rgb: Image.Image, original_size: Tuple[int, int], has_alpha: bool = False,
+             animated: bool = False) -> str:
+    """
+    根据内容粗略判断图片类别。
+
+    透明背景、动图或尺寸很小的是表情包；缩小后少数几种颜色占据大半画面的是截图，
+    其余按照片处理。颜色取每通道高 4 位，忽略 JPEG 压缩带来的噪点。
+    """
+    if has_alpha or animated or max(original_size) <= STICKER_MAX_SIDE:
+        return "sticker"
+    sample = rgb.resize((64, 64), Image.NEAREST).point(lambda value: value & 0xF0)
+    colors = sorted(sample.getcolors(64 * 64), reverse=True)
+    dominant = sum(count for count, _ in colors[:8]) / (64 * 64)
+    return "screenshot" if dominant >= 0.5 else "photo"
+
+
+def encode_adaptive(
+    image_data: bytes, model: str, max_size: int, supported_formats: List[str]
+) -> Optional[EncodedImage]:
+    """
+    按图片类别和模型的计费方式选择尺寸、质量和格式，格式不支持时返回 None。
+
+    尺寸先取类别对应的上限，再缩小到估算 token 不超过类别预算；模型接受 WebP 时，
+    表情包和截图使用 WebP，大面积纯色的画面比 JPEG 小得多。
+    """
+    cost = model_image_cost(model)
+    with Image.open(BytesIO(image_data)) as img:
+        if img.format not in supported_formats:
+            logger.warning(f"Unsupported image format: {img.format}")
+            return None
+        original_size = img.size
+        reusable = img.format == 'JPEG' and img.mode in ('RGB', 'L')
+        has_alpha = img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info)
+        animated = getattr(img, "is_animated", False)
+        # 按最大的类别上限解码一次，分类后再缩小
+        largest = max(int(max_size * profile.scale) for profile in ENCODE_PROFILES.values())
+        rgb = to_rgb(img, largest)
+        rgb.load()
+    kind = classify(rgb, original_size, has_alpha, animated)
+    profile = ENCODE_PROFILES[kind]
+    size = fit_budget(*original_size, int(max_size * profile.scale), profile.token_budget, cost)
+    baseline_tokens = estimate_tokens(cost, *fit_size(*original_size, max_size))
+    if kind == "photo" and reusable and max(original_size) <= size:
+        # 尺寸合适的照片直接复用原始数据
+        return EncodedImage(
+            data=base64.b64encode(memoryview(image_data)).decode('ascii'), mime="image/jpeg",
+            kind=kind, size=original_size, bytes_in=len(image_data), bytes_out=len(image_data),
+            tokens=estimate_tokens(cost, *original_size), baseline_tokens=baseline_tokens)
+    if max(rgb.size) > size:
+        rgb.thumbnail((size, size))
+    image_format = "WEBP" if profile.webp and cost.webp and _WEBP_AVAILABLE else "JPEG"
+    buffer = BytesIO()
+    rgb.save(buffer, format=image_format, quality=profile.quality)
+    with buffer.getbuffer() as view:
+        data = base64.b64encode(view).decode('ascii')
+        bytes_out = len(view)
+    return EncodedImage(
+        data=data, mime=f"image/{image_format.lower()}", kind=kind, size=rgb.size,
+        bytes_in=len(image_data), bytes_out=bytes_out,
+        tokens=estimate_tokens(cost, *rgb.size), baseline_tokens=baseline_tokens)
+
+
+class EncodeStats:
+    """按图片类别累计编码前后的字节数和估算的 token 数"""
+
+    def __init__(self):
+        self.totals: Dict[str, Dict[str, int]] = {}
+
+    def record(self, encoded: EncodedImage):
+        totals = self.totals.setdefault(
+            encoded.kind, {"images": 0, "bytes_in": 0, "bytes_out": 0, "tokens": 0, "baseline_tokens": 0})
+        totals["images"] += 1
+        totals["bytes_in"] += encoded.bytes_in
+        totals["bytes_out"] += encoded.bytes_out
+        totals["tokens"] += encoded.tokens
+        totals["baseline_tokens"] += encoded.baseline_tokens
+
+    def log_summary(self):
+        for kind, totals in self.totals.items():
+            images = totals["images"]
+            logger.info(
+                f"Image encoding ({kind}): {images} images, "
+                f"{(totals['bytes_in'] - totals['bytes_out']) / images:.0f} bytes and "
+                f"{(totals['baseline_tokens'] - totals['tokens']) / images:.0f} tokens saved per image")
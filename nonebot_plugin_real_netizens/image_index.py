@@ -0,0 +1,151 @@
+# nonebot_plugin_real_netizens\image_index.py
+from typing import Dict, List, Optional, Tuple
+
+import aiofiles
+from nonebot.log import logger
+
+from .config import plugin_config
+from .db.database import get_image_phashes, get_images_without_phash, set_image_phashes
+from .db.unit_of_work import use_session
+from .image_processor import UNSAVED_IMAGE_PREFIX, image_processor
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class MultiIndexHash:
+    """
+    64 位哈希的多索引哈希表，用于汉明距离范围查询。
+
+    将哈希切分为 max_distance + 1 段，每段各建一个精确匹配的字典。
+    距离不超过 max_distance 的两个哈希至少有一段完全相同（抽屉原理），
+    查询时只需校验各段命中的少量候选，不必遍历全部哈希。
+    """
+
+    def __init__(self, max_distance: int, bits: int = 64):
+        self.max_distance = max_distance
+        count = max_distance + 1
+        width, extra = divmod(bits, count)
+        self.blocks: List[Tuple[int, int]] = []
+        shift = 0
+        for index in range(count):
+            block_width = width + (1 if index < extra else 0)
+            self.blocks.append((shift, (1 << block_width) - 1))
+            shift += block_width
+        self.tables: List[Dict[int, List[int]]] = [{} for _ in self.blocks]
+        self.keys: Dict[int, List[str]] = {}
+        self.size = 0
+
+    def add(self, value: int, key: str):
+        self.size += 1
+        keys = self.keys.get(value)
+        if keys is not None:
+            keys.append(key)
+            return
+        self.keys[value] = [key]
+        for table, (shift, mask) in zip(self.tables, self.blocks):
+            table.setdefault((value >> shift) & mask, []).append(value)
+
+    def search(self, value: int, max_distance: Optional[int] = None) -> List[Tuple[int, str]]:
+        """返回距离不超过 max_distance 的 (距离, 键) 列表，按距离升序"""
+        if max_distance is None or max_distance > self.max_distance:
+            max_distance = self.max_distance
+        seen = set()
+        results = []
+        for table, (shift, mask) in zip(self.tables, self.blocks):
+            for candidate in table.get((value >> shift) & mask, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                distance = hamming_distance(value, candidate)
+                if distance <= max_distance:
+                    results.extend((distance, key) for key in self.keys[candidate])
+        results.sort()
+        return results
+
+
+class ImageIndex:
+    """
+    图片感知哈希的近似重复索引。
+
+    启动时从数据库加载已有图片的 pHash 建立多索引哈希表，新识别的图片随时加入。
+    同一表情包经过 QQ 重新压缩、缩放后 MD5 不同，但 pHash 只相差几位，
+    可以直接复用已有的描述，不再调用 VL 模型。
+    """
+
+    def __init__(self, threshold: int):
+        self.threshold = threshold
+        self.table = MultiIndexHash(max(threshold, 0))
+        self.known: Dict[str, int] = {}
+        self.loaded = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold >= 0
+
+    def add(self, phash: str, image_hash: str):
+        if image_hash in self.known:
+            return
+        value = int(phash, 16)
+        self.known[image_hash] = value
+        self.table.add(value, image_hash)
+
+    def find_similar(self, phash: str) -> Optional[Tuple[str, int]]:
+        """查找与 pHash 最接近且在阈值内的图片，返回 (图片 MD5, 距离)"""
+        if not self.enabled:
+            return None
+        matches = self.table.search(int(phash, 16))
+        return (matches[0][1], matches[0][0]) if matches else None
+
+    async def load(self, batch_size: int = 5000):
+        """从数据库分批加载已有图片的 pHash"""
+        if not self.enabled:
+            return
+        last_id = 0
+        while True:
+            async with use_session() as session:
+                rows = await get_image_phashes(session, last_id, batch_size)
+            for image_id, image_hash, phash in rows:
+                self.add(phash, image_hash)
+                last_id = image_id
+            if len(rows) < batch_size:
+                break
+        self.loaded = True
+        logger.info(f"Image similarity index loaded: {self.table.size} images")
+
+    async def backfill(self, batch_size: int = 100):
+        """为没有 pHash 的旧图片记录补算 pHash，图片文件已不存在的跳过"""
+        if not self.enabled:
+            return
+        last_id = 0
+        filled = 0
+        while True:
+            async with use_session() as session:
+                rows = await get_images_without_phash(session, last_id, batch_size)
+            updates = []
+            for image_id, image_hash, file_path in rows:
+                last_id = image_id
+                if not file_path or file_path.startswith(UNSAVED_IMAGE_PREFIX):
+                    continue
+                try:
+                    async with aiofiles.open(file_path, mode="rb") as f:
+                        data = await f.read()
+                    phash = await image_processor.perceptual_hash(data)
+                except Exception as e:
+                    # 包括图片文件已被删除
+                    logger.debug(f"Skipping pHash backfill for {file_path}: {e}")
+                    continue
+                updates.append((image_id, phash))
+                self.add(phash, image_hash)
+            if updates:
+                async with use_session() as session:
+                    await set_image_phashes(session, updates)
+                filled += len(updates)
+            if len(rows) < batch_size:
+                break
+        if filled:
+            logger.info(f"Backfilled pHash for {filled} images")
+
+
+image_index = ImageIndex(plugin_config.IMAGE_PHASH_THRESHOLD)
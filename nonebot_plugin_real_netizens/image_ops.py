@@ -0,0 +1,66 @@
+# nonebot_plugin_real_netizens\image_ops.py
+import base64
+import os
+from io import BytesIO
+from typing import List, Optional
+
+import imagehash
+from PIL import Image
+from nonebot.log import logger
+
+from .image_encoder import to_rgb
+
+# 在图片工作池中执行的 CPU 任务，使用模块级函数以便进程池 pickle。
+# 进程池的子进程会导入本模块，这里只能依赖 PIL 和不需要初始化 NoneBot 的模块
+
+
+def _preprocess(image_path: str, max_size: int, supported_formats: List[str]) -> Optional[bytes]:
+    """解码、缩放并去除透明通道，返回 JPEG 数据；格式不支持时返回 None"""
+    with Image.open(image_path) as img:
+        if img.format not in supported_formats:
+            logger.warning(f"Unsupported image format: {img.format}")
+            return None
+        jpeg_image = BytesIO()
+        to_rgb(img, max_size).save(jpeg_image, format='JPEG')
+        return jpeg_image.getvalue()
+
+
+def _prepare_base64(image_data: bytes, max_size: int, supported_formats: List[str]) -> Optional[str]:
+    """
+    将下载的图片数据转换为发送给 LLM 的 JPEG base64，格式不支持时返回 None。
+
+    尺寸不超过 max_size 的 RGB/灰度 JPEG 直接复用原始数据，其余图片只解码、编码一次，
+    base64 直接作用于缓冲区的 memoryview，不再复制中间结果。
+    """
+    with Image.open(BytesIO(image_data)) as img:
+        if img.format not in supported_formats:
+            logger.warning(f"Unsupported image format: {img.format}")
+            return None
+        if (img.format == 'JPEG' and img.mode in ('RGB', 'L')
+                and img.width <= max_size and img.height <= max_size):
+            return base64.b64encode(memoryview(image_data)).decode('ascii')
+        buffer = BytesIO()
+        to_rgb(img, max_size).save(buffer, format='JPEG')
+    with buffer.getbuffer() as view:
+        return base64.b64encode(view).decode('ascii')
+
+
+def _encode_base64(image: Image.Image) -> str:
+    buffer = BytesIO()
+    image.convert("RGB").save(buffer, format="JPEG")
+    with buffer.getbuffer() as view:
+        return base64.b64encode(view).decode('ascii')
+
+
+def _write_file(path: str, data: bytes):
+    """写入图片文件，文件已存在时跳过"""
+    if os.path.exists(path):
+        return
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def _perceptual_hash(image_data: bytes) -> str:
+    with Image.open(BytesIO(image_data)) as image:
+        return str(imagehash.phash(image))
@@ -1,20 +1,96 @@
 # nonebot_plugin_real_netizens\image_processor.py
 import asyncio
-import base64
 import json
 import os
+import time
 from io import BytesIO
-from typing import Dict, Optional, Tuple
+from typing import Dict, List, Optional, Tuple, Union
+import aiofiles
 import imagehash
 from PIL import Image
 from nonebot import get_driver
 from nonebot.adapters.onebot.v11 import MessageSegment
 from nonebot.log import logger
 from .config import Config
-from .db.models import Image as DBImage  # 避免与 PIL.Image 冲突
+from .image_encoder import EncodeStats, encode_adaptive
+from .image_ops import _encode_base64, _perceptual_hash, _prepare_base64, _preprocess, _write_file
+from .image_worker import ImageJobTimeout, ImageWorkerPool
 from .llm_generator import llm_generator
 
 
+# 未保存文件的图片记录的 file_path，该列唯一且不能为空
+UNSAVED_IMAGE_PREFIX = "unsaved://"
+
+
+def unsaved_image_path(image_hash: str) -> str:
+    return f"{UNSAVED_IMAGE_PREFIX}{image_hash}"
+
+
+BATCH_PROMPT = (
+    "下面按顺序给出 {count} 张图片，编号 1 到 {count}。\n"
+    "请逐张详细描述图片，然后判断它是否是表情包,如果是表情包,请给出一个或多个情绪标签。\n"
+    "使用json数组输出，每张图片一项，按编号顺序排列:\n"
+    "[\n"
+    '  {{"index": {{"type": "integer"}}, "description": {{"type": "string"}}, '
+    '"is_meme": {{"type": "boolean"}}, "emotion_tag": {{"type": "string", "nullable": true}}}}\n'
+    "]"
+)
+
+
+def _parse_batch_response(response: str, count: int) -> List[Optional[Dict]]:
+    """解析多图识别的 JSON 数组，按编号返回各图片的结果，缺失或不完整的项为 None"""
+    start, end = response.find("["), response.rfind("]")
+    if start == -1 or end == -1:
+        raise ValueError("No JSON array found in response")
+    items = json.loads(response[start:end + 1])
+    if not isinstance(items, list):
+        raise ValueError("Response is not a JSON array")
+    results: List[Optional[Dict]] = [None] * count
+    for position, item in enumerate(items):
+        if not isinstance(item, dict) or "description" not in item or "is_meme" not in item:
+            continue
+        index = item.get("index", position + 1)
+        if isinstance(index, int) and 1 <= index <= count and results[index - 1] is None:
+            results[index - 1] = item
+    return results
+
+
+class CaptionStats:
+    """
+    图片识别的吞吐统计。
+
+    按请求方式（single 单图、batch 多图）分别累计请求数、图片数、token 数和请求耗时，
+    用于比较合并请求前后每秒识别的图片数和每张图片消耗的 token。
+    """
+
+    def __init__(self):
+        self.totals: Dict[str, Dict[str, float]] = {}
+
+    def record(self, mode: str, images: int, tokens: int, seconds: float):
+        totals = self.totals.setdefault(mode, {"requests": 0, "images": 0, "tokens": 0, "seconds": 0.0})
+        totals["requests"] += 1
+        totals["images"] += images
+        totals["tokens"] += tokens
+        totals["seconds"] += seconds
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """返回各请求方式的 images_per_second 和 tokens_per_image"""
+        return {
+            mode: dict(
+                totals,
+                images_per_second=totals["images"] / totals["seconds"] if totals["seconds"] else 0.0,
+                tokens_per_image=totals["tokens"] / totals["images"] if totals["images"] else 0.0,
+            )
+            for mode, totals in self.totals.items()
+        }
+
+    def log_summary(self):
+        for mode, stats in self.summary().items():
+            logger.info(
+                f"Image captions ({mode}): {stats['images']:.0f} images in {stats['requests']:.0f} requests, "
+                f"{stats['images_per_second']:.2f} images/s, {stats['tokens_per_image']:.0f} tokens/image")
+
+
 class ImageProcessor:
     def __init__(self, config: Config):
         # 获取插件的配置对象
@@ -26,14 +102,52 @@ class ImageProcessor:
         self.max_size = self.config.MAX_IMAGE_SIZE
         self.vl_llm_model = self.config.VL_LLM_MODEL
         self.supported_formats = ['JPEG', 'PNG', 'GIF', 'WEBP', 'BMP']
+        self._pending_writes = set()
+        self.batch_size = self.config.IMAGE_CAPTION_BATCH_SIZE
+        self.batch_wait = self.config.IMAGE_CAPTION_BATCH_WAIT
+        # 等待合并识别的图片：(base64, MIME 类型, 结果 future)
+        self._batch: List[Tuple[str, str, asyncio.Future]] = []
+        self._batch_timer: Optional[asyncio.TimerHandle] = None
+        self._batch_tasks = set()
+        self.stats = CaptionStats()
+        self.adaptive_encoding = self.config.IMAGE_ADAPTIVE_ENCODING
+        self.encode_stats = EncodeStats()
 
     async def process_image(self, image_path: str, image_hash: str) -> Tuple[bool, Dict]:
+        """识别磁盘上已有的图片文件"""
         try:
-            processed_image = self.preprocess_image(image_path)
-            if processed_image is None:
+            async with aiofiles.open(image_path, mode="rb") as f:
+                image_data = await f.read()
+        except OSError as e:
+            logger.error(f"Error reading image {image_path}: {str(e)}")
+            return False, self._build_error_image_info(image_path, image_hash, "图片读取失败")
+        return await self.process_image_data(image_data, image_hash, image_path=image_path)
+
+    async def process_image_data(
+        self, image_data: bytes, image_hash: str, image_path: Optional[str] = None
+    ) -> Tuple[bool, Dict]:
+        """
+        识别下载到内存中的图片。
+
+        图片只在工作池中解码、编码一次；未指定 image_path 时，开启 IMAGE_SAVE_ENABLED
+        则按哈希生成保存路径并在后台写入原始数据，不阻塞识别，否则记录为未保存。
+        """
+        if image_path is None:
+            if self.config.IMAGE_SAVE_ENABLED:
+                image_path = self.image_path(image_hash)
+                self._save_in_background(image_path, image_data)
+            else:
+                image_path = unsaved_image_path(image_hash)
+        try:
+            try:
+                image_base64, mime = await self._encode(image_data)
+            except ImageJobTimeout as e:
+                logger.error(f"Image preprocessing timed out for {image_path}: {e}")
+                return False, self._build_error_image_info(image_path, image_hash, "图片预处理超时")
+            if image_base64 is None:
                 logger.error(f"Failed to preprocess image {image_path}")
                 return False, self._build_error_image_info(image_path, image_hash, "图片预处理失败")
-            image_description = await self.generate_image_description(processed_image)
+            image_description = await self.describe(image_base64, mime)
             if image_description is None or 'error' in image_description:
                 logger.error(
                     f"Failed to generate image description for {image_path}: {image_description.get('error')}"
@@ -52,6 +166,44 @@ class ImageProcessor:
             logger.error(f"Error processing image: {str(e)}")
             return False, self._build_error_image_info(image_path, image_hash, "图片处理失败，无法生成描述")
 
+    async def _encode(self, image_data: bytes) -> Tuple[Optional[str], str]:
+        """在工作池中编码图片，返回 (base64, MIME 类型)，格式不支持时 base64 为 None"""
+        if not self.adaptive_encoding:
+            image_base64 = await image_worker.run(
+                _prepare_base64, image_data, self.max_size, self.supported_formats)
+            return image_base64, "image/jpeg"
+        encoded = await image_worker.run(
+            encode_adaptive, image_data, self.vl_llm_model, self.max_size, self.supported_formats)
+        if encoded is None:
+            return None, "image/jpeg"
+        self.encode_stats.record(encoded)
+        logger.debug(
+            f"Encoded {encoded.kind} image as {encoded.mime} {encoded.size[0]}x{encoded.size[1]}: "
+            f"{encoded.bytes_in} -> {encoded.bytes_out} bytes, "
+            f"~{encoded.tokens} tokens ({encoded.baseline_tokens - encoded.tokens} saved)")
+        return encoded.data, encoded.mime
+
+    def image_path(self, image_hash: str) -> str:
+        """按 MD5 生成图片的保存路径"""
+        return os.path.join(self.config.IMAGE_SAVE_PATH, f"{image_hash}.jpg")
+
+    async def save_image(self, image_hash: str, image_data: bytes) -> str:
+        """将图片原始数据写入保存路径并返回路径，文件已存在时跳过"""
+        image_path = self.image_path(image_hash)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, _write_file, image_path, image_data)
+        return image_path
+
+    def _save_in_background(self, image_path: str, image_data: bytes):
+        task = asyncio.get_running_loop().run_in_executor(None, _write_file, image_path, image_data)
+        self._pending_writes.add(task)
+        task.add_done_callback(self._on_write_done)
+
+    def _on_write_done(self, task: asyncio.Future):
+        self._pending_writes.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Error saving image: {task.exception()}")
+
     def _build_error_image_info(self, image_path: str, image_hash: str, error_message: str) -> Dict:
         return {
             'file_path': image_path,
@@ -63,39 +215,116 @@ class ImageProcessor:
         }
 
     def preprocess_image(self, image_path: str) -> Optional[Image.Image]:
+        """同步预处理图片，在事件循环中请使用工作池执行 _preprocess"""
         try:
-            with Image.open(image_path) as img:
-                if img.format not in self.supported_formats:
-                    logger.warning(f"Unsupported image format: {img.format}")
-                    return None
-                if img.format == 'GIF':
-                    img.seek(0)
-                if img.width > self.max_size or img.height > self.max_size:
-                    img.thumbnail((self.max_size, self.max_size))
-                if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
-                    background = Image.new('RGB', img.size, (255, 255, 255))
-                    background.paste(img, mask=img.split()[
-                                     3] if img.mode == 'RGBA' else None)
-                    img = background
-                elif img.mode == 'P':  # 处理 PNG 图片的调色板模式
-                    img = img.convert('RGB')
-                jpeg_image = BytesIO()
-                img.save(jpeg_image, format='JPEG')
-                jpeg_image.seek(0)
-                return Image.open(jpeg_image)
+            jpeg_data = _preprocess(image_path, self.max_size, self.supported_formats)
+            return Image.open(BytesIO(jpeg_data)) if jpeg_data is not None else None
         except Exception as e:
             logger.error(f"Error preprocessing image: {str(e)}")
             return None
 
     def calculate_image_hash(self, image: Image.Image) -> str:
-        image_hash = str(imagehash.phash(image))
-        new_image = DBImage(hash=image_hash)  # 使用 DBImage 进行数据库操作
-        new_image.save()
-        return image_hash
+        """计算图片的感知哈希（pHash），相似图片的哈希值相近"""
+        return str(imagehash.phash(image))
+
+    async def perceptual_hash(self, image_data: bytes) -> str:
+        """在工作池中解码图片数据并计算感知哈希"""
+        return await image_worker.run(_perceptual_hash, image_data)
 
-    async def generate_image_description(self, image: Image.Image) -> Dict:
+    async def generate_image_description(self, image: Union[Image.Image, bytes]) -> Dict:
         try:
             image_base64 = await self.encode_image_to_base64(image)
+        except Exception as e:
+            logger.error(f"Error in generate_image_description: {e}")
+            return self._build_error_response(str(e), None)
+        return await self.describe(image_base64)
+
+    async def describe(self, image_base64: str, mime: str = "image/jpeg") -> Dict:
+        """
+        识别一张图片。
+
+        同时等待识别的图片最多 IMAGE_CAPTION_BATCH_SIZE 张合并为一次多模态请求，
+        凑满或等待 IMAGE_CAPTION_BATCH_WAIT 秒后发出；多图结果解析失败的图片改为单独识别。
+        """
+        if self.batch_size <= 1:
+            return await self._describe(image_base64, mime)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._batch.append((image_base64, mime, future))
+        if len(self._batch) >= self.batch_size:
+            self._flush_batch()
+        elif self._batch_timer is None:
+            self._batch_timer = loop.call_later(self.batch_wait, self._flush_batch)
+        return await future
+
+    def _flush_batch(self):
+        if self._batch_timer is not None:
+            self._batch_timer.cancel()
+            self._batch_timer = None
+        batch, self._batch = self._batch[:self.batch_size], self._batch[self.batch_size:]
+        if self._batch:
+            self._batch_timer = asyncio.get_running_loop().call_later(self.batch_wait, self._flush_batch)
+        if not batch:
+            return
+        task = asyncio.create_task(self._run_batch(batch))
+        self._batch_tasks.add(task)
+        task.add_done_callback(self._batch_tasks.discard)
+
+    async def _run_batch(self, batch: List[Tuple[str, str, asyncio.Future]]):
+        images = [(image_base64, mime) for image_base64, mime, _ in batch]
+        try:
+            if len(images) == 1:
+                results = [await self._describe(*images[0])]
+            else:
+                results = await self._describe_batch(images)
+                # 多图结果中缺失的图片单独识别
+                missing = [index for index, result in enumerate(results) if result is None]
+                if missing:
+                    logger.warning(f"Batch caption missing {len(missing)} of {len(images)} images, retrying singly")
+                    retried = await asyncio.gather(*(self._describe(*images[index]) for index in missing))
+                    for index, result in zip(missing, retried):
+                        results[index] = result
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, _, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def _describe_batch(self, images: List[Tuple[str, str]]) -> List[Optional[Dict]]:
+        """一次请求识别多张图片，images 为 (base64, MIME 类型) 列表，请求或解析失败时全部返回 None"""
+        content = [{"type": "text", "text": BATCH_PROMPT.format(count=len(images))}]
+        for index, (image_base64, mime) in enumerate(images, start=1):
+            content.append({"type": "text", "text": f"图片 {index}:"})
+            content.append({"type": "image_url", "image_url": {"url": f"data:{mime};base64,{image_base64}"}})
+        started = time.monotonic()
+        try:
+            response, usage = await llm_generator.generate_response_with_usage(
+                messages=[{"role": "user", "content": content}],
+                model=self.vl_llm_model,
+                temperature=0.7,
+                max_tokens=150 * len(images),
+            )
+        except Exception as e:
+            # 任何请求错误都退回逐张识别，不让整批图片一起失败
+            logger.error(f"Batch caption request failed: {e}")
+            return [None] * len(images)
+        if response is None:
+            logger.error("Batch caption request failed: API returned None.")
+            return [None] * len(images)
+        try:
+            results = _parse_batch_response(response, len(images))
+        except Exception as e:
+            logger.error(f"Failed to parse batch caption response: {e}. Response: {response}")
+            return [None] * len(images)
+        parsed = sum(result is not None for result in results)
+        self.stats.record("batch", parsed, usage.get("total_tokens", 0), time.monotonic() - started)
+        return results
+
+    async def _describe(self, image_base64: str, mime: str = "image/jpeg") -> Dict:
+        try:
             system_message = (
                 "请详细描述这张图片。\n"
                 "然后判断它是否是表情包,如果是表情包,请给出一个或多个情绪标签。\n"
@@ -114,7 +343,7 @@ class ImageProcessor:
                         {"type": "text", "text": f"{system_message}"},
                         {
                             "type": "image_url",
-                            "image_url": {"url": f"data:image/jpeg;base64,{image_base64}"},
+                            "image_url": {"url": f"data:{mime};base64,{image_base64}"},
                         },
                     ],
                 }
@@ -122,7 +351,8 @@ class ImageProcessor:
 
             for attempt in range(self.max_retries):
                 try:
-                    response = await llm_generator.generate_response(
+                    started = time.monotonic()
+                    response, usage = await llm_generator.generate_response_with_usage(
                         messages=messages,
                         model=self.vl_llm_model,
                         temperature=0.7,
@@ -150,6 +380,8 @@ class ImageProcessor:
                                 key in description_data for key in ["description", "is_meme"]
                             ):  # 只检查必要字段
                                 raise KeyError("Missing required fields in JSON response")
+                            self.stats.record(
+                                "single", 1, usage.get("total_tokens", 0), time.monotonic() - started)
                             return description_data
                         else:
                             raise ValueError("No valid JSON object found in response")
@@ -179,12 +411,14 @@ class ImageProcessor:
             "All attempts to generate image description failed.", None
         )
 
-    async def encode_image_to_base64(self, image: Image.Image) -> str:
-        buffered = BytesIO()
-        image = image.convert("RGB")
-        image.save(buffered, format="JPEG")
-        img_str = base64.b64encode(buffered.getvalue()).decode()
-        return img_str
+    async def encode_image_to_base64(self, image: Union[Image.Image, bytes]) -> str:
+        if isinstance(image, (bytes, bytearray)):
+            image_base64 = await image_worker.run(
+                _prepare_base64, bytes(image), self.max_size, self.supported_formats)
+            if image_base64 is None:
+                raise ValueError("Unsupported image format")
+            return image_base64
+        return await image_worker.run(_encode_base64, image)
 
     def _build_error_response(self, error_msg: str, status_code: Optional[int]) -> Dict:
         return {
@@ -198,4 +432,10 @@ class ImageProcessor:
 
 # 创建一个全局实例,使用依赖注入
 plugin_config = Config.parse_obj(get_driver().config)
+image_worker = ImageWorkerPool(
+    kind=plugin_config.IMAGE_WORKER_TYPE,
+    max_workers=plugin_config.IMAGE_WORKERS,
+    max_pending=plugin_config.IMAGE_QUEUE_SIZE,
+    timeout=plugin_config.IMAGE_JOB_TIMEOUT,
+)
 image_processor = ImageProcessor(plugin_config)
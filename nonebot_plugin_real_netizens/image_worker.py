@@ -0,0 +1,98 @@
+# nonebot_plugin_real_netizens\image_worker.py
+import asyncio
+import os
+import sys
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from nonebot.log import logger
+
+# 进程池的子进程以 spawn 方式启动时需要重新导入任务函数所在的模块，而导入插件包会执行
+# __init__ 中依赖已初始化 NoneBot 的代码。子进程启动时先登记一个空的包模块，
+# 之后只加载 image_ops 等任务实际用到的模块；fork 启动时包已存在，不做改动
+_WORKER_BOOTSTRAP = f"""
+import sys, types
+if {__package__!r} not in sys.modules:
+    package = types.ModuleType({__package__!r})
+    package.__path__ = [{os.path.dirname(os.path.abspath(__file__))!r}]
+    sys.modules[{__package__!r}] = package
+"""
+
+class ImageJobTimeout(asyncio.TimeoutError):
+    """图片任务排队或执行超时"""
+
+
+class ImageWorkerPool:
+    """
+    图片 CPU 任务的工作池。
+
+    解码、缩放、编码和感知哈希都放到线程池或进程池中执行，避免阻塞事件循环。
+    同时提交的任务数量有上限，超出的任务在事件循环中排队等待，
+    排队和执行的总耗时超过 timeout 时抛出 ImageJobTimeout。
+
+    使用进程池时，提交的函数和参数必须可以被 pickle（模块级函数、bytes、str 等），
+    且函数所在的模块不能依赖已初始化的 NoneBot，参见 image_ops。
+    """
+
+    def __init__(self, kind: str = "thread", max_workers: int = 0, max_pending: int = 32, timeout: float = 30):
+        self.kind = kind
+        self.max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self.max_pending = max(max_pending, self.max_workers)
+        self.timeout = timeout
+        self._executor: Optional[Executor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers, initializer=exec, initargs=(_WORKER_BOOTSTRAP, {}))
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="real_netizens_image")
+            logger.info(f"Image worker pool started: {self.kind} x {self.max_workers}")
+        return self._executor
+
+    async def run(self, func: Callable[..., Any], *args: Any, timeout: Optional[float] = None) -> Any:
+        """
+        在工作池中执行 func(*args) 并等待结果。
+
+        Raises:
+            ImageJobTimeout: 排队或执行超时。超时的任务若已开始执行会继续占用名额直到结束。
+        """
+        loop = asyncio.get_running_loop()
+        timeout = self.timeout if timeout is None else timeout
+        deadline = loop.time() + timeout
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout)
+        except asyncio.TimeoutError:
+            raise ImageJobTimeout(f"Image job queue is full ({self.max_pending} pending)")
+        try:
+            future = self._get_executor().submit(func, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        # 名额在任务真正结束时才释放，已超时但仍在执行的任务同样计入上限
+        future.add_done_callback(lambda _: self._release(loop))
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), max(deadline - loop.time(), 0))
+        except asyncio.TimeoutError:
+            future.cancel()
+            raise ImageJobTimeout(f"Image job {getattr(func, '__name__', func)} timed out after {timeout}s")
+
+    def _release(self, loop: asyncio.AbstractEventLoop):
+        try:
+            loop.call_soon_threadsafe(self._slots.release)
+        except RuntimeError:
+            # 事件循环已关闭
+            pass
+
+    def shutdown(self, wait: bool = False):
+        if self._executor is not None:
+            if sys.version_info >= (3, 9):
+                self._executor.shutdown(wait=wait, cancel_futures=True)
+            else:
+                self._executor.shutdown(wait=wait)
+            self._executor = None
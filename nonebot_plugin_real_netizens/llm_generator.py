@@ -1,7 +1,7 @@
 # llm_generator.py
 import json
 import logging
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 import aiohttp
 from nonebot import get_driver
@@ -32,9 +32,18 @@ class LLMGenerator:
                                 temperature: float, max_tokens: int,
                                 generation_config: Optional[Dict[str, Any]] = None,
                                 **kwargs) -> Optional[str]:
+        response, _ = await self.generate_response_with_usage(
+            messages, model, temperature, max_tokens, generation_config, **kwargs)
+        return response
+
+    async def generate_response_with_usage(self, messages: List[Dict[str, Any]], model: str,
+                                           temperature: float, max_tokens: int,
+                                           generation_config: Optional[Dict[str, Any]] = None,
+                                           **kwargs) -> Tuple[Optional[str], Dict[str, int]]:
+        """与 generate_response 相同，同时返回接口报告的 token 用量，接口未返回时为空字典"""
         if not self.initialized:
             logger.error("LLMGenerator not initialized")
-            return None
+            return None, {}
         headers = {
             "Accept": "application/json",
             "Authorization": f"Bearer {self.key}",
@@ -73,13 +82,13 @@ class LLMGenerator:
                     try:
                         data = json.loads(response_text)
                         logger.debug(f"API response JSON: {data}")
-                        return self.process_response(data)
+                        return self.process_response(data), data.get("usage") or {}
                     except json.JSONDecodeError as e:
                         logger.error(f"Failed to decode JSON response: {e}, response text: {response_text}")
-                        return None
+                        return None, {}
         except aiohttp.ClientError as e:
             logger.error(f"API request error: {e}")
-            return None
+            return None, {}
 
 
     def process_response(self, data: Dict[str, Any]) -> Optional[str]:
@@ -1,13 +1,9 @@
 # nonebot_plugin_real_netizens\main.py
-import hashlib
+import asyncio
 import json
-import os
 import random
-import time
-from typing import Dict, List, Optional
+from typing import List
 
-import aiofiles
-import aiohttp
 import nonebot
 from nonebot import get_driver, on_command, on_message, on_notice
 from nonebot.adapters.onebot.v11 import (
@@ -20,30 +16,33 @@ from nonebot.log import logger
 from nonebot.permission import SUPERUSER
 from nonebot.rule import to_me
 from nonebot.typing import T_State
-from nonebot_plugin_datastore import get_session
 
+from .activity_tracker import activity_tracker
 from .admin_commands import *
 from .behavior_decider import decide_behavior
+from .cache_snapshot import cache_snapshot
 from .character_manager import CharacterManager
 from .config import plugin_config
-from .db.database import (
-    add_image_record,
-    add_message,
-    delete_old_messages,
-    get_image_by_hash,
-)
+from .db.database import get_recent_images
+from .db.unit_of_work import event_scope, use_session
+from .db.user_info_service import avatar_describer, profile_syncer, save_user_info
 from .group_config_manager import GroupConfig, group_config_manager
-from .image_processor import image_processor
+from .image_cache import image_cache
+from .image_captioner import image_captioner
+from .image_downloader import image_downloader
+from .image_index import image_index
+from .image_processor import image_processor, image_worker
 from .llm_generator import llm_generator
 from .memory_manager import memory_manager
 from .message_builder import MessageBuilder
 from .message_processor import message_processor
-from .schedulers import scheduler
+from .retention_manager import retention_manager
+from .schedulers import revive_inactive_chat, scheduler
 
 
 async def init_plugin():
     """初始化插件"""
-    from .db.database import init_database
+    from .db.database import init_database, maintain_database
     from .resource_loader import character_card_loader, preset_loader, worldbook_loader
     from .schedulers import scheduler
     global character_manager  # 声明 character_manager 为全局变量
@@ -63,6 +62,10 @@ async def init_plugin():
     except Exception as e:
         logger.error(f"群组配置加载失败：{str(e)}")
         raise
+    # 后台预热各群组的上下文缓存，与后续初始化和机器人连接并行进行
+    asyncio.create_task(warm_up_caches())
+    if image_index.enabled:
+        asyncio.create_task(build_image_index())
     # 加载角色数据
     try:
         await character_manager.load_characters()
@@ -87,6 +90,38 @@ async def init_plugin():
     except Exception as e:
         logger.error(f"机器人ID设置失败：{str(e)}")
         raise
+    # 冷场检测：按群组设置定时器，恰好在超过不活跃阈值时触发。
+    # 数据库中有历史消息的群组都会载入活跃时间，未启用的群组阈值为 None，不设置定时器
+    activity_tracker.add_idle_watcher(
+        "inactive_chat",
+        lambda group_id: group_config_manager.get_group_config(group_id).inactive_threshold
+        if group_id in plugin_config.ENABLED_GROUPS else None,
+        revive_inactive_chat,
+    )
+    # 滚动摘要：群组空闲后将较早的消息折叠进摘要
+    if plugin_config.SUMMARY_ENABLED:
+        activity_tracker.add_idle_watcher(
+            "conversation_summary",
+            lambda group_id: plugin_config.SUMMARY_IDLE_SECONDS
+            if group_id in plugin_config.ENABLED_GROUPS else None,
+            memory_manager.compact_idle_group,
+        )
+    group_config_manager.register_observer(activity_tracker.reschedule)
+    await activity_tracker.load()
+    # 后台补齐启用群组的语义索引
+    if plugin_config.SEMANTIC_MEMORY_ENABLED:
+        asyncio.create_task(sync_semantic_indexes())
+    # 启动头像描述后台任务
+    avatar_describer.start()
+    get_driver().on_shutdown(avatar_describer.stop)
+    # 启动图片描述后台补齐任务
+    if image_captioner.lazy:
+        asyncio.create_task(start_image_captioner())
+        get_driver().on_shutdown(image_captioner.stop)
+    get_driver().on_shutdown(image_worker.shutdown)
+    get_driver().on_shutdown(image_processor.stats.log_summary)
+    get_driver().on_shutdown(image_processor.encode_stats.log_summary)
+    get_driver().on_shutdown(image_downloader.close)
     # 启动调度器
     scheduler.start()
     logger.info("调度器启动成功")
@@ -101,41 +136,64 @@ async def init_plugin():
         hour=int(plugin_config.MORNING_GREETING_TIME.split(":")[0]),
         minute=int(plugin_config.MORNING_GREETING_TIME.split(":")[1]),
     )
-    scheduler.add_job(check_inactive_chats, "interval", minutes=30)
-    scheduler.add_job(clean_old_messages, "cron", hour=3)
+    scheduler.add_job(clean_old_messages, "interval",
+                      minutes=plugin_config.RETENTION_INTERVAL)
+    if plugin_config.SQLITE_MAINTENANCE_INTERVAL > 0:
+        scheduler.add_job(maintain_database, "interval",
+                          minutes=plugin_config.SQLITE_MAINTENANCE_INTERVAL)
+    scheduler.add_job(memory_manager.flush_impression_updates, "interval",
+                      seconds=plugin_config.IMPRESSION_FLUSH_INTERVAL)
+    scheduler.add_job(profile_syncer.refresh, "interval",
+                      seconds=plugin_config.PROFILE_REFRESH_INTERVAL)
+    # 关闭时写入尚未落库的印象更新和用户资料
+    get_driver().on_shutdown(memory_manager.flush_impression_updates)
+    get_driver().on_shutdown(profile_syncer.refresh)
+    # 定期和关闭时保存缓存快照，重启后恢复
+    if plugin_config.CACHE_SNAPSHOT_ENABLED:
+        if plugin_config.CACHE_SNAPSHOT_INTERVAL > 0:
+            scheduler.add_job(cache_snapshot.save, "interval",
+                              minutes=plugin_config.CACHE_SNAPSHOT_INTERVAL)
+        get_driver().on_shutdown(cache_snapshot.save)
+
+async def warm_up_caches():
+    """恢复缓存快照，再预热启用群组的最近消息、摘要和印象缓存，以及最近的图片识别结果"""
+    try:
+        if plugin_config.CACHE_SNAPSHOT_ENABLED:
+            await cache_snapshot.restore(plugin_config.CACHE_SNAPSHOT_MAX_AGE)
+        await memory_manager.warm_up(plugin_config.ENABLED_GROUPS)
+        if image_cache.enabled and plugin_config.IMAGE_CACHE_WARM_UP > 0:
+            async with use_session() as session:
+                image_cache.warm_up(await get_recent_images(session, plugin_config.IMAGE_CACHE_WARM_UP))
+    except Exception as e:
+        logger.error(f"缓存预热失败：{str(e)}")
 
-# 消息处理器
-message_handler = on_message(priority=5)
 
+async def build_image_index():
+    """加载图片感知哈希索引，并为旧图片补算 pHash"""
+    try:
+        await image_index.load()
+        await image_index.backfill()
+    except Exception as e:
+        logger.error(f"图片近似重复索引加载失败：{str(e)}")
 
-async def download_and_process_image(image_url: str) -> Optional[Dict]:
-    async with aiohttp.ClientSession() as session:
-        async with session.get(image_url) as resp:
-            if resp.status != 200:
-                raise Exception(
-                    f"Failed to download image: HTTP {resp.status}")
-            image_data = await resp.read()
-    # 计算图片哈希
-    image_hash = hashlib.md5(image_data).hexdigest()
-    # 检查数据库中是否存在相同哈希的图片
-    existing_image = await get_image_by_hash(image_hash)
-    if existing_image:
-        return existing_image  # 直接返回已存在的图片信息
-    # 如果是新图片,保存并处理
-    image_file = f"{image_hash}.jpg"
-    # 创建保存图片的目录
-    os.makedirs(plugin_config.IMAGE_SAVE_PATH, exist_ok=True)
-    image_path = os.path.join(plugin_config.IMAGE_SAVE_PATH, image_file)
-    async with aiofiles.open(image_path, mode="wb") as f:
-        await f.write(image_data)
-    # 使用 image_processor 处理新图片
-    success, image_info = await image_processor.process_image(image_path, image_hash)
-    if success:
-        # 保存新图片信息到数据库
-        await add_image_record(image_info)
-        return image_info  # 返回处理后的图片信息
-    else:
-        return None
+async def start_image_captioner():
+    """加载上次未识别完的图片，并启动后台补齐任务"""
+    try:
+        await image_captioner.load()
+    except Exception as e:
+        logger.error(f"待识别图片加载失败：{str(e)}")
+    image_captioner.start()
+
+async def sync_semantic_indexes():
+    """逐个群组将语义索引追赶到最新消息"""
+    for group_id in plugin_config.ENABLED_GROUPS:
+        try:
+            await memory_manager.sync_semantic_index(group_id)
+        except Exception as e:
+            logger.error(f"语义索引同步失败（群 {group_id}）：{str(e)}")
+
+# 消息处理器
+message_handler = on_message(priority=5)
 
 
 @message_handler.handle()
@@ -151,43 +209,41 @@ async def handle_group_message(bot: Bot, event: GroupMessageEvent, state: T_Stat
     group_config = group_config_manager.get_group_config(group_id)
     character_id = group_config.character_id or plugin_config.DEFAULT_CHARACTER_ID
 
-    # 处理消息中的文本和图片
-    full_content, image_descriptions = await process_message_content(event.get_message())
+    # 同一条消息的处理流程共享一个数据库会话，写入合并提交
+    async with event_scope() as unit:
+        # 处理消息中的文本和图片，超时未识别完的图片先用占位符代替
+        content = await message_processor.parse_message_content(event.get_message())
+        full_content = content.render()
 
-    # 保存消息到数据库
-    await add_message(group_id, user_id, full_content)
+        # 记录用户资料与最后发言，由后台任务批量同步
+        await save_user_info(bot, event)
 
-    # 触发机制检查
-    if await check_trigger(group_id, full_content, group_config):
-        await process_ai_response(bot, event, group_id, user_id, character_id, full_content, group_config)
+        # 保存消息到数据库
+        message_id = await memory_manager.add_message(group_id, user_id, full_content)
 
+        # 在调用 LLM 前提交消息和图片记录，避免长时间占用写锁
+        await unit.commit()
 
-async def process_message_content(message):
-    text_content = ""
-    image_descriptions = []
-    for segment in message:
-        if segment.type == "text":
-            text_content += segment.data['text']
-        elif segment.type == "image":
-            image_url = segment.data['url']
-            try:
-                image_info = await download_and_process_image(image_url)
-                if image_info:
-                    description = f"[图片描述: {image_info['description']}]"
-                    if image_info['is_meme']:
-                        description += f"[表情包情绪: {image_info['emotion_tag']}]"
-                    image_descriptions.append(description)
-            except Exception as e:
-                logger.error(f"Error processing image: {str(e)}")
+        # 剩余图片识别完成后补写到已保存的消息中
+        if message_id is not None:
+            message_processor.start_backfill(group_id, message_id, content)
 
-    return text_content + " ".join(image_descriptions), image_descriptions
+        # 触发机制检查
+        if await check_trigger(group_id, full_content, group_config):
+            await process_ai_response(bot, event, group_id, user_id, character_id, full_content, group_config)
 
 
-async def process_ai_response(bot, event, group_id, user_id, full_content, group_config):
+async def process_ai_response(bot, event, group_id, user_id, character_id, full_content, group_config):
     # 获取用户印象
-    user_impression = await memory_manager.get_impression(group_id, user_id)
-    # 获取最近的消息
-    recent_messages = await memory_manager.get_recent_messages(group_id, limit=plugin_config.CONTEXT_MESSAGE_COUNT)
+    user_impression = await memory_manager.get_impression(group_id, user_id, character_id)
+    # 获取滚动摘要和尚未折叠进摘要的最近消息
+    chat_summary, recent_messages = await memory_manager.get_context_messages(group_id)
+    # 检索与当前消息相关的历史聊天
+    related_history = await memory_manager.get_related_history(
+        group_id, full_content, recent_messages, plugin_config.RELATED_HISTORY_COUNT)
+    # 确定要构建提示词后才识别消息中引用的图片
+    full_content = await image_captioner.resolve(full_content)
+    recent_messages = await image_captioner.resolve_messages(recent_messages)
     # 从角色管理器获取最新的角色信息
     character_info = character_manager.get_character_info(group_id)
     # 构建消息
@@ -197,12 +253,15 @@ async def process_ai_response(bot, event, group_id, user_id, full_content, group
         character_id=character_info['character_id'] or plugin_config.DEFAULT_CHARACTER_ID
     )
     # 决策行为
-    behavior_decision = await decide_behavior(full_content, recent_messages, message_builder, user_id, group_id)
+    behavior_decision = await decide_behavior(full_content, recent_messages, message_builder, user_id, group_id,
+                                              chat_summary=chat_summary)
     if behavior_decision["should_reply"]:
         context = {
             "user": event.sender.nickname,
             "char": character_info.get("name"),
             "user_impression": user_impression,
+            "chat_summary": chat_summary,
+            "related_history": related_history,
             "reply_type": behavior_decision["reply_type"],
             "priority": behavior_decision["priority"]
         }
@@ -211,16 +270,17 @@ async def process_ai_response(bot, event, group_id, user_id, full_content, group
         try:
             parsed_response = json.loads(response)
             await bot.send(event=event, message=parsed_response["response"])
+            # 更新记忆：用户消息已在入库时保存，这里只保存回复并更新印象
+            await memory_manager.add_message(group_id, memory_manager.bot_id, parsed_response["response"])
             new_impression = parsed_response["impression_update"]
-            await memory_manager.update_impression(group_id, user_id, parsed_response['character_id'], new_impression)
+            memory_manager.queue_impression_update(
+                group_id, user_id, parsed_response.get('character_id', character_id), new_impression)
             logger.debug(
                 f"Internal thoughts: {parsed_response['internal_thoughts']}")
             logger.debug(
                 f"Behavior decision reason: {behavior_decision['reason']}")
         except json.JSONDecodeError:
             logger.error(f"Failed to parse LLM response as JSON: {response}")
-    # 更新记忆
-    await memory_manager.update_memory(group_id, user_id, parsed_response['character_id'], full_content, response)
 
 
 async def check_trigger(group_id, full_content, group_config):
@@ -322,37 +382,9 @@ async def morning_greeting():
             await bot.send_group_msg(group_id=group_id, message=greeting)
 
 
-@scheduler.scheduled_job("interval", minutes=30)
-async def check_inactive_chats():
-    bot = get_driver().bots.values()[0]
-    current_time = time.time()
-    for group_id in group_config_manager.get_all_groups():
-        group_config = group_config_manager.get_group_config(group_id)
-        character_id = group_config.character_id
-        # 如果没有设置角色，则使用默认角色
-        if not character_id:
-            character_id = plugin_config.DEFAULT_CHARACTER_ID
-        last_message_time = await memory_manager.get_last_message_time(group_id)
-        if current_time - last_message_time > group_config.inactive_threshold:
-            context = {"user": "群友", "char": character_manager.get_character_info(
-                character_id, "name")}
-            # 获取预设名称和世界书名称列表
-            preset_name = group_config.preset_name
-            worldbook_names = group_config.worldbook_names
-            message_builder = MessageBuilder(
-                preset_name=preset_name,
-                worldbook_names=worldbook_names,
-                character_id=character_id
-            )
-            revival_msg = await message_processor(None, [], message_builder, context)
-            if revival_msg:
-                await bot.send_group_msg(group_id=group_id, message=revival_msg)
-
-
-@scheduler.scheduled_job("cron", hour=3)
 async def clean_old_messages():
-    async with get_session() as session:
-        await delete_old_messages(session, days=30)
+    """分批执行聊天记录保留策略，由调度器全天增量运行"""
+    await retention_manager.run()
 
 
 # 触发机制检查
@@ -1,17 +1,50 @@
 # nonebot_plugin_real_netizens\memory_manager.py
 
 
+import asyncio
+import time
 from collections import defaultdict
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+from itertools import zip_longest
+from typing import Dict, List, Optional, Set, Tuple
 
+from cachetools import LRUCache
 from nonebot.adapters.onebot.v11 import Bot
 from nonebot.log import logger
-from nonebot_plugin_datastore import get_session
 from sqlalchemy import desc, select
 
+from .activity_tracker import activity_tracker
+from .cache_snapshot import cache_snapshot
 from .config import Config
+from .db.archive import get_archived_messages_by_ids
+from .db.database import (
+    add_message,
+    get_active_impressions,
+    get_first_message_ids,
+    get_last_message_ids,
+    get_messages_after,
+    get_messages_by_ids,
+    get_recent_messages_by_group,
+    get_summaries,
+    get_summary,
+    get_tail_start_id,
+    save_summary,
+    search_messages,
+    update_message_content,
+    upsert_impressions,
+)
 from .db.models import Impression, Message
+from .db.unit_of_work import commit_or_flush, current_unit, use_session
+from .image_captioner import IMAGE_REFERENCE_PATTERN, format_image_description, image_captioner, image_reference
+from .llm_generator import llm_generator
+from .semantic_memory import semantic_memory
+
+SUMMARY_PROMPT = (
+    "你是群聊记录整理员。请把【已有摘要】和【新的聊天记录】合并成一份新的群聊摘要。\n"
+    "要求：保留重要的人物、事件、约定、话题走向和群友之间的关系与情绪；"
+    "省略寒暄和无意义的刷屏；使用第三人称，“我”指机器人自己；"
+    "不超过 {max_chars} 字；只输出摘要正文。"
+)
 
 
 class MemoryManager:
@@ -19,13 +52,83 @@ class MemoryManager:
         self.bot_id = None
         self.config = Config()
         self.message_cache = defaultdict(list)
+        # 消息缓存对应的最后消息 ID，用于恢复快照时与数据库核对
+        self.cache_last_ids: Dict[int, int] = {}
+        # 消息缓存中各条消息的 ID，与 message_cache 一一对应，用于从缓存取出摘要之后的消息
+        self.cache_message_ids: Dict[int, List[int]] = {}
         self.impression_cache = {}
+        # 待批量写入的印象更新，键为 (group_id, user_id, character_id)
+        self.pending_impressions: Dict[tuple, str] = {}
+        # 群组滚动摘要缓存：group_id -> (摘要内容, 已折叠的最后消息 ID)
+        self.summary_cache: Dict[int, Tuple[Optional[str], int]] = {}
         self.cache_expiry = timedelta(minutes=30)  # 缓存过期时间
+        # 机器人 ID 设置后置位，缓存预热需要它区分消息角色。
+        # 首次使用时创建：Python 3.8/3.9 的 Event 在创建时绑定事件循环，模块导入时循环尚未运行
+        self._bot_ready: Optional[asyncio.Event] = None
+        # lazy 模式下引用了尚未识别图片的消息：MD5 -> {(group_id, message_id)}。
+        # 只保存在内存中，重启前未改写的消息保留引用，进入提示词前仍由 resolve 替换，但检索不到图片内容
+        self.image_references: LRUCache = LRUCache(maxsize=10000)
+        image_captioner.register_observer(self.on_image_captioned)
+
+    @property
+    def bot_ready(self) -> asyncio.Event:
+        if self._bot_ready is None:
+            self._bot_ready = asyncio.Event()
+        return self._bot_ready
 
     async def set_bot_id(self, bot: Bot):
         self.bot_id = int(bot.self_id)
+        self.bot_ready.set()
         logger.info(f"Bot ID set to {self.bot_id}")
 
+    async def warm_up(self, group_ids: List[int]) -> Dict[str, int]:
+        """
+        启动时预热缓存：以少量集合查询加载各群组的最近消息、滚动摘要，
+        以及最近发言用户的印象，避免每个群组的第一条消息都查询数据库。
+
+        查询期间不需要机器人 ID，可在机器人连接前开始执行。
+
+        Returns:
+            预热的群组数、消息数和印象数。
+        """
+        started = time.time()
+        group_ids = list(group_ids)
+        stats = {"groups": 0, "messages": 0, "impressions": 0}
+        if not group_ids:
+            return stats
+        async with use_session() as session:
+            messages = await get_recent_messages_by_group(
+                session, group_ids, self.config.CONTEXT_MESSAGE_COUNT)
+            summaries = await get_summaries(session, group_ids)
+            # 最近上下文中出现过的用户即为近期活跃用户
+            pairs = {(msg.group_id, msg.user_id) for rows in messages.values() for msg in rows}
+            impressions = await get_active_impressions(
+                session, group_ids, list({user_id for _, user_id in pairs}))
+        for group_id in group_ids:
+            summary = summaries.get(group_id)
+            self.summary_cache.setdefault(
+                group_id, (summary.content, summary.last_message_id) if summary else (None, 0))
+        for impression in impressions:
+            if (impression.group_id, impression.user_id) in pairs:
+                self.impression_cache.setdefault(
+                    (impression.group_id, impression.user_id, impression.character_id), impression.content)
+                stats["impressions"] += 1
+        await self.bot_ready.wait()
+        for group_id, rows in messages.items():
+            # 预热期间有新消息的群组跳过，留给首次访问时加载，避免缓存缺失这些消息
+            last_activity = activity_tracker.get_last_activity(group_id)
+            if group_id in self.message_cache or (last_activity or 0) > started:
+                continue
+            self.message_cache[group_id] = [self._format_message(msg) for msg in rows]
+            self.cache_message_ids[group_id] = [msg.id for msg in rows]
+            self.cache_last_ids[group_id] = rows[-1].id
+            stats["groups"] += 1
+            stats["messages"] += len(rows)
+        logger.info(
+            f"Warmed up {stats['groups']} groups, {stats['messages']} messages and "
+            f"{stats['impressions']} impressions in {time.time() - started:.2f}s")
+        return stats
+
     async def get_recent_messages(self, group_id: int, limit: int = 5) -> List[Dict]:
         if self.bot_id is None:
             logger.error("Bot ID not set. Please call set_bot_id() first.")
@@ -33,9 +136,9 @@ class MemoryManager:
         # 检查缓存
         cached_messages = self.message_cache.get(group_id, [])
         if len(cached_messages) >= limit:
-            return cached_messages[:limit]
+            return cached_messages[-limit:]
         try:
-            async with get_session() as session:
+            async with use_session() as session:
                 query = select(Message).where(Message.group_id == group_id).order_by(
                     desc(Message.timestamp)).limit(limit)
                 result = await session.execute(query)
@@ -44,33 +147,231 @@ class MemoryManager:
                                        "content": msg.content} for msg in reversed(messages)]
                 # 更新缓存
                 self.message_cache[group_id] = formatted_messages
+                self.cache_message_ids[group_id] = [msg.id for msg in reversed(messages)]
+                if messages:
+                    self.cache_last_ids[group_id] = messages[0].id
                 return formatted_messages
         except Exception as e:
             logger.error(f"Error retrieving recent messages: {str(e)}")
             return []
 
+    async def add_message(self, group_id: int, user_id: int, content: str) -> Optional[int]:
+        """
+        消息入库的统一入口：写入数据库，并更新上下文缓存、活跃记录和语义索引。
+
+        Returns:
+            新消息的 ID，写入失败时返回 None。
+        """
+        try:
+            async with use_session() as session:
+                message = await add_message(session, group_id, user_id, content)
+                message_id = message.id
+        except Exception as e:
+            logger.error(f"Error adding message for group {group_id}: {str(e)}")
+            return None
+        self._append_to_cache(group_id, message_id, {"role": "user" if user_id != self.bot_id else "assistant",
+                                                     "content": content})
+        activity_tracker.touch(group_id)
+        self._track_image_references(group_id, message_id, content)
+        await self.index_messages(group_id, [(message_id, content)])
+        return message_id
+
+    async def replace_message_content(self, group_id: int, message_id: int, old_content: str, new_content: str):
+        """
+        修改已保存消息的内容，用于补写入库后才完成识别的图片描述。
+
+        全文索引由数据库触发器同步；语义索引的向量按入库时的内容计算，这里按新内容重新计算。
+        """
+        try:
+            async with use_session() as session:
+                if not await update_message_content(session, message_id, new_content):
+                    return
+        except Exception as e:
+            logger.error(f"Error updating message {message_id} for group {group_id}: {str(e)}")
+            return
+        # 上下文缓存不记录消息 ID，从最新的消息往前查找相同内容的条目
+        for entry in reversed(self.message_cache.get(group_id, [])):
+            if entry["content"] == old_content:
+                entry["content"] = new_content
+                break
+        self._track_image_references(group_id, message_id, new_content)
+        await self.reindex_messages(group_id, [(message_id, new_content)])
+
+    def _track_image_references(self, group_id: int, message_id: int, content: str):
+        for image_hash in IMAGE_REFERENCE_PATTERN.findall(content or ""):
+            references: Optional[Set[Tuple[int, int]]] = self.image_references.get(image_hash)
+            if references is None:
+                references = self.image_references[image_hash] = set()
+            references.add((group_id, message_id))
+
+    async def on_image_captioned(self, image_info: Dict):
+        """
+        图片延迟识别完成后，将引用它的消息改写为描述。
+
+        消息以引用入库时全文和语义索引都检索不到图片内容，改写后由 replace_message_content 重新索引。
+        """
+        references = self.image_references.pop(image_info["hash"], None)
+        if not references:
+            return
+        reference = image_reference(image_info["hash"])
+        description = format_image_description(image_info)
+        try:
+            async with use_session() as session:
+                messages = await get_messages_by_ids(session, [message_id for _, message_id in references])
+        except Exception as e:
+            logger.error(f"Error loading messages referencing image {image_info['hash']}: {str(e)}")
+            return
+        for group_id, message_id in sorted(references):
+            message = messages.get(message_id)
+            if message is None or reference not in (message.content or ""):
+                continue
+            await self.replace_message_content(
+                group_id, message_id, message.content, message.content.replace(reference, description))
+
+    def _append_to_cache(self, group_id: int, message_id: int, entry: Dict):
+        # 只在已有缓存时追加，避免不完整的缓存被当作完整上下文返回
+        if group_id in self.message_cache:
+            self.message_cache[group_id].append(entry)
+            self.cache_last_ids[group_id] = message_id
+            self.message_cache[group_id] = self.message_cache[group_id][-self.config.CONTEXT_MESSAGE_COUNT:]
+            message_ids = self.cache_message_ids.get(group_id)
+            if message_ids is not None:
+                message_ids.append(message_id)
+                self.cache_message_ids[group_id] = message_ids[-self.config.CONTEXT_MESSAGE_COUNT:]
+
+    async def index_messages(self, group_id: int, messages: List[Tuple[int, str]]):
+        """将消息加入语义索引，向量化和文件写入在线程中执行"""
+        if not self.config.SEMANTIC_MEMORY_ENABLED or not messages:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, semantic_memory.add_messages, group_id, messages)
+        except Exception as e:
+            logger.error(f"Error indexing messages for group {group_id}: {str(e)}")
+
+    async def reindex_messages(self, group_id: int, messages: List[Tuple[int, str]]):
+        """按修改后的内容替换语义索引中的向量，向量化和文件写入在线程中执行"""
+        if not self.config.SEMANTIC_MEMORY_ENABLED or not messages:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, semantic_memory.replace_messages, group_id, messages)
+        except Exception as e:
+            logger.error(f"Error reindexing messages for group {group_id}: {str(e)}")
+
+    async def sync_semantic_index(self, group_id: int, batch_size: int = 1000) -> int:
+        """
+        将语义索引追赶到数据库中的最新消息，用于首次启用或重启后补齐。
+
+        Returns:
+            新索引的消息条数。
+        """
+        if not self.config.SEMANTIC_MEMORY_ENABLED:
+            return 0
+        loop = asyncio.get_running_loop()
+        last_id = await loop.run_in_executor(None, lambda: semantic_memory.get_index(group_id).last_id)
+        indexed = 0
+        while True:
+            async with use_session() as session:
+                messages = await get_messages_after(session, group_id, last_id, limit=batch_size)
+            if not messages:
+                break
+            await self.index_messages(group_id, [(msg.id, msg.content) for msg in messages])
+            indexed += len(messages)
+            last_id = messages[-1].id
+            if len(messages) < batch_size:
+                break
+        if indexed:
+            logger.info(f"Semantic index for group {group_id} caught up {indexed} messages")
+        return indexed
+
+    async def prune_semantic_index(self) -> int:
+        """
+        从语义索引中移除已被保留策略删除的消息。
+
+        保留策略总是先删除最旧的消息，因此每个群组只需保留不早于数据库中最早一条消息的向量。
+        启用归档时被移出的消息仍可从归档中检索，不做清理。
+
+        Returns:
+            从索引文件中移除的向量数。
+        """
+        if not self.config.SEMANTIC_MEMORY_ENABLED or self.config.MESSAGE_ARCHIVE_ENABLED:
+            return 0
+        loop = asyncio.get_running_loop()
+        group_ids = await loop.run_in_executor(None, semantic_memory.indexed_groups)
+        async with use_session() as session:
+            first_ids = await get_first_message_ids(session, group_ids)
+        removed = 0
+        for group_id, first_id in first_ids.items():
+            try:
+                removed += await loop.run_in_executor(None, semantic_memory.prune, group_id, first_id)
+            except Exception as e:
+                logger.error(f"Error pruning semantic index for group {group_id}: {str(e)}")
+        if removed:
+            logger.info(f"Pruned {removed} deleted messages from semantic indexes")
+        return removed
+
+    async def semantic_search(self, group_id: int, query: str, k: int = 5) -> List[Dict]:
+        """
+        按语义相似度检索群组历史消息。
+
+        Returns:
+            按相似度排序的消息列表，每项包含 id、user_id、content、timestamp、score。
+        """
+        if not self.config.SEMANTIC_MEMORY_ENABLED or not query or k <= 0:
+            return []
+        try:
+            loop = asyncio.get_running_loop()
+            hits = await loop.run_in_executor(
+                None, semantic_memory.search, group_id, query, k, self.config.SEMANTIC_MIN_SCORE)
+            if not hits:
+                return []
+            async with use_session() as session:
+                rows = await get_messages_by_ids(session, [message_id for message_id, _ in hits])
+                messages = {
+                    message_id: {"id": msg.id, "user_id": msg.user_id,
+                                 "content": msg.content, "timestamp": msg.timestamp}
+                    for message_id, msg in rows.items()
+                }
+                # 不在消息表中的命中可能已被归档
+                missing = [message_id for message_id, _ in hits if message_id not in messages]
+                if missing and self.config.MESSAGE_ARCHIVE_ENABLED:
+                    messages.update(await get_archived_messages_by_ids(session, group_id, missing))
+        except Exception as e:
+            logger.error(f"Error in semantic search for group {group_id}: {str(e)}")
+            return []
+        # 已被删除的消息不再返回
+        return [
+            {"id": message_id, "user_id": msg["user_id"], "content": msg["content"],
+             "timestamp": msg["timestamp"], "score": score}
+            for message_id, score in hits if (msg := messages.get(message_id))
+        ]
+
+    def search_impressions(self, group_id: int, query: str, k: int = 3) -> List[Tuple[int, str]]:
+        """
+        在已缓存的印象中检索与 query 相关的用户印象。
+
+        Returns:
+            (用户 ID, 印象内容) 列表，按相似度降序。
+        """
+        if not self.config.SEMANTIC_MEMORY_ENABLED or not query or k <= 0:
+            return []
+        candidates = {
+            user_id: content
+            for (cached_group_id, user_id, _), content in self.impression_cache.items()
+            if cached_group_id == group_id and isinstance(content, str) and content
+        }
+        ranked = semantic_memory.rank(query, candidates, k, self.config.SEMANTIC_MIN_SCORE)
+        return [(user_id, candidates[user_id]) for user_id, _ in ranked]
+
     async def update_memory(self, group_id: int, user_id: int, user_message: str, ai_response: str, character_id: str):
         try:
-            # 添加用户消息到数据库
-            async with get_session() as session:
-                new_message = Message(
-                    group_id=group_id, user_id=user_id, content=user_message, timestamp=datetime.utcnow())  # 设置时间戳
-                session.add(new_message)
-                await session.commit()
-            # 添加AI回复到数据库
-            async with get_session() as session:
-                new_message = Message(
-                    group_id=group_id, user_id=self.bot_id, content=ai_response, timestamp=datetime.utcnow())  # 设置时间戳
-                session.add(new_message)
-                await session.commit()
-            # 更新缓存
-            user_cache_entry = {"role": "user", "content": user_message}
-            ai_cache_entry = {"role": "assistant", "content": ai_response}
-            self.message_cache[group_id].insert(0, user_cache_entry)
-            self.message_cache[group_id].insert(0, ai_cache_entry)
-            self.message_cache[group_id] = self.message_cache[group_id][:self.config.CONTEXT_MESSAGE_COUNT]
-            # 更新印象
-            await self.update_impression(group_id, user_id, character_id, ai_response)
+            # 添加用户消息和AI回复到数据库，并同步缓存、活跃记录和语义索引
+            await self.add_message(group_id, user_id, user_message)
+            await self.add_message(group_id, self.bot_id, ai_response)
+            # 更新印象（进入写入队列，由定时任务批量落库）
+            self.queue_impression_update(
+                group_id, user_id, character_id, ai_response)
             logger.debug(
                 f"Memory updated for group {group_id}, user {user_id}")
         except Exception as e:
@@ -83,19 +384,26 @@ class MemoryManager:
         cache_key = (group_id, user_id, character_id)
         if cache_key in self.impression_cache:
             return self.impression_cache[cache_key]
+        # 同一事件流程内已确认不存在的印象不再重复查询
+        unit = current_unit()
+        if unit is not None and ("impression", cache_key) in unit.cache:
+            return None
         try:
-            async with get_session() as session:
-                impression = await session.execute(
+            async with use_session() as session:
+                result = await session.execute(
                     select(Impression).where(
                         Impression.group_id == group_id,
                         Impression.user_id == user_id,
                         Impression.character_id == character_id,
                         Impression.is_active == True
                     )
-                ).scalar_one_or_none()
+                )
+                impression = result.scalar_one_or_none()
                 if impression:
                     self.impression_cache[cache_key] = impression.content
                     return impression.content
+                if unit is not None:
+                    unit.cache[("impression", cache_key)] = None
                 return None
         except Exception as e:
             logger.error(
@@ -107,35 +415,61 @@ class MemoryManager:
         更新或创建用户对角色的印象。
         """
         try:
-            async with get_session() as session:
-                impression = await session.execute(
-                    select(Impression).where(
-                        Impression.group_id == group_id,
-                        Impression.user_id == user_id,
-                        Impression.character_id == character_id
-                    )
-                ).scalar_one_or_none()
-                if impression:
-                    impression.content = new_impression
-                else:
-                    impression = Impression(
-                        group_id=group_id,
-                        user_id=user_id,
-                        character_id=character_id,
-                        content=new_impression
-                    )
-                    session.add(impression)
-                await session.commit()
+            async with use_session() as session:
+                await upsert_impressions(session, [{
+                    "group_id": group_id,
+                    "user_id": user_id,
+                    "character_id": character_id,
+                    "content": new_impression,
+                }])
             # 更新缓存
             self.impression_cache[(
                 group_id, user_id, character_id)] = new_impression
+            # 已直接落库，丢弃队列中较旧的同键更新
+            self.pending_impressions.pop(
+                (group_id, user_id, character_id), None)
         except Exception as e:
             logger.error(
                 f"Error updating impression for group {group_id}, user {user_id}, character {character_id}: {str(e)}")
 
+    def queue_impression_update(self, group_id: int, user_id: int, character_id: str, new_impression: str):
+        """
+        将印象更新放入写入队列，缓存立即生效，由 flush_impression_updates 批量落库。
+        """
+        cache_key = (group_id, user_id, character_id)
+        self.impression_cache[cache_key] = new_impression
+        self.pending_impressions[cache_key] = new_impression
+
+    async def flush_impression_updates(self) -> int:
+        """
+        将队列中的印象更新以一条 upsert 语句写入数据库。
+
+        Returns:
+            写入的印象条数。
+        """
+        if not self.pending_impressions:
+            return 0
+        pending, self.pending_impressions = self.pending_impressions, {}
+        rows = [
+            {"group_id": group_id, "user_id": user_id,
+                "character_id": character_id, "content": content}
+            for (group_id, user_id, character_id), content in pending.items()
+        ]
+        try:
+            async with use_session() as session:
+                count = await upsert_impressions(session, rows)
+            logger.debug(f"Flushed {count} queued impression updates")
+            return count
+        except Exception as e:
+            # 写入失败时放回队列，保留期间产生的更新
+            for key, content in pending.items():
+                self.pending_impressions.setdefault(key, content)
+            logger.error(f"Error flushing impression updates: {str(e)}")
+            return 0
+
     async def deactivate_impression(self, group_id: int, user_id: int, character_id: str):
         try:
-            async with get_session() as session:
+            async with use_session() as session:
                 impression = await session.execute(
                     select(Impression).where(
                         Impression.group_id == group_id,
@@ -146,7 +480,7 @@ class MemoryManager:
                 if impression:
                     impression.is_active = False
                     impression.deactivated_at = datetime.utcnow()
-                    await session.commit()
+                    await commit_or_flush(session)
                     logger.info(
                         f"Impression deactivated for group {group_id}, user {user_id}, character {character_id}")
                 else:
@@ -157,7 +491,7 @@ class MemoryManager:
 
     async def reactivate_impression(self, group_id: int, user_id: int, character_id: str):
         try:
-            async with get_session() as session:
+            async with use_session() as session:
                 impression = await session.execute(
                     select(Impression).where(
                         Impression.group_id == group_id,
@@ -168,7 +502,7 @@ class MemoryManager:
                 if impression:
                     impression.is_active = True
                     impression.deactivated_at = None
-                    await session.commit()
+                    await commit_or_flush(session)
                     logger.info(
                         f"Impression reactivated for group {group_id}, user {user_id}, character {character_id}")
                 else:
@@ -181,8 +515,12 @@ class MemoryManager:
         if self.bot_id is None:
             logger.error("Bot ID not set. Please call set_bot_id() first.")
             return None
+        # 优先使用内存中的活跃记录
+        last_activity = activity_tracker.get_last_activity(group_id)
+        if last_activity is not None:
+            return last_activity
         try:
-            async with get_session() as session:
+            async with use_session() as session:
                 # 查询数据库中该群组的最后一条消息的时间戳
                 result = await session.execute(
                     select(Message.timestamp).where(Message.group_id ==
@@ -198,15 +536,242 @@ class MemoryManager:
                 f"Error getting last message time for group {group_id}: {str(e)}")
             return None
 
+    async def get_summary(self, group_id: int) -> Tuple[Optional[str], int]:
+        """
+        获取群组的滚动摘要。
+
+        Returns:
+            (摘要内容, 已折叠的最后消息 ID)，没有摘要时为 (None, 0)。
+        """
+        if group_id in self.summary_cache:
+            return self.summary_cache[group_id]
+        try:
+            async with use_session() as session:
+                summary = await get_summary(session, group_id)
+            cached = (summary.content, summary.last_message_id) if summary else (None, 0)
+            self.summary_cache[group_id] = cached
+            return cached
+        except Exception as e:
+            logger.error(f"Error getting summary for group {group_id}: {str(e)}")
+            return None, 0
+
+    async def get_context_messages(self, group_id: int) -> Tuple[Optional[str], List[Dict]]:
+        """
+        获取构建提示词所需的长期记忆与短期上下文。
+
+        Returns:
+            (滚动摘要, 尚未折叠进摘要的最新消息)，消息条数不超过 CONTEXT_MESSAGE_COUNT。
+        """
+        summary, last_message_id = await self.get_summary(group_id)
+        if not summary:
+            return None, await self.get_recent_messages(group_id, limit=self.config.CONTEXT_MESSAGE_COUNT)
+        cached = self._cached_messages_after(group_id, last_message_id, self.config.CONTEXT_MESSAGE_COUNT)
+        if cached is not None:
+            return summary, cached
+        try:
+            async with use_session() as session:
+                messages = await get_messages_after(
+                    session, group_id, last_message_id,
+                    limit=self.config.CONTEXT_MESSAGE_COUNT, newest=True)
+            return summary, [self._format_message(msg) for msg in messages]
+        except Exception as e:
+            logger.error(f"Error retrieving context messages: {str(e)}")
+            return summary, []
+
+    async def search_messages(self, group_id: int, query: str, k: int = 5) -> List[Dict]:
+        """
+        检索群组中与 query 相关的历史消息。
+
+        Returns:
+            按相关度排序的消息列表，每项包含 id、user_id、content、timestamp、score。
+        """
+        if not query or not query.strip() or k <= 0:
+            return []
+        try:
+            async with use_session() as session:
+                return await search_messages(session, group_id, query, k)
+        except Exception as e:
+            logger.error(f"Error searching messages for group {group_id}: {str(e)}")
+            return []
+
+    async def get_related_history(self, group_id: int, query: str, recent_messages: List[Dict], k: int) -> List[str]:
+        """
+        获取可注入提示词的相关历史聊天，排除已在最近上下文中的消息。
+        """
+        if k <= 0:
+            return []
+        recent_contents = {message["content"] for message in recent_messages}
+        keyword_hits = await self.search_messages(group_id, query, k + len(recent_messages))
+        semantic_hits = await self.semantic_search(group_id, query, k + len(recent_messages))
+        # 关键词命中与语义命中交替合并，按消息 ID 去重
+        merged: List[Dict] = []
+        seen = set()
+        for pair in zip_longest(keyword_hits, semantic_hits):
+            for hit in pair:
+                if hit and hit["id"] not in seen:
+                    seen.add(hit["id"])
+                    merged.append(hit)
+        related = []
+        for hit in merged:
+            if hit["content"] in recent_contents or hit["content"] == query:
+                continue
+            speaker = "我" if hit["user_id"] == self.bot_id else hit["user_id"]
+            related.append(f"{speaker}: {hit['content']}")
+            if len(related) >= k:
+                break
+        related = list(await asyncio.gather(*(image_captioner.resolve(line) for line in related)))
+        for user_id, impression in self.search_impressions(group_id, query, k):
+            related.append(f"对 {user_id} 的印象: {impression}")
+        return related
+
+    def _cached_messages_after(self, group_id: int, after_id: int, limit: int) -> Optional[List[Dict]]:
+        """
+        从消息缓存中取出 ID 大于 after_id 的最新 limit 条消息，缓存不足以确定结果时返回 None。
+
+        缓存保存群组最新的若干条消息：最早一条已被摘要折叠，或缓存中已有 limit 条时，
+        缓存中 after_id 之后的部分即为数据库查询的结果。
+        """
+        messages = self.message_cache.get(group_id)
+        message_ids = self.cache_message_ids.get(group_id)
+        if not messages or message_ids is None or len(message_ids) != len(messages):
+            return None
+        start = next((index for index, message_id in enumerate(message_ids) if message_id > after_id),
+                     len(message_ids))
+        if start == 0 and len(messages) < limit:
+            return None
+        return messages[start:][-limit:]
+
+    def _format_message(self, msg: Message) -> Dict:
+        return {"role": "user" if msg.user_id != self.bot_id else "assistant",
+                "content": msg.content}
+
+    async def compact_group(self, group_id: int) -> bool:
+        """
+        将一个窗口的较早消息折叠进群组的滚动摘要。
+
+        最新的 SUMMARY_TAIL_COUNT 条消息保留为原始记录，不参与折叠。
+
+        Returns:
+            是否完成了一次折叠。
+        """
+        summary, last_message_id = await self.get_summary(group_id)
+        async with use_session() as session:
+            tail_start_id = await get_tail_start_id(
+                session, group_id, self.config.SUMMARY_TAIL_COUNT)
+            if tail_start_id is None:
+                return False
+            messages = await get_messages_after(
+                session, group_id, last_message_id,
+                limit=self.config.SUMMARY_WINDOW, before_id=tail_start_id)
+            if len(messages) < self.config.SUMMARY_MIN_MESSAGES:
+                return False
+            stored = await get_summary(session, group_id)
+            message_count = stored.message_count if stored else 0
+        transcript = await image_captioner.resolve("\n".join(
+            f"{'我' if msg.user_id == self.bot_id else msg.user_id}: {msg.content}"
+            for msg in messages
+        ))
+        new_summary = await llm_generator.generate_response(
+            messages=[
+                {"role": "system", "content": SUMMARY_PROMPT.format(
+                    max_chars=self.config.SUMMARY_MAX_CHARS)},
+                {"role": "user", "content": f"【已有摘要】\n{summary or '无'}\n\n【新的聊天记录】\n{transcript}"},
+            ],
+            model=self.config.FAST_LLM_MODEL,
+            temperature=0.3,
+            max_tokens=self.config.SUMMARY_MAX_CHARS * 2,
+        )
+        if not new_summary:
+            logger.warning(f"Failed to summarize messages for group {group_id}")
+            return False
+        new_summary = new_summary.strip()
+        new_last_message_id = messages[-1].id
+        async with use_session() as session:
+            await save_summary(session, group_id, new_summary, new_last_message_id,
+                               message_count + len(messages))
+        self.summary_cache[group_id] = (new_summary, new_last_message_id)
+        logger.debug(
+            f"Compacted {len(messages)} messages into summary for group {group_id}")
+        return True
+
+    async def compact_idle_group(self, group_id: int):
+        """
+        群组空闲时连续折叠摘要，群组重新活跃或达到 SUMMARY_MAX_WINDOWS 时停止。
+        """
+        last_activity = activity_tracker.get_last_activity(group_id)
+        for _ in range(self.config.SUMMARY_MAX_WINDOWS):
+            try:
+                if not await self.compact_group(group_id):
+                    break
+            except Exception as e:
+                logger.error(f"Error compacting summary for group {group_id}: {str(e)}")
+                break
+            if activity_tracker.get_last_activity(group_id) != last_activity:
+                break
+
+    def dump_cache(self) -> Dict:
+        """导出缓存快照，只包含能与数据库核对的部分"""
+        return {
+            "messages": {group_id: list(messages) for group_id, messages in self.message_cache.items()
+                         if group_id in self.cache_last_ids},
+            "last_ids": dict(self.cache_last_ids),
+            "message_ids": {group_id: list(message_ids) for group_id, message_ids in self.cache_message_ids.items()},
+            "summaries": dict(self.summary_cache),
+            "impressions": {key: content for key, content in self.impression_cache.items()
+                            if isinstance(content, str)},
+            "pending_impressions": dict(self.pending_impressions),
+        }
+
+    async def restore_cache(self, data: Dict):
+        """
+        从快照恢复缓存。
+
+        消息缓存只在群组最后消息 ID 与数据库一致时恢复，摘要和印象只在内容与数据库一致时恢复；
+        尚未落库的印象更新重新放入写入队列。已有的缓存不会被覆盖。
+        """
+        snapshot_last_ids: Dict[int, int] = data.get("last_ids", {})
+        summaries: Dict[int, Tuple[Optional[str], int]] = data.get("summaries", {})
+        impressions: Dict[tuple, str] = data.get("impressions", {})
+        async with use_session() as session:
+            last_ids = await get_last_message_ids(session, list(snapshot_last_ids))
+            stored_summaries = await get_summaries(session, list(summaries))
+            stored_impressions = await get_active_impressions(
+                session, list({key[0] for key in impressions}), list({key[1] for key in impressions}))
+        restored = 0
+        for group_id, messages in data.get("messages", {}).items():
+            last_id = snapshot_last_ids.get(group_id)
+            if group_id in self.message_cache or last_id is None or last_ids.get(group_id) != last_id:
+                continue
+            self.message_cache[group_id] = messages
+            self.cache_last_ids[group_id] = last_id
+            message_ids = data.get("message_ids", {}).get(group_id)
+            if message_ids is not None and len(message_ids) == len(messages):
+                self.cache_message_ids[group_id] = message_ids
+            restored += 1
+        for group_id, cached in summaries.items():
+            stored = stored_summaries.get(group_id)
+            if cached == ((stored.content, stored.last_message_id) if stored else (None, 0)):
+                self.summary_cache.setdefault(group_id, cached)
+        for impression in stored_impressions:
+            key = (impression.group_id, impression.user_id, impression.character_id)
+            if impressions.get(key) == impression.content:
+                self.impression_cache.setdefault(key, impression.content)
+        for key, content in data.get("pending_impressions", {}).items():
+            self.pending_impressions.setdefault(key, content)
+            self.impression_cache.setdefault(key, content)
+        logger.debug(f"Restored message cache for {restored} of {len(snapshot_last_ids)} groups")
+
     async def clear_cache(self):
         """清理过期的缓存"""
         current_time = datetime.now()
         for group_id in list(self.message_cache.keys()):
             if current_time - self.message_cache[group_id][-1].get('timestamp', current_time) > self.cache_expiry:
                 del self.message_cache[group_id]
+                self.cache_message_ids.pop(group_id, None)
         for key in list(self.impression_cache.keys()):
             if current_time - self.impression_cache[key].get('timestamp', current_time) > self.cache_expiry:
                 del self.impression_cache[key]
 
 
 memory_manager = MemoryManager()
+cache_snapshot.register("memory", memory_manager.dump_cache, memory_manager.restore_cache)
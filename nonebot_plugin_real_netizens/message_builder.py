@@ -81,7 +81,9 @@ class MessageBuilder:
             "wiAfter": self.get_world_info_content("after", context),
             "loreAfter": self.get_world_info_content("after", context),
             "mesExamples": character_info.get("mes_example", ""),
-            "chat_history": context.get("chat_history", [])
+            "chat_history": context.get("chat_history", []),
+            "chatSummary": context.get("chat_summary") or "",
+            "relatedHistory": "\n".join(context.get("related_history") or []),
         }
 
         # 获取聊天历史
@@ -174,6 +176,18 @@ class MessageBuilder:
                             message_ids.append(str(uuid.uuid4()))
                 # 处理聊天历史
                 else:
+                    # 在聊天历史之前插入检索到的相关历史聊天
+                    if context.get("related_history"):
+                        related_message = {"role": "system", "content": "[相关的历史聊天]\n" + "\n".join(context["related_history"]),
+                                           "message_id": str(uuid.uuid4())}
+                        messages.append(related_message)
+                        message_ids.append(related_message["message_id"])
+                    # 在聊天历史之前插入较早聊天记录的滚动摘要
+                    if context.get("chat_summary"):
+                        summary_message = {"role": "system", "content": f"[较早的聊天摘要]\n{context['chat_summary']}",
+                                           "message_id": str(uuid.uuid4())}
+                        messages.append(summary_message)
+                        message_ids.append(summary_message["message_id"])
                     # 将聊天历史消息添加到 messages 列表
                     messages.extend(chat_history)
                     message_ids.extend([message["message_id"]
@@ -284,6 +298,8 @@ class MessageBuilder:
             {{isodate}}: 当前 ISO 日期（YYYY-MM-DD）。
             {{lastCharMessage}}: 角色发送的最后一条聊天消息。
             {{lastUserMessage}}: 用户发送的最后一条聊天消息。
+            {{chatSummary}}: 较早聊天记录的滚动摘要。
+            {{relatedHistory}}: 检索到的相关历史聊天。
 
         Args:
             template_string (str): 模板字符串。
@@ -1,11 +1,10 @@
 # nonebot_plugin_real_netizens\message_processor.py
-import hashlib
-import os
-from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
 
-import aiofiles
-import aiohttp
-from .db.database import add_image_record, get_image_by_hash
+from .db.database import add_image_alias, add_image_record, get_image_by_file_id, get_image_by_hash
+from .db.unit_of_work import detach_unit
 from nonebot import get_driver
 from nonebot.adapters.onebot.v11 import GroupMessageEvent, Message, MessageSegment
 from nonebot.log import logger
@@ -13,17 +12,57 @@ from nonebot.log import logger
 from .character_manager import character_manager
 from .config import Config
 from .group_config_manager import group_config_manager
+from .image_cache import image_cache
+from .image_captioner import format_image_description, image_captioner
+from .image_downloader import ImageDownloadError, image_downloader
+from .image_index import image_index
 from .image_processor import image_processor
 from .llm_generator import llm_generator
 from .memory_manager import memory_manager
 from .message_builder import MessageBuilder
 
 plugin_config = Config.parse_obj(get_driver().config)
+# 下载器查询缓存时表示该图片近期识别失败
+_FAILED = object()
+# 截止时间内未完成识别的图片在消息中的占位符
+IMAGE_PLACEHOLDER = "[图片: 识别中]"
+
+
+async def _lookup_image(image_hash: str):
+    if image_cache.is_failed(image_hash):
+        return _FAILED
+    return await get_image_by_hash(image_hash)
+
+
+@dataclass
+class MessageContent:
+    """
+    消息的文本和图片描述。
+
+    Attributes:
+        text: 拼接后的文本内容。
+        images: 按消息中的顺序排列的图片描述，识别失败为 None，尚未完成为占位符。
+        pending: 截止时间内未完成的图片任务，键为图片在 images 中的位置。
+    """
+    text: str = ""
+    images: List[Optional[str]] = field(default_factory=list)
+    pending: Dict[int, "asyncio.Task[Optional[str]]"] = field(default_factory=dict)
+
+    @property
+    def image_descriptions(self) -> List[str]:
+        return [description for description in self.images if description]
+
+    def render(self) -> str:
+        return self.text + " ".join(self.image_descriptions)
 
 
 class MessageProcessor:
     def __init__(self):
         self.config_cache: Dict[int, Any] = {}
+        # 后台运行的图片和补写任务，保持引用避免被回收
+        self.background_tasks = set()
+        # 正在下载或识别的图片，键为 ("file", 文件 ID) 或 ("hash", MD5)，同一图片同时只处理一次
+        self.inflight: Dict[Tuple[str, str], asyncio.Task] = {}
         group_config_manager.register_observer(self.on_config_change)
 
     def on_config_change(self, group_id: int):
@@ -55,6 +94,7 @@ class MessageProcessor:
         )
         message = event.message
         full_content, image_descriptions = await self.process_message_content(message)
+        full_content = await image_captioner.resolve(full_content)
         # 更新上下文
         context["message"] = full_content
         # 构建消息
@@ -75,53 +115,172 @@ class MessageProcessor:
 
     async def process_message_content(self, message: Message) -> Tuple[str, List[str]]:
         """处理消息内容，提取文本和图片描述。"""
-        text_content = ""
-        image_descriptions = []
+        content = await self.parse_message_content(message)
+        return content.render(), content.image_descriptions
+
+    async def parse_message_content(self, message: Message, deadline: Optional[float] = None) -> MessageContent:
+        """
+        并发识别消息中的图片，最多等待 deadline 秒。
+
+        同一条消息最多同时处理 IMAGE_MESSAGE_CONCURRENCY 张图片。超时的图片继续在后台识别，
+        在消息中先以占位符代替，可通过 backfill_message 在完成后补写到已保存的消息。
+
+        Args:
+            deadline: 等待的最长时间（秒），默认取 IMAGE_MESSAGE_DEADLINE，0 表示等待全部图片。
+        """
+        if deadline is None:
+            deadline = plugin_config.IMAGE_MESSAGE_DEADLINE
+        content = MessageContent()
+        semaphore = asyncio.Semaphore(plugin_config.IMAGE_MESSAGE_CONCURRENCY)
+        tasks: List[asyncio.Task] = []
         for segment in message:
             if segment.type == "text":
-                text_content += segment.data['text']
+                content.text += segment.data['text']
             elif segment.type == "image":
-                image_url = segment.data['url']
-                try:
-                    image_info = await self.download_and_process_image(image_url)
-                    if image_info:
-                        description = f"[图片描述: {image_info['description']}]"
-                        if image_info['is_meme']:
-                            description += f"[表情包情绪: {image_info['emotion_tag']}]"
-                        image_descriptions.append(description)
-                except Exception as e:
-                    logger.error(
-                        f"Error downloading or processing image: {str(e)}")
-        full_content = text_content + " ".join(image_descriptions)
-        return full_content, image_descriptions
-
-    async def download_and_process_image(self, image_url: str) -> Optional[Dict]:
-        """下载并处理图片。"""
+                tasks.append(self._spawn(self._describe_segment(segment, semaphore)))
+        if not tasks:
+            return content
+        done, _ = await asyncio.wait(tasks, timeout=deadline or None)
+        for index, task in enumerate(tasks):
+            if task in done:
+                content.images.append(task.result())
+            else:
+                content.images.append(IMAGE_PLACEHOLDER)
+                content.pending[index] = task
+        if content.pending:
+            logger.debug(f"{len(content.pending)} of {len(tasks)} images not ready after {deadline}s")
+        return content
+
+    def start_backfill(self, group_id: int, message_id: int, content: MessageContent):
+        """在后台等待未完成的图片识别并补写消息，没有未完成的图片时不做任何事"""
+        if content.pending:
+            self._spawn(self.backfill_message(group_id, message_id, content))
+
+    async def backfill_message(self, group_id: int, message_id: int, content: MessageContent):
+        """等待未完成的图片识别，将描述补写到已保存的消息中"""
+        detach_unit()
+        old_content = content.render()
+        for index, task in content.pending.items():
+            content.images[index] = await task
+        content.pending = {}
+        new_content = content.render()
+        if new_content != old_content:
+            await memory_manager.replace_message_content(group_id, message_id, old_content, new_content)
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
+
+    async def _shared(self, key: Tuple[str, str], factory: Callable[[], Awaitable[Optional[Dict]]]) -> Optional[Dict]:
+        """同一键同时只运行一个任务，其余调用者等待同一个结果"""
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(factory())
+            self.inflight[key] = task
+            task.add_done_callback(lambda _: self.inflight.pop(key, None))
+        # 某个等待者被取消时不影响共享的任务
+        return await asyncio.shield(task)
+
+    async def _describe_segment(self, segment: MessageSegment, semaphore: asyncio.Semaphore) -> Optional[str]:
+        """识别单个图片消息段并生成描述，失败时返回 None"""
+        # 多张图片并发识别，不能共用所在工作单元的会话
+        detach_unit()
+        image_url = segment.data.get('url') or segment.data.get('file')
+        async with semaphore:
+            try:
+                # 同一条消息或多个群组中同时出现的相同图片只下载和识别一次
+                image_info = await self._shared(
+                    ("file", segment.data.get('file') or image_url),
+                    lambda: self.download_and_process_image(image_url, segment.data.get('file')))
+            except Exception as e:
+                logger.error(f"Error downloading or processing image: {str(e)}")
+                return None
+        if not image_info:
+            return None
+        return format_image_description(image_info)
+
+    async def download_and_process_image(self, image_url: str, file_name: Optional[str] = None) -> Optional[Dict]:
+        """下载并处理图片，已识别过的图片直接返回记录，尽量不完整下载。"""
+        # 消息段的 file 字段由内容生成，同一张图片重复发送时不变
+        file_id = file_name if file_name and len(file_name) <= 255 and "://" not in file_name else None
+        if image_cache.is_failed(file_id):
+            return None
+        if file_id:
+            image_info = await get_image_by_file_id(file_id)
+            if image_info:
+                return image_info
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(image_url) as resp:
-                    if resp.status != 200:
-                        raise aiohttp.ClientError(
-                            f"Failed to download image: HTTP {resp.status}")
-                    image_data = await resp.read()
-        except aiohttp.ClientError as e:
+            result = await image_downloader.fetch(image_url, lookup=_lookup_image, hint=file_name)
+        except ImageDownloadError as e:
             logger.error(f"Error downloading image from {image_url}: {e}")
             return None
-        image_hash = hashlib.md5(image_data).hexdigest()
-        existing_image = await get_image_by_hash(image_hash)
-        if existing_image:
-            return existing_image
-        image_file = f"{image_hash}.jpg"
-        os.makedirs(plugin_config.IMAGE_SAVE_PATH, exist_ok=True)
-        image_path = os.path.join(plugin_config.IMAGE_SAVE_PATH, image_file)
-        async with aiofiles.open(image_path, mode="wb") as f:
-            await f.write(image_data)
-        success, image_info = await image_processor.process_image(image_path, image_hash)
-        if success:
-            await add_image_record(image_info)
-            return image_info
+        if result.cached is _FAILED:
+            image_cache.mark_failed(file_id)
+            return None
+        if result.cached is not None:
+            image_info = result.cached
         else:
+            # 文件 ID 不同但内容相同的图片按 MD5 合并
+            image_info = await self._shared(
+                ("hash", result.hash), lambda: self.process_new_image(result.data, result.hash))
+            if image_info is None:
+                # 识别失败的图片在一段时间内不再重试
+                image_cache.mark_failed(result.hash, file_id)
+                return None
+        if file_id:
+            await add_image_alias(file_id, image_info)
+        return image_info
+
+    async def process_new_image(self, image_data: bytes, image_hash: str) -> Optional[Dict]:
+        """
+        识别 MD5 未见过的图片，近似重复的图片直接复用已有的记录。
+
+        lazy 模式下只保存图片和不带描述的记录，由 image_captioner 在需要时识别。
+        """
+        phash = None
+        if image_index.enabled:
+            try:
+                phash = await image_processor.perceptual_hash(image_data)
+            except Exception as e:
+                logger.warning(f"Failed to compute pHash for image {image_hash}: {e}")
+        if phash:
+            similar = image_index.find_similar(phash)
+            similar_info = await get_image_by_hash(similar[0]) if similar else None
+            # 相似的图片自身也尚未识别时不复用
+            if similar_info and similar_info["description"] is not None:
+                logger.debug(f"Image {image_hash} is a near duplicate of {similar[0]} (distance {similar[1]})")
+                # 不保存新图片，也不另建记录，文件 ID 的别名直接指向相似图片的记录
+                return similar_info
+        if image_captioner.lazy:
+            try:
+                image_path = await image_processor.save_image(image_hash, image_data)
+            except OSError as e:
+                logger.error(f"Error saving image {image_hash}: {e}")
+                return None
+            image_info = {
+                "file_path": image_path,
+                "file_name": f"{image_hash}.jpg",
+                "hash": image_hash,
+                "description": None,
+                "is_meme": False,
+                "emotion_tag": None,
+            }
+            # 其他进程已写入同一图片时以数据库中的记录为准
+            image_info = await add_image_record(dict(image_info, phash=phash))
+            if image_info["description"] is None:
+                image_captioner.enqueue(image_hash, image_info["file_path"])
+            if phash:
+                image_index.add(phash, image_hash)
+            return image_info
+        success, image_info = await image_processor.process_image_data(image_data, image_hash)
+        if not success:
             return None
+        image_info = await add_image_record(dict(image_info, phash=phash))
+        if phash:
+            image_index.add(phash, image_hash)
+        return image_info
 
 
 message_processor = MessageProcessor()
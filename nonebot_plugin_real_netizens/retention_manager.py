@@ -0,0 +1,148 @@
+# nonebot_plugin_real_netizens\retention_manager.py
+import asyncio
+import time
+from typing import Optional
+
+from nonebot.log import logger
+from nonebot_plugin_datastore import get_session
+from pydantic import BaseModel
+
+from .config import plugin_config
+from .db.archive import archive_group_overflow_messages, archive_old_messages
+from .db.database import (
+    delete_group_overflow_messages,
+    delete_old_messages,
+    get_group_message_counts,
+)
+from .memory_manager import memory_manager
+
+
+class RetentionReport(BaseModel):
+    """
+    单轮清理报告。
+
+    Attributes:
+        age_deleted: 因超过保存天数删除的行数。
+        overflow_deleted: 因超过群组保存条数删除的行数。
+        batches: 执行的删除批次数。
+        paused_seconds: 批次之间暂停的总时间（秒）。
+        elapsed_seconds: 本轮清理的总耗时（秒）。
+        finished: 本轮是否已清理完，为 False 时剩余部分留到下一轮。
+        archived: 移出的消息是否已归档，为 False 时直接删除。
+    """
+    age_deleted: int = 0
+    overflow_deleted: int = 0
+    batches: int = 0
+    paused_seconds: float = 0.0
+    elapsed_seconds: float = 0.0
+    finished: bool = True
+    archived: bool = False
+
+    @property
+    def rows_deleted(self) -> int:
+        return self.age_deleted + self.overflow_deleted
+
+
+class RetentionManager:
+    """
+    聊天记录保留策略执行器。
+
+    分小批删除超过 MESSAGE_RETENTION_DAYS 天或超出每群 CHAT_HISTORY_LIMIT 条的消息，
+    批次之间暂停以让出数据库锁；每轮最多执行 RETENTION_MAX_BATCHES 批，可全天增量运行。
+    启用 MESSAGE_ARCHIVE_ENABLED 时消息被压缩归档而不是删除。
+    """
+
+    def __init__(self):
+        # 在 run 中创建：Python 3.8/3.9 的 Lock 在创建时绑定事件循环，模块导入时循环尚未运行
+        self._lock: Optional[asyncio.Lock] = None
+        self.last_report: RetentionReport = RetentionReport()
+
+    async def run(self) -> RetentionReport:
+        """
+        执行一轮清理。
+
+        Returns:
+            本轮清理报告；上一轮尚未结束时直接返回上一轮的报告。
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        if self._lock.locked():
+            return self.last_report
+        async with self._lock:
+            report = RetentionReport(archived=plugin_config.MESSAGE_ARCHIVE_ENABLED)
+            start = time.perf_counter()
+            budget = plugin_config.RETENTION_MAX_BATCHES
+            try:
+                budget = await self._enforce_age(report, budget)
+                if budget > 0:
+                    await self._enforce_limit(report, budget)
+                if report.rows_deleted and not report.archived:
+                    await memory_manager.prune_semantic_index()
+            except Exception as e:
+                logger.error(f"Error enforcing message retention: {e}")
+            report.elapsed_seconds = time.perf_counter() - start
+            self.last_report = report
+            if report.rows_deleted or not report.finished:
+                logger.info(
+                    f"Retention: {'archived' if report.archived else 'deleted'} {report.rows_deleted} messages "
+                    f"({report.age_deleted} expired, {report.overflow_deleted} over limit) "
+                    f"in {report.batches} batches, paused {report.paused_seconds:.2f}s, "
+                    f"took {report.elapsed_seconds:.2f}s, finished={report.finished}")
+            return report
+
+    async def _enforce_age(self, report: RetentionReport, budget: int) -> int:
+        days = plugin_config.MESSAGE_RETENTION_DAYS
+        batch_size = plugin_config.RETENTION_BATCH_SIZE
+        if days <= 0:
+            return budget
+        while budget > 0:
+            async with get_session() as session:
+                if plugin_config.MESSAGE_ARCHIVE_ENABLED:
+                    deleted = await archive_old_messages(session, days, batch_size)
+                else:
+                    deleted = await delete_old_messages(session, days, batch_size)
+            report.batches += 1
+            report.age_deleted += deleted
+            budget -= 1
+            if deleted < batch_size:
+                return budget
+            await self._pause(report)
+        report.finished = False
+        return budget
+
+    async def _enforce_limit(self, report: RetentionReport, budget: int) -> int:
+        limit = plugin_config.CHAT_HISTORY_LIMIT
+        batch_size = plugin_config.RETENTION_BATCH_SIZE
+        if limit <= 0:
+            return budget
+        async with get_session() as session:
+            counts = await get_group_message_counts(session)
+        for group_id, count in counts.items():
+            overflow = count - limit
+            while overflow > 0:
+                if budget <= 0:
+                    report.finished = False
+                    return budget
+                async with get_session() as session:
+                    if plugin_config.MESSAGE_ARCHIVE_ENABLED:
+                        deleted = await archive_group_overflow_messages(
+                            session, group_id, limit, batch_size)
+                    else:
+                        deleted = await delete_group_overflow_messages(
+                            session, group_id, limit, batch_size)
+                report.batches += 1
+                report.overflow_deleted += deleted
+                budget -= 1
+                if not deleted:
+                    break
+                overflow -= deleted
+                await self._pause(report)
+        return budget
+
+    async def _pause(self, report: RetentionReport):
+        pause = plugin_config.RETENTION_BATCH_PAUSE
+        await asyncio.sleep(pause)
+        report.paused_seconds += pause
+
+
+retention_manager = RetentionManager()
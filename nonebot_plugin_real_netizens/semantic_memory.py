@@ -0,0 +1,386 @@
+# nonebot_plugin_real_netizens\semantic_memory.py
+import os
+import re
+import threading
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from nonebot.log import logger
+
+from .config import plugin_config
+
+
+class HashingVectorizer:
+    """
+    哈希向量化器。
+
+    将文本的字符 n-gram 通过 CRC32 哈希映射到固定维度，并用哈希的一位决定符号以抵消冲突，
+    结果做 L2 归一化。无需词表、分词或外部嵌入服务，中文按字切分即可工作。
+    """
+
+    def __init__(self, dim: int = 256, ngram_range: Tuple[int, int] = (1, 2)):
+        """
+        初始化哈希向量化器。
+
+        Args:
+            dim (int): 向量维度。
+            ngram_range (Tuple[int, int]): 字符 n-gram 的最小和最大长度。
+        """
+        self.dim = dim
+        self.ngram_range = ngram_range
+
+    def _normalize(self, text: str) -> str:
+        return re.sub(r"\s+", " ", text.lower()).strip()
+
+    def transform(self, text: str) -> np.ndarray:
+        """
+        将单条文本转换为归一化向量。
+
+        Args:
+            text (str): 文本。
+
+        Returns:
+            np.ndarray: 形状为 (dim,) 的 float32 向量，空文本返回零向量。
+        """
+        vector = np.zeros(self.dim, dtype=np.float32)
+        text = self._normalize(text)
+        min_n, max_n = self.ngram_range
+        for n in range(min_n, max_n + 1):
+            for i in range(len(text) - n + 1):
+                h = zlib.crc32(text[i:i + n].encode("utf-8"))
+                vector[h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector
+
+    def transform_many(self, texts: Iterable[str]) -> np.ndarray:
+        """将多条文本转换为形状为 (n, dim) 的矩阵。"""
+        vectors = [self.transform(text) for text in texts]
+        if not vectors:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.vstack(vectors)
+
+
+class SemanticIndex:
+    """
+    单个群组的向量索引。
+
+    向量以 float32 追加写入 .vec 文件，对应的消息 ID 以 int64 写入 .ids 文件；
+    检索时通过内存映射读取整个矩阵，一次矩阵向量乘法完成余弦相似度计算。
+    映射之后追加的向量同时保存在内存中的尾部数组，超过 TAIL_LIMIT 行才重新映射文件。
+    """
+
+    # 尾部数组超过该行数时重新映射文件
+    TAIL_LIMIT = 4096
+    # 过期向量超过该比例时重写索引文件
+    COMPACT_RATIO = 0.1
+    # 重写索引文件时每次复制的行数
+    COMPACT_CHUNK = 65536
+
+    def __init__(self, path: str, dim: int):
+        """
+        初始化向量索引。
+
+        Args:
+            path (str): 索引文件路径前缀，不含扩展名。
+            dim (int): 向量维度。
+        """
+        self.vec_path = f"{path}.vec"
+        self.ids_path = f"{path}.ids"
+        self.dim = dim
+        self.lock = threading.Lock()
+        self._matrix: Optional[np.memmap] = None
+        self._ids: Optional[np.ndarray] = None
+        self._tail_vectors: Optional[np.ndarray] = None
+        self._tail_ids: Optional[np.ndarray] = None
+        # 小于该 ID 的消息已被删除，检索时跳过
+        self.min_id = 0
+        self.count = self._load_count()
+
+    def _load_count(self) -> int:
+        if not os.path.exists(self.vec_path) or not os.path.exists(self.ids_path):
+            return 0
+        rows = os.path.getsize(self.vec_path) // (4 * self.dim)
+        ids = os.path.getsize(self.ids_path) // 8
+        if rows < ids:
+            # 追加时先写向量，只有重写索引文件中断才会出现向量少于 ID，
+            # 此时两者无法对应，删除后由 sync_semantic_index 重建
+            logger.warning(f"Semantic index {self.vec_path} is inconsistent, rebuilding")
+            os.remove(self.vec_path)
+            os.remove(self.ids_path)
+            return 0
+        # 以较短的文件为准，丢弃中断写入留下的残缺记录
+        return ids
+
+    @property
+    def last_id(self) -> int:
+        """已索引的最大消息 ID，索引为空时返回 0。"""
+        with self.lock:
+            if not self.count:
+                return 0
+            self._open()
+            return int(self._all_ids().max())
+
+    def add(self, ids: List[int], vectors: np.ndarray):
+        """
+        追加向量。
+
+        Args:
+            ids (List[int]): 消息 ID 列表。
+            vectors (np.ndarray): 形状为 (len(ids), dim) 的向量矩阵。
+        """
+        if not ids:
+            return
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        ids = np.asarray(ids, dtype=np.int64)
+        with self.lock:
+            os.makedirs(os.path.dirname(self.vec_path) or ".", exist_ok=True)
+            # 截断残缺记录后再追加，保证两个文件行数一致
+            for path, width in ((self.vec_path, 4 * self.dim), (self.ids_path, 8)):
+                if os.path.exists(path) and os.path.getsize(path) != self.count * width:
+                    with open(path, "r+b") as f:
+                        f.truncate(self.count * width)
+            with open(self.vec_path, "ab") as f:
+                f.write(vectors.tobytes())
+            with open(self.ids_path, "ab") as f:
+                f.write(ids.tobytes())
+            self.count += len(ids)
+            if self._matrix is None:
+                return
+            # 已映射时追加到尾部数组，避免每条消息都重新读取整个索引
+            if self._tail_ids is None:
+                self._tail_vectors, self._tail_ids = vectors, ids
+            else:
+                self._tail_vectors = np.vstack((self._tail_vectors, vectors))
+                self._tail_ids = np.concatenate((self._tail_ids, ids))
+            if len(self._tail_ids) > self.TAIL_LIMIT:
+                self._ids = self._all_ids()
+                self._map()
+
+    def replace(self, ids: List[int], vectors: np.ndarray) -> int:
+        """
+        原位替换已索引消息的向量，用于消息内容被修改后重新索引。
+
+        Args:
+            ids (List[int]): 消息 ID 列表，不在索引中的忽略。
+            vectors (np.ndarray): 形状为 (len(ids), dim) 的向量矩阵。
+
+        Returns:
+            int: 替换的向量数。
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self.lock:
+            if not self.count or not len(ids):
+                return 0
+            self._open()
+            all_ids = self._all_ids()
+            mapped = len(self._matrix)
+            replaced = 0
+            # 内存映射与文件共享页缓存，写入文件后映射中立即可见；尾部数组需单独更新
+            with open(self.vec_path, "r+b") as f:
+                for message_id, vector in zip(ids, vectors):
+                    for position in np.flatnonzero(all_ids == message_id):
+                        f.seek(int(position) * 4 * self.dim)
+                        f.write(vector.tobytes())
+                        if position >= mapped:
+                            self._tail_vectors[position - mapped] = vector
+                        replaced += 1
+            return replaced
+
+    def _open(self):
+        if self._matrix is None:
+            self._ids = np.fromfile(self.ids_path, dtype=np.int64, count=self.count)
+            self._map()
+
+    def _map(self):
+        self._matrix = np.memmap(self.vec_path, dtype=np.float32, mode="r",
+                                 shape=(self.count, self.dim))
+        self._tail_vectors = None
+        self._tail_ids = None
+
+    def _all_ids(self) -> np.ndarray:
+        if self._tail_ids is None:
+            return self._ids
+        return np.concatenate((self._ids, self._tail_ids))
+
+    def search(self, query: np.ndarray, k: int) -> List[Tuple[int, float]]:
+        """
+        检索与查询向量最相似的 k 条记录。
+
+        Args:
+            query (np.ndarray): 归一化的查询向量。
+            k (int): 返回条数。
+
+        Returns:
+            List[Tuple[int, float]]: (消息 ID, 余弦相似度) 列表，按相似度降序。
+        """
+        with self.lock:
+            if not self.count or k <= 0:
+                return []
+            self._open()
+            scores = self._matrix @ query
+            if self._tail_ids is not None:
+                scores = np.concatenate((scores, self._tail_vectors @ query))
+            ids = self._all_ids()
+            if self.min_id:
+                scores = np.where(ids >= self.min_id, scores, -np.inf)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(ids[i]), float(scores[i])) for i in top if np.isfinite(scores[i])]
+
+    def prune(self, min_id: int) -> int:
+        """
+        移除消息 ID 小于 min_id 的向量。
+
+        过期向量先在检索时跳过，超过 COMPACT_RATIO 后才重写索引文件。
+
+        Returns:
+            int: 从索引文件中移除的向量数。
+        """
+        with self.lock:
+            if not self.count or min_id <= self.min_id:
+                return 0
+            self.min_id = min_id
+            self._open()
+            ids = self._all_ids()
+            keep = ids >= min_id
+            kept = int(keep.sum())
+            if self.count - kept < max(1, self.count * self.COMPACT_RATIO):
+                return 0
+            matrix, tail = self._matrix, self._tail_vectors
+            self._matrix = None
+            # 先替换向量文件再替换 ID 文件，中断时向量少于 ID，加载时据此重建
+            with open(f"{self.vec_path}.tmp", "wb") as f:
+                for start in range(0, len(matrix), self.COMPACT_CHUNK):
+                    rows = matrix[start:start + self.COMPACT_CHUNK]
+                    f.write(np.ascontiguousarray(rows[keep[start:start + len(rows)]]).tobytes())
+                if tail is not None:
+                    f.write(tail[keep[len(matrix):]].tobytes())
+            del matrix
+            ids[keep].tofile(f"{self.ids_path}.tmp")
+            os.replace(f"{self.vec_path}.tmp", self.vec_path)
+            os.replace(f"{self.ids_path}.tmp", self.ids_path)
+            removed = self.count - kept
+            self.count = kept
+            self._ids = self._tail_vectors = self._tail_ids = None
+            return removed
+
+
+class SemanticMemory:
+    """
+    本地语义记忆。
+
+    每个群组一个向量索引文件，检索以向量化余弦相似度完成，单核可扩展到百万级消息。
+    """
+
+    def __init__(self, base_path: str, dim: int = 256):
+        """
+        初始化语义记忆。
+
+        Args:
+            base_path (str): 索引文件目录。
+            dim (int): 向量维度。
+        """
+        self.base_path = base_path
+        self.vectorizer = HashingVectorizer(dim)
+        self.indexes: Dict[int, SemanticIndex] = {}
+        # 索引在线程池中创建，同一群组只能有一个索引对象操作索引文件
+        self.lock = threading.Lock()
+
+    def get_index(self, group_id: int) -> SemanticIndex:
+        """获取群组的向量索引，不存在时创建。索引的读写各自加锁，可在多个线程中使用。"""
+        index = self.indexes.get(group_id)
+        if index is not None:
+            return index
+        with self.lock:
+            if group_id not in self.indexes:
+                self.indexes[group_id] = SemanticIndex(
+                    os.path.join(self.base_path, str(group_id)), self.vectorizer.dim)
+            return self.indexes[group_id]
+
+    def add_messages(self, group_id: int, messages: List[Tuple[int, str]]):
+        """
+        将消息加入群组索引。
+
+        Args:
+            group_id (int): 群组 ID。
+            messages (List[Tuple[int, str]]): (消息 ID, 消息内容) 列表。
+        """
+        messages = [(message_id, content) for message_id, content in messages if content]
+        if not messages:
+            return
+        vectors = self.vectorizer.transform_many(content for _, content in messages)
+        self.get_index(group_id).add([message_id for message_id, _ in messages], vectors)
+
+    def replace_messages(self, group_id: int, messages: List[Tuple[int, str]]) -> int:
+        """
+        按新内容重新计算已索引消息的向量。
+
+        尚未索引的消息不在这里加入，由 add_messages 或 sync_semantic_index 负责。
+
+        Args:
+            group_id (int): 群组 ID。
+            messages (List[Tuple[int, str]]): (消息 ID, 新的消息内容) 列表。
+
+        Returns:
+            int: 替换的向量数。
+        """
+        messages = [(message_id, content) for message_id, content in messages if content]
+        if not messages:
+            return 0
+        vectors = self.vectorizer.transform_many(content for _, content in messages)
+        return self.get_index(group_id).replace([message_id for message_id, _ in messages], vectors)
+
+    def indexed_groups(self) -> List[int]:
+        """获取索引目录中已有索引文件的群组 ID。"""
+        if not os.path.isdir(self.base_path):
+            return []
+        names = (name[:-len(".ids")] for name in os.listdir(self.base_path) if name.endswith(".ids"))
+        return [int(name) for name in names if name.lstrip("-").isdigit()]
+
+    def prune(self, group_id: int, min_id: int) -> int:
+        """
+        移除群组索引中消息 ID 小于 min_id 的向量。
+
+        Returns:
+            int: 从索引文件中移除的向量数。
+        """
+        return self.get_index(group_id).prune(min_id)
+
+    def search(self, group_id: int, query: str, k: int = 5, min_score: float = 0.0) -> List[Tuple[int, float]]:
+        """
+        检索群组中与 query 语义相近的消息。
+
+        Returns:
+            List[Tuple[int, float]]: (消息 ID, 相似度) 列表，按相似度降序。
+        """
+        vector = self.vectorizer.transform(query)
+        if not vector.any():
+            return []
+        hits = self.get_index(group_id).search(vector, k)
+        return [(message_id, score) for message_id, score in hits if score >= min_score]
+
+    def rank(self, query: str, candidates: Dict[int, str], k: int = 5, min_score: float = 0.0) -> List[Tuple[int, float]]:
+        """
+        对少量候选文本（例如用户印象）按与 query 的相似度排序。
+
+        Args:
+            query (str): 查询文本。
+            candidates (Dict[int, str]): 键到文本的映射。
+
+        Returns:
+            List[Tuple[int, float]]: (键, 相似度) 列表，按相似度降序。
+        """
+        if not candidates:
+            return []
+        vector = self.vectorizer.transform(query)
+        keys = list(candidates)
+        scores = self.vectorizer.transform_many(candidates[key] for key in keys) @ vector
+        order = np.argsort(-scores)[:k]
+        return [(keys[i], float(scores[i])) for i in order if scores[i] >= min_score]
+
+
+semantic_memory = SemanticMemory(plugin_config.SEMANTIC_INDEX_PATH, plugin_config.SEMANTIC_DIM)
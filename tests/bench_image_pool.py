@@ -0,0 +1,101 @@
+# tests\bench_image_pool.py
+"""
+图片工作池事件循环延迟基准测试。
+
+模拟一批大图同时到达，分别在事件循环中直接处理和通过 ImageWorkerPool 处理，
+同时运行一个每 10ms 唤醒一次的计时任务，统计它的唤醒延迟（事件循环卡顿）。
+
+用法: python tests/bench_image_pool.py [图片数量] [图片边长]
+"""
+import asyncio
+import importlib.util
+import os
+import statistics
+import sys
+import time
+from io import BytesIO
+
+from PIL import Image
+
+# 单独加载工作池模块，避免导入插件包时初始化 NoneBot
+_spec = importlib.util.spec_from_file_location(
+    "image_worker",
+    os.path.join(os.path.dirname(__file__), "..", "nonebot_plugin_real_netizens", "image_worker.py"),
+)
+image_worker = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(image_worker)
+
+TICK = 0.01
+MAX_SIZE = 512  # 与 Config.MAX_IMAGE_SIZE 的默认值保持一致
+
+
+def make_image(side: int, seed: int) -> bytes:
+    image = Image.effect_noise((side, side), 64 + seed % 32).convert("RGBA")
+    buffer = BytesIO()
+    image.save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+def preprocess(data: bytes) -> bytes:
+    # 与 ImageProcessor 的预处理流程一致：解码、缩放、合成白底、编码两次 JPEG
+    with Image.open(BytesIO(data)) as img:
+        img.thumbnail((MAX_SIZE, MAX_SIZE))
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[3])
+        first = BytesIO()
+        background.save(first, format="JPEG")
+    with Image.open(BytesIO(first.getvalue())) as img:
+        second = BytesIO()
+        img.convert("RGB").save(second, format="JPEG")
+        return second.getvalue()
+
+
+async def ticker(stop: asyncio.Event, lags: list):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(TICK)
+        lags.append(loop.time() - start - TICK)
+
+
+async def run(mode: str, images: list) -> dict:
+    stop = asyncio.Event()
+    lags: list = []
+    tick_task = asyncio.create_task(ticker(stop, lags))
+    await asyncio.sleep(TICK * 2)
+    pool = image_worker.ImageWorkerPool(kind=mode, max_pending=8, timeout=300) if mode != "inline" else None
+
+    async def handle(data: bytes):
+        if pool is None:
+            return preprocess(data)
+        return await pool.run(preprocess, data)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(handle(data) for data in images))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await tick_task
+    if pool is not None:
+        pool.shutdown(wait=True)
+    lags_ms = sorted(lag * 1000 for lag in lags) or [0.0]
+    return {
+        "elapsed": elapsed,
+        "p50": statistics.median(lags_ms),
+        "p99": lags_ms[min(len(lags_ms) - 1, int(len(lags_ms) * 0.99))],
+        "max": lags_ms[-1],
+    }
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 24
+    side = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    images = [make_image(side, seed) for seed in range(count)]
+    print(f"{count} images, {side}x{side} RGBA PNG")
+    print(f"{'mode':<8} {'total s':>8} {'lag p50 ms':>11} {'lag p99 ms':>11} {'lag max ms':>11}")
+    for mode in ("inline", "thread", "process"):
+        result = asyncio.run(run(mode, images))
+        print(f"{mode:<8} {result['elapsed']:>8.2f} {result['p50']:>11.1f} {result['p99']:>11.1f} {result['max']:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+# tests\bench_sqlite_profile.py
+"""
+SQLite 性能配置并发基准测试。
+
+模拟 add_message、印象写入和 save_user_info 的并发写入者与上下文读取者，
+对比 SQLite 默认配置与 init_database 应用的性能配置的吞吐量和锁冲突次数。
+
+用法: python tests/bench_sqlite_profile.py [写入线程数] [每线程事务数]
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+# 与 Config 中 SQLITE_* 的默认值保持一致
+TUNED_PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+]
+
+SCHEMA = [
+    "CREATE TABLE messages (id INTEGER PRIMARY KEY, group_id INTEGER, user_id INTEGER, content TEXT, timestamp REAL)",
+    "CREATE INDEX idx_message_group_id ON messages (group_id, id)",
+    "CREATE TABLE impressions (group_id INTEGER, user_id INTEGER, character_id TEXT, content TEXT, "
+    "UNIQUE (group_id, user_id, character_id))",
+    "CREATE TABLE users (user_id INTEGER PRIMARY KEY, nickname TEXT, last_message TEXT)",
+]
+
+
+def connect(path: str, tuned: bool) -> sqlite3.Connection:
+    # 两种配置都使用 sqlite3 默认的 5 秒连接超时
+    conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    if tuned:
+        for pragma in TUNED_PRAGMAS:
+            conn.execute(pragma)
+    return conn
+
+
+def writer(path: str, tuned: bool, worker: int, transactions: int, stats: dict, lock: threading.Lock):
+    conn = connect(path, tuned)
+    done = errors = 0
+    for i in range(transactions):
+        group_id = i % 20
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("INSERT INTO messages (group_id, user_id, content, timestamp) VALUES (?, ?, ?, ?)",
+                         (group_id, worker, f"消息 {worker}-{i}" * 4, time.time()))
+            conn.execute(
+                "INSERT INTO impressions VALUES (?, ?, 'nolll', ?) "
+                "ON CONFLICT (group_id, user_id, character_id) DO UPDATE SET content = excluded.content",
+                (group_id, worker, f"印象 {i}"))
+            conn.execute("INSERT OR REPLACE INTO users VALUES (?, ?, ?)",
+                         (worker, f"user{worker}", f"消息 {i}"))
+            conn.execute("COMMIT")
+            done += 1
+        except sqlite3.OperationalError:
+            errors += 1
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+    conn.close()
+    with lock:
+        stats["commits"] += done
+        stats["locked"] += errors
+
+
+def reader(path: str, tuned: bool, stop: threading.Event, stats: dict, lock: threading.Lock):
+    conn = connect(path, tuned)
+    reads = errors = 0
+    while not stop.is_set():
+        try:
+            conn.execute(
+                "SELECT content FROM messages WHERE group_id = ? ORDER BY id DESC LIMIT 30",
+                (reads % 20,)).fetchall()
+            reads += 1
+        except sqlite3.OperationalError:
+            errors += 1
+    conn.close()
+    with lock:
+        stats["reads"] += reads
+        stats["locked"] += errors
+
+
+def run(tuned: bool, writers: int, transactions: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        setup = connect(path, tuned)
+        for statement in SCHEMA:
+            setup.execute(statement)
+        setup.close()
+        stats = {"commits": 0, "reads": 0, "locked": 0}
+        lock = threading.Lock()
+        stop = threading.Event()
+        readers = [threading.Thread(target=reader, args=(path, tuned, stop, stats, lock))
+                   for _ in range(2)]
+        threads = [threading.Thread(target=writer, args=(path, tuned, n, transactions, stats, lock))
+                   for n in range(writers)]
+        start = time.perf_counter()
+        for thread in readers + threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        stop.set()
+        for thread in readers:
+            thread.join()
+        stats["elapsed"] = elapsed
+        stats["commits_per_sec"] = stats["commits"] / elapsed
+        return stats
+
+
+def main():
+    writers = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    transactions = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    print(f"SQLite {sqlite3.sqlite_version}, {writers} writers x {transactions} transactions, 2 readers")
+    for name, tuned in (("default", False), ("tuned", True)):
+        stats = run(tuned, writers, transactions)
+        print(f"{name:>8}: {stats['commits']:>6} commits, {stats['locked']:>6} locked errors, "
+              f"{stats['reads']:>7} reads, {stats['commits_per_sec']:>8.1f} commits/s, "
+              f"{stats['elapsed']:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# tests\test_activity_tracker.py
+import asyncio
+import time
+
+import pytest
+from nonebug import App
+
+
+@pytest.mark.asyncio
+async def test_idle_watcher_fires_after_threshold(app: App):
+    from nonebot_plugin_real_netizens.activity_tracker import ActivityTracker
+    tracker = ActivityTracker()
+    fired = []
+
+    async def on_idle(group_id: int):
+        fired.append(group_id)
+
+    tracker.add_idle_watcher("test", lambda group_id: 0.05, on_idle)
+    tracker.touch(123)
+    await asyncio.sleep(0.02)
+    assert fired == []
+    await asyncio.sleep(0.1)
+    assert fired == [123]
+    # 触发后在群组再次活跃前不会重复触发
+    await asyncio.sleep(0.1)
+    assert fired == [123]
+
+
+@pytest.mark.asyncio
+async def test_touch_resets_timer(app: App):
+    from nonebot_plugin_real_netizens.activity_tracker import ActivityTracker
+    tracker = ActivityTracker()
+    fired = []
+
+    async def on_idle(group_id: int):
+        fired.append(group_id)
+
+    tracker.add_idle_watcher("test", lambda group_id: 0.1, on_idle)
+    tracker.touch(456)
+    await asyncio.sleep(0.06)
+    tracker.touch(456)
+    await asyncio.sleep(0.06)
+    assert fired == []
+    await asyncio.sleep(0.1)
+    assert fired == [456]
+
+
+@pytest.mark.asyncio
+async def test_stale_activity_fires_immediately(app: App):
+    from nonebot_plugin_real_netizens.activity_tracker import ActivityTracker
+    tracker = ActivityTracker()
+    fired = []
+
+    async def on_idle(group_id: int):
+        fired.append(group_id)
+
+    tracker.touch(789, time.time() - 3600)
+    tracker.add_idle_watcher("test", lambda group_id: 60, on_idle)
+    await asyncio.sleep(0.01)
+    assert fired == [789]
+    assert tracker.get_last_activity(789) is not None
+
+
+@pytest.mark.asyncio
+async def test_threshold_none_skips_group(app: App):
+    from nonebot_plugin_real_netizens.activity_tracker import ActivityTracker
+    tracker = ActivityTracker()
+    fired = []
+
+    async def on_idle(group_id: int):
+        fired.append(group_id)
+
+    # 载入的历史群组中只有阈值不为 None 的群组设置定时器
+    tracker.touch(1, time.time() - 3600)
+    tracker.touch(2, time.time() - 3600)
+    tracker.add_idle_watcher("test", lambda group_id: 60 if group_id == 1 else None, on_idle)
+    await asyncio.sleep(0.01)
+    assert fired == [1]
+    assert list(tracker.watchers["test"].timers) == []
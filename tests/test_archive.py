@@ -0,0 +1,25 @@
+# tests\test_archive.py
+from datetime import date, datetime, timezone
+
+import pytest
+from nonebug import App
+
+
+@pytest.mark.asyncio
+async def test_archive_round_trip(app: App):
+    from nonebot_plugin_real_netizens.db.archive import decode_archive, encode_messages
+    from nonebot_plugin_real_netizens.db.models import Message, MessageArchive
+    timestamp = datetime(2024, 5, 1, 12, 30)
+    messages = [
+        Message(id=1, group_id=10, user_id=100, content="早上好", timestamp=timestamp),
+        Message(id=2, group_id=10, user_id=101, content="今天吃什么？", timestamp=timestamp),
+    ]
+    archive = MessageArchive(
+        group_id=10, day=date(2024, 5, 1), first_message_id=1, last_message_id=2,
+        message_count=2, codec="zlib", data=encode_messages(messages, "zlib", 6))
+    decoded = decode_archive(archive)
+    assert [message["id"] for message in decoded] == [1, 2]
+    assert decoded[1]["content"] == "今天吃什么？"
+    assert decoded[0]["group_id"] == 10
+    # 不带时区的时间按 UTC 处理
+    assert decoded[0]["timestamp"] == timestamp.replace(tzinfo=timezone.utc)
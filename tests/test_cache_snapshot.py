@@ -0,0 +1,38 @@
+# tests\test_cache_snapshot.py
+import pytest
+from nonebug import App
+
+
+@pytest.mark.asyncio
+async def test_snapshot_round_trip(app: App, tmp_path):
+    from nonebot_plugin_real_netizens.cache_snapshot import CacheSnapshot
+    snapshot = CacheSnapshot(str(tmp_path / "snapshot.bin"))
+    cache = {123: [{"role": "user", "content": "你好"}]}
+    restored = {}
+
+    async def load(data):
+        restored.update(data)
+
+    snapshot.register("messages", lambda: dict(cache), load)
+    assert await snapshot.save() > 0
+    assert await snapshot.restore() == ["messages"]
+    assert restored == cache
+
+
+@pytest.mark.asyncio
+async def test_snapshot_rejects_unknown_or_expired(app: App, tmp_path):
+    from nonebot_plugin_real_netizens.cache_snapshot import CacheSnapshot
+    path = tmp_path / "snapshot.bin"
+    snapshot = CacheSnapshot(str(path))
+
+    async def load(data):
+        raise AssertionError("should not restore")
+
+    snapshot.register("messages", lambda: {"a": 1}, load)
+    assert await snapshot.restore() == []
+    await snapshot.save()
+    # 过期的快照被忽略
+    assert await snapshot.restore(max_age=1e-9) == []
+    # 格式不符的文件被忽略
+    path.write_bytes(b"garbage")
+    assert await snapshot.restore() == []
@@ -0,0 +1,38 @@
+# tests\test_data_transfer.py
+import gzip
+import json
+from datetime import datetime, timezone
+
+import pytest
+from nonebug import App
+
+
+@pytest.mark.asyncio
+async def test_record_round_trip(app: App):
+    from nonebot_plugin_real_netizens.db.data_transfer import deserialize_record, serialize_row
+    from nonebot_plugin_real_netizens.db.models import Message
+    message = Message(id=7, group_id=10, user_id=100, content="你好",
+                      timestamp=datetime(2024, 5, 1, 12, 30, tzinfo=timezone.utc))
+    record = json.loads(json.dumps(serialize_row("message", Message, message)))
+    assert record["_type"] == "message"
+    row = deserialize_record(Message, record)
+    assert row["id"] == 7
+    assert row["content"] == "你好"
+    # 导入时统一转换为不带时区的 UTC 时间
+    assert row["timestamp"] == datetime(2024, 5, 1, 12, 30)
+
+
+@pytest.mark.asyncio
+async def test_gzip_writer_resumes_at_batch_boundary(app: App, tmp_path):
+    from nonebot_plugin_real_netizens.db.data_transfer import JsonlWriter
+    path = str(tmp_path / "export.jsonl.gz")
+    writer = JsonlWriter(path)
+    offset = writer.write_batch([{"_type": "message", "id": 1}])
+    writer.write_batch([{"_type": "message", "id": 2}])
+    writer.close()
+    # 从第一批之后继续写入，第二批被丢弃并重写
+    writer = JsonlWriter(path, offset)
+    writer.write_batch([{"_type": "message", "id": 3}])
+    writer.close()
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        assert [json.loads(line)["id"] for line in f] == [1, 3]
@@ -0,0 +1,51 @@
+# tests\test_image_batch.py
+import asyncio
+
+import pytest
+from nonebug import App
+
+SINGLE_RESPONSE = '{"description": "鸟", "is_meme": false, "emotion_tag": null}'
+
+
+def _processor(batch_size: int):
+    from nonebot_plugin_real_netizens.config import Config
+    from nonebot_plugin_real_netizens.image_processor import ImageProcessor
+    processor = ImageProcessor(Config())
+    processor.batch_size = batch_size
+    processor.batch_wait = 0.05
+    return processor
+
+
+@pytest.mark.asyncio
+async def test_describe_batches_concurrent_images(app: App, mocker):
+    processor = _processor(3)
+    batch_response = (
+        '[{"index": 1, "description": "猫", "is_meme": true, "emotion_tag": "开心"},'
+        ' {"index": 3, "description": "狗", "is_meme": false, "emotion_tag": null}]'
+    )
+    mock_generate = mocker.patch(
+        "nonebot_plugin_real_netizens.image_processor.llm_generator.generate_response_with_usage",
+        side_effect=[(batch_response, {"total_tokens": 900}), (SINGLE_RESPONSE, {"total_tokens": 400})],
+    )
+    results = await asyncio.gather(*(processor.describe(image) for image in ("img1", "img2", "img3")))
+    assert [result["description"] for result in results] == ["猫", "鸟", "狗"]
+    # 三张图片合并为一次请求，结果中缺失的第二张单独识别
+    assert mock_generate.call_count == 2
+    assert len(mock_generate.call_args_list[0].kwargs["messages"][0]["content"]) == 7
+    stats = processor.stats.summary()
+    assert stats["batch"]["images"] == 2 and stats["batch"]["tokens_per_image"] == 450
+    assert stats["single"]["images"] == 1
+
+
+@pytest.mark.asyncio
+async def test_describe_batch_error_falls_back_to_single(app: App, mocker):
+    processor = _processor(2)
+    mock_generate = mocker.patch(
+        "nonebot_plugin_real_netizens.image_processor.llm_generator.generate_response_with_usage",
+        side_effect=[ConnectionError("reset"), (SINGLE_RESPONSE, {"total_tokens": 400}),
+                     (SINGLE_RESPONSE, {"total_tokens": 400})],
+    )
+    results = await asyncio.gather(*(processor.describe(image) for image in ("img1", "img2")))
+    # 多图请求出错时不抛给调用方，两张图片都单独识别
+    assert [result["description"] for result in results] == ["鸟", "鸟"]
+    assert mock_generate.call_count == 3
@@ -0,0 +1,84 @@
+# tests\test_image_cache.py
+import pytest
+from nonebug import App
+from sqlalchemy.ext.asyncio import create_async_engine
+
+
+@pytest.fixture
+async def engine(app: App, mocker):
+    from nonebot_plugin_real_netizens.db.models import Base
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    mocker.patch("nonebot_plugin_real_netizens.db.unit_of_work.get_engine", return_value=engine)
+    yield engine
+    await engine.dispose()
+
+
+def _image(image_hash: str) -> dict:
+    return {"file_path": f"data/images/{image_hash}.jpg", "file_name": f"{image_hash}.jpg", "hash": image_hash,
+            "description": "一只猫", "is_meme": True, "emotion_tag": "开心"}
+
+
+@pytest.mark.asyncio
+async def test_lru_and_aliases(app: App):
+    from nonebot_plugin_real_netizens.image_cache import ImageCache
+    cache = ImageCache(maxsize=2, negative_ttl=60)
+    cache.put(_image("h1"), "F1.image")
+    cache.put(_image("h2"))
+    assert cache.get("h1")["hash"] == "h1"
+    cache.put(_image("h3"))
+    # h2 最久未使用，被淘汰
+    assert cache.get("h2") is None
+    assert cache.get_by_file_id("F1.image")["hash"] == "h1"
+
+
+@pytest.mark.asyncio
+async def test_negative_cache_expires(app: App, mocker):
+    from nonebot_plugin_real_netizens.image_cache import ImageCache
+    now = mocker.patch("nonebot_plugin_real_netizens.image_cache.time.time", return_value=1000.0)
+    cache = ImageCache(maxsize=10, negative_ttl=60)
+    cache.mark_failed("bad_hash", "BAD.image")
+    assert cache.is_failed("bad_hash") and cache.is_failed("BAD.image")
+    assert not cache.is_failed(None)
+    now.return_value = 1061.0
+    assert not cache.is_failed("bad_hash")
+    # 识别成功后清除失败记录
+    cache.mark_failed("h1")
+    cache.put(_image("h1"))
+    assert not cache.is_failed("h1")
+
+
+@pytest.mark.asyncio
+async def test_snapshot_round_trip(engine):
+    from nonebot_plugin_real_netizens.db.database import add_image_alias, add_image_record
+    from nonebot_plugin_real_netizens.image_cache import ImageCache
+    await add_image_record(_image("h1"))
+    await add_image_alias("F1.image", _image("h1"))
+    cache = ImageCache(maxsize=10, negative_ttl=60)
+    cache.put(_image("h1"), "F1.image")
+    # 快照之后被删除的图片和别名不恢复
+    cache.put(_image("h2"), "F2.image")
+    cache.mark_failed("bad_hash")
+    restored = ImageCache(maxsize=10, negative_ttl=60)
+    await restored.restore(cache.dump())
+    assert restored.get_by_file_id("F1.image") == _image("h1")
+    assert restored.get("h2") is None and restored.get_by_file_id("F2.image") is None
+    assert restored.is_failed("bad_hash")
+
+
+@pytest.mark.asyncio
+async def test_restore_queries_in_batches(engine, mocker):
+    from nonebot_plugin_real_netizens.db.database import add_image_alias, add_image_record
+    from nonebot_plugin_real_netizens.image_cache import ImageCache
+    # 快照中的键分多条语句查询，避免超出 SQLite 的绑定参数上限
+    mocker.patch("nonebot_plugin_real_netizens.db.database.IN_CLAUSE_BATCH", 2)
+    cache = ImageCache(maxsize=10, negative_ttl=60)
+    for index in range(5):
+        image_hash = f"h{index}"
+        await add_image_record(_image(image_hash))
+        await add_image_alias(f"F{index}.image", _image(image_hash))
+        cache.put(_image(image_hash), f"F{index}.image")
+    restored = ImageCache(maxsize=10, negative_ttl=60)
+    await restored.restore(cache.dump())
+    assert all(restored.get_by_file_id(f"F{index}.image") == _image(f"h{index}") for index in range(5))
@@ -0,0 +1,62 @@
+# tests\test_image_captioner.py
+import pytest
+from nonebug import App
+
+HASH_A = "a" * 32
+HASH_B = "b" * 32
+
+
+@pytest.mark.asyncio
+async def test_resolve_captions_referenced_images(app: App, mocker):
+    from nonebot_plugin_real_netizens.image_captioner import UNKNOWN_IMAGE, ImageCaptioner, image_reference
+    records = {
+        HASH_A: {"file_path": "a.jpg", "file_name": "a.jpg", "hash": HASH_A,
+                 "description": None, "is_meme": False, "emotion_tag": None},
+    }
+
+    async def fake_get(image_hash):
+        return records.get(image_hash)
+    mocker.patch("nonebot_plugin_real_netizens.image_captioner.get_image_by_hash", side_effect=fake_get)
+    mock_process = mocker.patch(
+        "nonebot_plugin_real_netizens.image_captioner.image_processor.process_image",
+        return_value=(True, {"description": "一只猫", "is_meme": True, "emotion_tag": "开心"}),
+    )
+    mock_save = mocker.patch("nonebot_plugin_real_netizens.image_captioner.set_image_description")
+    mocker.patch("nonebot_plugin_real_netizens.image_captioner.use_session")
+    captioner = ImageCaptioner(mode="lazy", idle_seconds=60, interval=0, timeout=5)
+    captioner.enqueue(HASH_A, "a.jpg")
+    text = f"看{image_reference(HASH_A)}和{image_reference(HASH_A)}，还有{image_reference(HASH_B)}"
+    resolved = await captioner.resolve(text)
+    # 同一图片只识别一次，没有记录的图片不附带描述
+    assert resolved == f"看[图片描述: 一只猫][表情包情绪: 开心]和[图片描述: 一只猫][表情包情绪: 开心]，还有{UNKNOWN_IMAGE}"
+    mock_process.assert_called_once_with("a.jpg", HASH_A)
+    assert mock_save.call_args.args[1]["description"] == "一只猫"
+    assert HASH_A not in captioner.pending
+    # 不含引用的文本原样返回
+    assert await captioner.resolve("你好") == "你好"
+
+
+@pytest.mark.asyncio
+async def test_observers_notified_after_caption(app: App, mocker):
+    import asyncio
+    from nonebot_plugin_real_netizens.image_captioner import ImageCaptioner
+    mocker.patch(
+        "nonebot_plugin_real_netizens.image_captioner.get_image_by_hash",
+        return_value={"file_path": "a.jpg", "file_name": "a.jpg", "hash": HASH_A,
+                      "description": None, "is_meme": False, "emotion_tag": None},
+    )
+    mocker.patch(
+        "nonebot_plugin_real_netizens.image_captioner.image_processor.process_image",
+        return_value=(True, {"description": "一只猫", "is_meme": False, "emotion_tag": None}),
+    )
+    mocker.patch("nonebot_plugin_real_netizens.image_captioner.set_image_description")
+    mocker.patch("nonebot_plugin_real_netizens.image_captioner.use_session")
+    captioner = ImageCaptioner(mode="lazy", idle_seconds=60, interval=0, timeout=5)
+    captioned = asyncio.Queue()
+    captioner.register_observer(captioned.put)
+    # 后台任务启动前登记图片不需要事件循环中的唤醒事件
+    captioner.enqueue(HASH_A, "a.jpg")
+    assert (await captioner.caption(HASH_A))["description"] == "一只猫"
+    # 描述写入后在后台通知观察者，由其改写引用该图片的消息
+    image_info = await asyncio.wait_for(captioned.get(), 1)
+    assert image_info["hash"] == HASH_A and image_info["description"] == "一只猫"
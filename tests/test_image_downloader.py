@@ -0,0 +1,81 @@
+# tests\test_image_downloader.py
+import hashlib
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from nonebug import App
+
+IMAGE_DATA = b"\x89PNG\r\n\x1a\n" + b"\x00" * 4096
+
+
+@pytest.fixture
+async def image_server():
+    requests = []
+
+    async def image(request: web.Request):
+        requests.append(request.path)
+        return web.Response(body=IMAGE_DATA, content_type="image/png")
+
+    async def page(request: web.Request):
+        requests.append(request.path)
+        return web.Response(text="<html></html>", content_type="text/html")
+
+    app = web.Application()
+    app.router.add_get("/image.png", image)
+    app.router.add_get("/page.html", page)
+    server = TestServer(app)
+    await server.start_server()
+    server.requests = requests
+    yield server
+    await server.close()
+
+
+@pytest.mark.asyncio
+async def test_fetch_hashes_while_downloading(app: App, image_server):
+    from nonebot_plugin_real_netizens.image_downloader import ImageDownloader
+    downloader = ImageDownloader(max_bytes=1 << 20, timeout=5, limit=4, limit_per_host=2)
+    try:
+        result = await downloader.fetch(str(image_server.make_url("/image.png")))
+        assert result.data == IMAGE_DATA
+        assert result.hash == hashlib.md5(IMAGE_DATA).hexdigest()
+    finally:
+        await downloader.close()
+
+
+@pytest.mark.asyncio
+async def test_fetch_rejects_oversized_and_non_image(app: App, image_server):
+    from nonebot_plugin_real_netizens.image_downloader import ImageDownloader, ImageDownloadError
+    downloader = ImageDownloader(max_bytes=1024, timeout=5, limit=4, limit_per_host=2)
+    try:
+        with pytest.raises(ImageDownloadError):
+            await downloader.fetch(str(image_server.make_url("/image.png")))
+        downloader.max_bytes = 1 << 20
+        with pytest.raises(ImageDownloadError):
+            await downloader.fetch(str(image_server.make_url("/page.html")))
+    finally:
+        await downloader.close()
+
+
+@pytest.mark.asyncio
+async def test_fetch_short_circuits_on_known_hash(app: App, image_server):
+    from nonebot_plugin_real_netizens.image_downloader import ImageDownloader
+    downloader = ImageDownloader(max_bytes=1 << 20, timeout=5, limit=4, limit_per_host=2)
+    md5 = hashlib.md5(IMAGE_DATA).hexdigest()
+
+    async def lookup(image_hash: str):
+        return {"hash": image_hash} if image_hash == md5 else None
+
+    try:
+        # 文件名中带有 MD5 时不发起请求
+        result = await downloader.fetch(
+            str(image_server.make_url("/image.png")), lookup=lookup, hint=f"{md5.upper()}.image")
+        assert result.cached == {"hash": md5}
+        assert result.data is None
+        assert image_server.requests == []
+        # 否则下载完成后按内容哈希命中
+        result = await downloader.fetch(str(image_server.make_url("/image.png")), lookup=lookup)
+        assert result.cached == {"hash": md5}
+        assert image_server.requests == ["/image.png"]
+    finally:
+        await downloader.close()
@@ -0,0 +1,81 @@
+# tests\test_image_encoder.py
+import base64
+import random
+from io import BytesIO
+
+from PIL import Image, ImageDraw
+
+
+def _encode(image: Image.Image, image_format: str = "PNG") -> bytes:
+    buffer = BytesIO()
+    image.save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+def _screenshot() -> Image.Image:
+    image = Image.new("RGB", (1080, 2340), (245, 245, 245))
+    draw = ImageDraw.Draw(image)
+    for top in range(100, 2200, 120):
+        draw.rectangle((40, top, 900, top + 60), fill=(255, 255, 255))
+        draw.text((60, top + 20), "see you at 9pm, bring snacks", fill=(0, 0, 0))
+    return image
+
+
+def _photo() -> Image.Image:
+    rng = random.Random(0)
+    return Image.frombytes("RGB", (1600, 1200), bytes(rng.getrandbits(8) for _ in range(1600 * 1200 * 3)))
+
+
+def test_estimate_tokens():
+    from nonebot_plugin_real_netizens.image_encoder import estimate_tokens, model_image_cost
+    # 28 像素方块：512x512 需要 19x19 个方块
+    assert estimate_tokens(model_image_cost("qwen2-vl-7b"), 512, 512) == 19 * 19 + 2
+    # OpenAI 瓦片：短边缩放到 768 后为 768x768，共 4 块
+    assert estimate_tokens(model_image_cost("gpt-4o-mini"), 1024, 1024) == 85 + 170 * 4
+    assert estimate_tokens(model_image_cost("gemini-1.5-flash"), 4000, 3000) == 258
+
+
+def test_encode_adaptive_by_kind():
+    from nonebot_plugin_real_netizens.image_encoder import encode_adaptive
+    formats = ["JPEG", "PNG", "GIF", "WEBP", "BMP"]
+    sticker = encode_adaptive(_encode(Image.new("RGBA", (240, 240), (255, 0, 0, 128))), "qwen2-vl-7b", 512, formats)
+    assert sticker.kind == "sticker"
+    assert max(sticker.size) <= 256 and sticker.tokens <= 120
+
+    screenshot = encode_adaptive(_encode(_screenshot()), "qwen2-vl-7b", 512, formats)
+    assert screenshot.kind == "screenshot"
+    assert screenshot.mime == "image/webp"
+    # 截图保留比照片更高的分辨率以便识别文字
+    assert max(screenshot.size) > 512 and screenshot.tokens <= 1500
+
+    photo = encode_adaptive(_encode(_photo(), "JPEG"), "qwen2-vl-7b", 512, formats)
+    assert photo.kind == "photo"
+    assert photo.mime == "image/jpeg"
+    assert photo.tokens <= photo.baseline_tokens and photo.bytes_out < photo.bytes_in
+    with Image.open(BytesIO(base64.b64decode(photo.data))) as decoded:
+        assert decoded.size == photo.size
+
+    # 未知模型只发送 JPEG
+    assert encode_adaptive(_encode(_screenshot()), "some-vl-model", 512, formats).mime == "image/jpeg"
+
+
+def test_fit_budget_stops_at_minimum_cost():
+    from nonebot_plugin_real_netizens.image_encoder import estimate_tokens, fit_budget, fit_size, model_image_cost
+    # 固定计费的模型缩小不减少 token，表情包保持原尺寸
+    assert fit_budget(240, 240, 256, 120, model_image_cost("gemini-1.5-flash")) == 240
+    # OpenAI 至少一块瓦片，一块瓦片以内的表情包不再缩小
+    gpt = model_image_cost("gpt-4o-mini")
+    assert fit_budget(240, 240, 256, 120, gpt) == 240
+    assert fit_budget(800, 600, 256, 120, gpt) == 256
+    # 超过最低 token 数的预算仍然生效
+    size = fit_budget(1024, 1024, 1024, 450, gpt)
+    assert 64 < size < 1024 and estimate_tokens(gpt, *fit_size(1024, 1024, size)) <= 450
+
+
+def test_encode_sticker_for_fixed_cost_model():
+    from nonebot_plugin_real_netizens.image_encoder import encode_adaptive
+    formats = ["JPEG", "PNG", "GIF", "WEBP", "BMP"]
+    sticker = encode_adaptive(_encode(Image.new("RGBA", (240, 240), (255, 0, 0, 128))), "gemini-1.5-flash",
+                              512, formats)
+    assert sticker.kind == "sticker"
+    assert sticker.size == (240, 240) and sticker.tokens == 258
@@ -0,0 +1,46 @@
+# tests\test_image_index.py
+import os
+import random
+from io import BytesIO
+
+import imagehash
+import pytest
+from nonebug import App
+from PIL import Image
+
+TEST_JPG_PATH = os.path.join(os.path.dirname(__file__), "jpgtest.jpg")
+TEST_PNG_PATH = os.path.join(os.path.dirname(__file__), "pngtest.png")
+
+
+@pytest.mark.asyncio
+async def test_multi_index_hash_matches_brute_force(app: App):
+    from nonebot_plugin_real_netizens.image_index import MultiIndexHash, hamming_distance
+    rng = random.Random(0)
+    values = [rng.getrandbits(64) for _ in range(2000)]
+    table = MultiIndexHash(4)
+    for index, value in enumerate(values):
+        table.add(value, str(index))
+    for value in values[:50]:
+        query = value ^ (1 << rng.randrange(64)) ^ (1 << rng.randrange(64))
+        expected = sorted(
+            (hamming_distance(query, other), str(index))
+            for index, other in enumerate(values)
+            if hamming_distance(query, other) <= 4
+        )
+        assert table.search(query) == expected
+
+
+@pytest.mark.asyncio
+async def test_recompressed_image_is_near_duplicate(app: App):
+    from nonebot_plugin_real_netizens.image_index import ImageIndex
+    index = ImageIndex(threshold=4)
+    with Image.open(TEST_JPG_PATH) as image:
+        index.add(str(imagehash.phash(image)), "original")
+        # 模拟 QQ 缩小并重新压缩后的同一张图片
+        buffer = BytesIO()
+        image.convert("RGB").resize((image.width // 2, image.height // 2)).save(buffer, format="JPEG", quality=40)
+    with Image.open(buffer) as recompressed:
+        match = index.find_similar(str(imagehash.phash(recompressed)))
+    assert match is not None and match[0] == "original"
+    with Image.open(TEST_PNG_PATH) as other:
+        assert index.find_similar(str(imagehash.phash(other))) is None
@@ -1,11 +1,13 @@
 # tests/test_image_processor.py
 import asyncio
+import base64
 import os
+from io import BytesIO
 from typing import Dict
 import pytest
 from PIL import Image
 from nonebot import get_driver
-from nonebot_plugin_real_netizens.image_processor import ImageProcessor
+from nonebot_plugin_real_netizens.image_processor import ImageProcessor, _prepare_base64
 from nonebot_plugin_real_netizens.config import Config  # 导入插件的 Config
 
 # 测试图片路径，使用绝对路径
@@ -117,3 +119,25 @@ async def test_generate_image_description():
         print(f"状态码: {png_description['status_code']}")
     else:
         print(f"PNG 描述: {png_description}")
+
+
+def test_prepare_base64():
+    formats = image_processor.supported_formats
+
+    # 尺寸足够小的 JPEG 直接复用原始数据
+    with open(TEST_JPG_PATH, "rb") as f:
+        jpg_data = f.read()
+    with Image.open(BytesIO(jpg_data)) as jpg_image:
+        small_enough = max(jpg_image.size) <= image_processor.max_size
+    if small_enough:
+        assert base64.b64decode(_prepare_base64(jpg_data, image_processor.max_size, formats)) == jpg_data
+
+    # 其余图片只编码一次，缩放到 max_size 以内，透明背景合成为白色
+    with open(TEST_PNG_PATH, "rb") as f:
+        png_data = f.read()
+    encoded = _prepare_base64(png_data, image_processor.max_size, formats)
+    with Image.open(BytesIO(base64.b64decode(encoded))) as png_image:
+        assert png_image.format == "JPEG"
+        assert png_image.mode == "RGB"
+        assert max(png_image.size) <= image_processor.max_size
+
@@ -0,0 +1,37 @@
+# tests\test_image_worker.py
+import threading
+import time
+
+import pytest
+from nonebug import App
+
+
+def _square(value: int) -> int:
+    return value * value
+
+
+@pytest.mark.asyncio
+async def test_run_in_pool(app: App):
+    from nonebot_plugin_real_netizens.image_worker import ImageWorkerPool
+    pool = ImageWorkerPool(max_workers=2, max_pending=2, timeout=5)
+    try:
+        assert await pool.run(_square, 7) == 49
+        assert await pool.run(threading.get_ident) != threading.get_ident()
+    finally:
+        pool.shutdown(wait=True)
+
+
+@pytest.mark.asyncio
+async def test_job_timeout_keeps_slot_until_done(app: App):
+    from nonebot_plugin_real_netizens.image_worker import ImageJobTimeout, ImageWorkerPool
+    pool = ImageWorkerPool(max_workers=1, max_pending=1, timeout=0.1)
+    try:
+        with pytest.raises(ImageJobTimeout):
+            await pool.run(time.sleep, 0.5)
+        # 超时的任务仍在执行，队列已满，新任务排队超时
+        with pytest.raises(ImageJobTimeout):
+            await pool.run(_square, 2)
+        # 前一个任务结束后名额释放
+        assert await pool.run(_square, 3, timeout=2) == 9
+    finally:
+        pool.shutdown(wait=True)
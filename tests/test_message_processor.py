@@ -41,7 +41,10 @@ async def test_process_message(app: App, group_message_event: GroupMessageEvent,
     # 验证依赖函数被调用
     mock_llm_generator.generate_response.assert_called_once()
 @pytest.mark.asyncio
-async def test_process_message_content(app: App, processor, mock_image):
+async def test_process_message_content(app: App, processor, mock_image, mocker):
+    from nonebot_plugin_real_netizens.message_processor import image_captioner
+    # 收到图片时立即识别
+    mocker.patch.object(image_captioner, "mode", "eager")
     # 测试纯文本消息
     message = Message("Hello, world!")
     full_content, image_descriptions = await processor.process_message_content(message)
@@ -79,28 +82,32 @@ async def test_process_message_with_empty_content(
     assert result == ""
 @pytest.mark.asyncio
 async def test_download_and_process_image(app: App, processor, mocker):
-    # 模拟 aiohttp.ClientSession
-    mock_session = mocker.AsyncMock()
-    mock_response = mocker.AsyncMock()
-    mock_response.status = 200
-    mock_response.read.return_value = b"fake_image_data"
-    mock_session.get.return_value.__aenter__.return_value = mock_response
-    mocker.patch("aiohttp.ClientSession", return_value=mock_session)
-    # 模拟 image_processor
-    mock_image_processor = mocker.patch(
-        "nonebot_plugin_real_netizens.message_processor.image_processor"
+    from nonebot_plugin_real_netizens.image_downloader import DownloadResult
+    from nonebot_plugin_real_netizens.message_processor import image_captioner, image_index, image_processor
+    # 模拟共享的图片下载器
+    mock_fetch = mocker.patch(
+        "nonebot_plugin_real_netizens.message_processor.image_downloader.fetch",
+        return_value=DownloadResult("fake_hash", b"fake_image_data"),
     )
-    mock_image_processor.process_image.return_value = (
-        True,
-        {
-            "description": "A test image",
-            "is_meme": False,
-            "emotion_tag": None,
-        },
+    # 收到图片时立即识别，不查找近似重复的图片
+    mocker.patch.object(image_captioner, "mode", "eager")
+    mocker.patch.object(image_index, "threshold", -1)
+    # 模拟 image_processor 的异步方法
+    mock_process_image_data = mocker.patch.object(
+        image_processor, "process_image_data", new_callable=mocker.AsyncMock, return_value=(
+            True,
+            {
+                "description": "A test image",
+                "is_meme": False,
+                "emotion_tag": None,
+            },
+        )
     )
-    # 模拟 add_image_record
+    mock_save_image = mocker.patch.object(image_processor, "save_image", new_callable=mocker.AsyncMock)
+    # 模拟 add_image_record，返回写入的记录
     mock_add_image_record = mocker.patch(
-        "nonebot_plugin_real_netizens.message_processor.add_image_record"
+        "nonebot_plugin_real_netizens.message_processor.add_image_record", new_callable=mocker.AsyncMock,
+        side_effect=lambda image_info: image_info,
     )
     # 调用待测试函数
     image_info = await processor.download_and_process_image(
@@ -112,15 +119,32 @@ async def test_download_and_process_image(app: App, processor, mocker):
     assert image_info["is_meme"] is False
     assert image_info["emotion_tag"] is None
     # 验证依赖函数被调用
-    mock_session.get.assert_called_once_with("http://test.com/image.jpg")
-    mock_image_processor.process_image.assert_called_once()
-    mock_add_image_record.assert_called_once()
+    assert mock_fetch.call_args.args[0] == "http://test.com/image.jpg"
+    mock_process_image_data.assert_awaited_once_with(b"fake_image_data", "fake_hash")
+    mock_add_image_record.assert_awaited_once()
+    mock_save_image.assert_not_awaited()
+@pytest.mark.asyncio
+async def test_download_and_process_image_cached(app: App, processor, mocker):
+    from nonebot_plugin_real_netizens.image_downloader import DownloadResult
+    cached = {"description": "A cached image", "is_meme": False, "emotion_tag": None}
+    mocker.patch(
+        "nonebot_plugin_real_netizens.message_processor.image_downloader.fetch",
+        return_value=DownloadResult("cached_hash", cached=cached),
+    )
+    mock_image_processor = mocker.patch(
+        "nonebot_plugin_real_netizens.message_processor.image_processor"
+    )
+    # 已识别过的图片不再识别
+    assert await processor.download_and_process_image("http://test.com/image.jpg") == cached
+    mock_image_processor.process_image_data.assert_not_called()
 @pytest.mark.asyncio
 async def test_download_and_process_image_error(app: App, processor, mocker):
-    # 模拟 aiohttp.ClientSession 抛出异常
-    mock_session = mocker.AsyncMock()
-    mock_session.get.side_effect = Exception("Network error")
-    mocker.patch("aiohttp.ClientSession", return_value=mock_session)
+    from nonebot_plugin_real_netizens.image_downloader import ImageDownloadError
+    # 模拟下载器抛出异常
+    mocker.patch(
+        "nonebot_plugin_real_netizens.message_processor.image_downloader.fetch",
+        side_effect=ImageDownloadError("Network error"),
+    )
     # 模拟 logger
     mock_logger = mocker.patch(
         "nonebot_plugin_real_netizens.message_processor.logger"
@@ -132,4 +156,60 @@ async def test_download_and_process_image_error(app: App, processor, mocker):
     # 断言
     assert image_info is None
     mock_logger.error.assert_called_once()
-
+@pytest.mark.asyncio
+async def test_parse_message_content_deadline(app: App, processor, mocker):
+    import asyncio
+    from nonebot_plugin_real_netizens.message_processor import IMAGE_PLACEHOLDER
+    delays = {"fast.image": 0, "slow.image": 0.3}
+    async def fake_process(url, file_name=None):
+        await asyncio.sleep(delays[file_name])
+        return {"description": file_name, "is_meme": False, "emotion_tag": None}
+    mocker.patch.object(processor, "download_and_process_image", side_effect=fake_process)
+    mock_replace = mocker.patch(
+        "nonebot_plugin_real_netizens.message_processor.memory_manager.replace_message_content"
+    )
+    message = Message("看图[CQ:image,file=slow.image][CQ:image,file=fast.image]")
+    content = await processor.parse_message_content(message, deadline=0.1)
+    # 未完成的图片先用占位符，顺序与消息中一致
+    assert content.render() == f"看图{IMAGE_PLACEHOLDER} [图片描述: fast.image]"
+    assert list(content.pending) == [0]
+    await processor.backfill_message(123, 1, content)
+    mock_replace.assert_called_once_with(
+        123, 1, f"看图{IMAGE_PLACEHOLDER} [图片描述: fast.image]",
+        "看图[图片描述: slow.image] [图片描述: fast.image]")
+@pytest.mark.asyncio
+async def test_same_image_processed_once(app: App, processor, mocker):
+    import asyncio
+    calls = []
+    async def fake_process(url, file_name=None):
+        calls.append(file_name)
+        await asyncio.sleep(0.05)
+        return {"description": file_name, "is_meme": False, "emotion_tag": None}
+    mocker.patch.object(processor, "download_and_process_image", side_effect=fake_process)
+    message = Message("[CQ:image,file=same.image][CQ:image,file=same.image]")
+    # 同一条消息和另一条同时处理的消息中的相同图片只处理一次
+    first, second = await asyncio.gather(
+        processor.parse_message_content(message), processor.parse_message_content(message))
+    assert calls == ["same.image"]
+    assert first.images == second.images == ["[图片描述: same.image]"] * 2
+    assert not processor.inflight
+@pytest.mark.asyncio
+async def test_near_duplicate_reuses_record(app: App, processor, mocker):
+    from nonebot_plugin_real_netizens.message_processor import image_index, image_processor
+    similar = {"file_path": "data/images/old_hash.jpg", "file_name": "old_hash.jpg", "hash": "old_hash",
+               "description": "A cat", "is_meme": True, "emotion_tag": "开心"}
+    mocker.patch.object(image_index, "threshold", 4)
+    mocker.patch.object(image_index, "find_similar", return_value=("old_hash", 3))
+    mocker.patch.object(image_processor, "perceptual_hash", new_callable=mocker.AsyncMock, return_value="ffff0000ffff0000")
+    mock_process_image_data = mocker.patch.object(image_processor, "process_image_data", new_callable=mocker.AsyncMock)
+    mocker.patch(
+        "nonebot_plugin_real_netizens.message_processor.get_image_by_hash",
+        new_callable=mocker.AsyncMock, return_value=similar,
+    )
+    mock_add_image_record = mocker.patch(
+        "nonebot_plugin_real_netizens.message_processor.add_image_record", new_callable=mocker.AsyncMock
+    )
+    # 近似重复的图片直接使用相似图片的记录，不另建指向未保存文件的记录
+    assert await processor.process_new_image(b"new_image_data", "new_hash") == similar
+    mock_process_image_data.assert_not_awaited()
+    mock_add_image_record.assert_not_awaited()
@@ -0,0 +1,116 @@
+# tests\test_semantic_memory.py
+import numpy as np
+import pytest
+from nonebug import App
+
+
+@pytest.mark.asyncio
+async def test_hashing_vectorizer(app: App):
+    from nonebot_plugin_real_netizens.semantic_memory import HashingVectorizer
+    vectorizer = HashingVectorizer(dim=256)
+    vector = vectorizer.transform("今天一起去吃火锅吧")
+    assert vector.shape == (256,)
+    assert vector.dtype == np.float32
+    assert np.isclose(np.linalg.norm(vector), 1.0)
+    # 相同文本得到相同向量，空文本得到零向量
+    assert np.array_equal(vector, vectorizer.transform("今天一起去吃火锅吧"))
+    assert not vectorizer.transform("").any()
+
+
+@pytest.mark.asyncio
+async def test_semantic_memory_search(app: App, tmp_path):
+    from nonebot_plugin_real_netizens.semantic_memory import SemanticMemory
+    memory = SemanticMemory(str(tmp_path), dim=256)
+    memory.add_messages(1, [
+        (1, "原神新版本的角色好强"),
+        (2, "学校食堂太难吃了"),
+        (3, "周末有人一起去爬山吗"),
+    ])
+    hits = memory.search(1, "原神更新了", k=2)
+    assert hits[0][0] == 1
+    assert len(hits) == 2
+    assert hits[0][1] >= hits[1][1]
+    # 其他群组的索引互不影响
+    assert memory.search(2, "原神更新了", k=2) == []
+
+
+@pytest.mark.asyncio
+async def test_semantic_index_persists(app: App, tmp_path):
+    from nonebot_plugin_real_netizens.semantic_memory import SemanticMemory
+    memory = SemanticMemory(str(tmp_path), dim=128)
+    memory.add_messages(1, [(10, "第一条消息"), (11, "第二条消息")])
+    memory.add_messages(1, [(12, "第三条消息")])
+    reloaded = SemanticMemory(str(tmp_path), dim=128)
+    index = reloaded.get_index(1)
+    assert index.count == 3
+    assert index.last_id == 12
+    assert reloaded.search(1, "第三条消息", k=1)[0][0] == 12
+
+
+@pytest.mark.asyncio
+async def test_semantic_index_appends_after_search(app: App, tmp_path):
+    from nonebot_plugin_real_netizens.semantic_memory import SemanticMemory
+    memory = SemanticMemory(str(tmp_path), dim=128)
+    memory.add_messages(1, [(1, "原神新版本的角色好强")])
+    assert memory.search(1, "原神", k=1)[0][0] == 1
+    index = memory.get_index(1)
+    matrix = index._matrix
+    memory.add_messages(1, [(2, "周末有人一起去爬山吗")])
+    # 已映射的矩阵不重新读取，新消息可以立即检索到
+    assert index._matrix is matrix
+    assert memory.search(1, "一起去爬山", k=1)[0][0] == 2
+    assert index.last_id == 2
+
+
+@pytest.mark.asyncio
+async def test_semantic_index_prune(app: App, tmp_path):
+    from nonebot_plugin_real_netizens.semantic_memory import SemanticMemory
+    memory = SemanticMemory(str(tmp_path), dim=128)
+    memory.add_messages(1, [(message_id, f"第{message_id}条消息") for message_id in range(1, 11)])
+    assert memory.indexed_groups() == [1]
+    # 删除的消息不再命中，超过比例后从文件中移除
+    assert memory.prune(1, 6) == 5
+    assert all(message_id >= 6 for message_id, _ in memory.search(1, "消息", k=10))
+    reloaded = SemanticMemory(str(tmp_path), dim=128)
+    assert reloaded.get_index(1).count == 5
+    assert reloaded.search(1, "第8条消息", k=1)[0][0] == 8
+
+
+@pytest.mark.asyncio
+async def test_semantic_index_replace(app: App, tmp_path):
+    from nonebot_plugin_real_netizens.semantic_memory import SemanticMemory
+    memory = SemanticMemory(str(tmp_path), dim=128)
+    memory.add_messages(1, [(1, "看图[图片: 识别中]"), (2, "今天吃什么")])
+    memory.search(1, "吃什么", k=1)
+    memory.add_messages(1, [(3, "再看一张[图片: 识别中]")])
+    # 已映射的行和尾部数组中的行都原位替换
+    assert memory.replace_messages(1, [(1, "看图[图片描述: 一只橘猫]"), (3, "再看一张[图片描述: 海边日落]"),
+                                       (4, "未索引的消息")]) == 2
+    assert memory.search(1, "橘猫", k=1)[0][0] == 1
+    assert memory.search(1, "海边日落", k=1)[0][0] == 3
+    reloaded = SemanticMemory(str(tmp_path), dim=128)
+    assert reloaded.get_index(1).count == 3
+    assert reloaded.search(1, "海边日落", k=1)[0][0] == 3
+
+
+@pytest.mark.asyncio
+async def test_semantic_index_concurrent_adds(app: App, tmp_path, mocker):
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    from nonebot_plugin_real_netizens.semantic_memory import SemanticIndex, SemanticMemory
+    load_count = SemanticIndex._load_count
+
+    def slow_load_count(self):
+        # 放大创建索引对象的耗时，让多个线程同时进入创建过程
+        time.sleep(0.05)
+        return load_count(self)
+    mocker.patch.object(SemanticIndex, "_load_count", autospec=True, side_effect=slow_load_count)
+    memory = SemanticMemory(str(tmp_path), dim=128)
+    # 新群组的第一批消息在多个线程中同时写入，只创建一个索引对象
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda message_id: memory.add_messages(1, [(message_id, f"第{message_id}条消息")]),
+                          range(1, 65)))
+    assert memory.get_index(1).count == 64
+    reloaded = SemanticMemory(str(tmp_path), dim=128)
+    assert reloaded.get_index(1).count == 64
+    assert sorted(message_id for message_id, _ in reloaded.search(1, "消息", k=64)) == list(range(1, 65))
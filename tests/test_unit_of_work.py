@@ -0,0 +1,111 @@
+# tests\test_unit_of_work.py
+import pytest
+from nonebug import App
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import create_async_engine
+
+
+@pytest.fixture
+async def engine(app: App, mocker):
+    from nonebot_plugin_real_netizens.db.models import Base
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    mocker.patch("nonebot_plugin_real_netizens.db.unit_of_work.get_engine", return_value=engine)
+    yield engine
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_event_scope_shares_session_and_commits_once(engine):
+    from nonebot_plugin_real_netizens.db.database import add_message
+    from nonebot_plugin_real_netizens.db.models import Message
+    from nonebot_plugin_real_netizens.db.unit_of_work import event_scope, use_session
+    async with event_scope() as unit:
+        commit = unit.session.commit
+        commits = []
+
+        async def counting_commit():
+            commits.append(1)
+            await commit()
+
+        unit.session.commit = counting_commit
+        async with use_session() as session:
+            assert session is unit.session
+            first = await add_message(session, 1, 10, "你好")
+        async with use_session() as session:
+            second = await add_message(session, 1, 11, "在吗")
+            # 未提交的写入在同一工作单元内可见
+            count = (await session.execute(select(func.count(Message.id)))).scalar()
+        assert first.id and second.id
+        assert count == 2
+        assert commits == []
+    assert commits == [1]
+    async with use_session() as session:
+        assert (await session.execute(select(func.count(Message.id)))).scalar() == 2
+
+
+@pytest.mark.asyncio
+async def test_event_scope_rolls_back_on_error(engine):
+    from nonebot_plugin_real_netizens.db.database import add_message
+    from nonebot_plugin_real_netizens.db.models import Message
+    from nonebot_plugin_real_netizens.db.unit_of_work import current_unit, event_scope, use_session
+    with pytest.raises(RuntimeError):
+        async with event_scope() as unit:
+            await add_message(unit.session, 1, 10, "你好")
+            raise RuntimeError
+    assert current_unit() is None
+    async with use_session() as session:
+        assert (await session.execute(select(func.count(Message.id)))).scalar() == 0
+
+
+@pytest.mark.asyncio
+async def test_image_lookup_reads_own_writes(engine):
+    from nonebot_plugin_real_netizens.db.database import add_image_record, get_image_by_hash
+    from nonebot_plugin_real_netizens.db.unit_of_work import event_scope
+    image_info = {
+        "file_path": "data/images/abc.jpg",
+        "file_name": "abc.jpg",
+        "hash": "abc",
+        "description": "一只猫",
+        "is_meme": False,
+        "emotion_tag": None,
+    }
+    async with event_scope():
+        assert await get_image_by_hash("abc") is None
+        await add_image_record(image_info)
+        assert await get_image_by_hash("abc") == image_info
+    assert (await get_image_by_hash("abc"))["description"] == "一只猫"
+
+
+@pytest.mark.asyncio
+async def test_image_alias_deferred_until_commit(engine):
+    from nonebot_plugin_real_netizens.db.database import (
+        add_image_alias,
+        add_image_record,
+        get_image_by_file_id,
+    )
+    from nonebot_plugin_real_netizens.db.unit_of_work import event_scope
+    image_info = {"file_path": "data/images/h1.jpg", "file_name": "h1.jpg", "hash": "h1",
+                  "description": "一只猫", "is_meme": True, "emotion_tag": "开心"}
+    async with event_scope() as unit:
+        await add_image_record(image_info)
+        await add_image_alias("ABCDEF.image", image_info)
+        # 图片和别名的写入都推迟到提交时执行，不提前占用写锁
+        assert len(unit.pending) == 2
+        assert await get_image_by_file_id("ABCDEF.image") == image_info
+    assert await get_image_by_file_id("ABCDEF.image") == image_info
+    assert await get_image_by_file_id("unknown.image") is None
+
+
+@pytest.mark.asyncio
+async def test_duplicate_image_record_keeps_first(engine):
+    from nonebot_plugin_real_netizens.db.database import add_image_record, get_image_by_hash
+    from nonebot_plugin_real_netizens.image_cache import image_cache
+    image_info = {"file_path": "data/images/h1.jpg", "file_name": "h1.jpg", "hash": "h1",
+                  "description": "一只猫", "is_meme": False, "emotion_tag": None}
+    assert await add_image_record(image_info) == image_info
+    # 同一图片被并发识别时，后写入的一方得到先写入的记录，不因唯一约束失败
+    assert (await add_image_record(dict(image_info, description="一只狗")))["description"] == "一只猫"
+    image_cache.images.clear()
+    assert (await get_image_by_hash("h1"))["description"] == "一只猫"